@@ -0,0 +1,228 @@
+#    A stand-in for the Zenfolio API, for the tests
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+# FakeZenfolio serves, on a local port, just enough of the Zenfolio API
+# for the commands to log in, read the hierarchy and galleries, create
+# groups and galleries, upload and delete photos, and download originals
+# (with Range requests), so that they can be tested with --nossl --host
+# 127.0.0.1:PORT and no network.  Any password is accepted.
+
+import BaseHTTPServer
+import SocketServer
+import json
+import threading
+import urlparse
+
+class FakeZenfolio:
+    """
+    A stand-in Zenfolio server, run in a thread.
+
+    Attributes:
+    host: "127.0.0.1:PORT", for --host.
+    calls: list of the API methods called (and "Upload" for uploads),
+        in order.
+    lock: held while a request is answered.
+    """
+
+    def __init__(self):
+        self._next_id = 100
+        self._photosets = {}
+        self._originals = {}
+        self.root = self._element("Group", "root", Elements=[])
+        self.calls = []
+        self.lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.fake = self
+        self.host = "127.0.0.1:{:d}".format(self._server.server_address[1])
+        self._thread = None
+
+    def _element(self, etype, title, **fields):
+        self._next_id += 1
+        element = {'$type': etype, 'Id': self._next_id, 'Title': title}
+        element.update(fields)
+        return element
+
+    def add_group(self, parent, title):
+        """
+        Add a group to a group (self.root, for example) and return it.
+        """
+        group = self._element("Group", title, Elements=[])
+        parent['Elements'].append(group)
+        return group
+
+    def add_gallery(self, parent, title):
+        """
+        Add an empty gallery to a group and return its element.
+        """
+        gallery = self._element("PhotoSet", title, Type="Gallery",
+                                PhotoCount=0)
+        gallery['UploadUrl'] = "http://{:s}/upload/{:d}".format(
+            self.host, gallery['Id'])
+        parent['Elements'].append(gallery)
+        self._photosets[gallery['Id']] = []
+        return gallery
+
+    def add_photo(self, gallery, filename, data):
+        """
+        Add a photo with the given file name and contents to a gallery
+        and return it.
+        """
+        photo = self._element("Photo", filename, FileName=filename,
+                              Size=len(data))
+        photo['OriginalUrl'] = "http://{:s}/original/{:d}".format(
+            self.host, photo['Id'])
+        self._originals[photo['Id']] = data
+        self._photosets[gallery['Id']].append(photo)
+        gallery['PhotoCount'] += 1
+        return photo
+
+    def photos(self, gallery):
+        """
+        Get the photos in a gallery, in order.
+        """
+        return self._photosets[gallery['Id']]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def call(self, method, params):
+        """
+        Answer an API call; returns the result.  Unknown methods and
+        Ids raise KeyError, which is answered as an API error.
+        """
+        self.calls.append(method)
+        if ( method == "GetChallenge" ):
+            return {'PasswordSalt': [1, 2, 3], 'Challenge': [4, 5, 6]}
+        if ( method in ("Authenticate", "AuthenticatePlain") ):
+            return "TOKEN"
+        if ( method == "LoadGroupHierarchy" ):
+            return self.root
+        if ( method == "LoadPhotoSet" ):
+            element = self._find(params[0])
+            photoset = dict(element)
+            if ( str(params[2]).lower() == "true" ):
+                photoset['Photos'] = self._photosets[params[0]]
+            return photoset
+        if ( method == "LoadPhotoSetPhotos" ):
+            return self._photosets[params[0]][params[1]:params[1] + params[2]]
+        if ( method == "CreateGroup" ):
+            return self.add_group(self._find(params[0]),
+                                  params[1]['Title'])
+        if ( method == "CreatePhotoSet" ):
+            return self.add_gallery(self._find(params[0]),
+                                    params[2]['Title'])
+        if ( method == "DeletePhoto" ):
+            self._delete(params[0])
+            return None
+        raise KeyError(method)
+
+    def upload(self, gallery_id, filename, data):
+        """
+        Answer an upload to a gallery's UploadUrl; returns the new
+        photo.
+        """
+        self.calls.append("Upload")
+        return self.add_photo(self._find(gallery_id), filename,
+                              data)
+
+    def _delete(self, photo_id):
+        for gallery_id, photos in self._photosets.items():
+            for photo in photos:
+                if ( photo['Id'] == photo_id ):
+                    photos.remove(photo)
+                    self._find(gallery_id)['PhotoCount'] -= 1
+                    return
+        raise KeyError(photo_id)
+
+    def _find(self, element_id):
+        elements = [self.root]
+        while ( elements != [] ):
+            element = elements.pop()
+            if ( element['Id'] == element_id ):
+                return element
+            elements.extend(element.get('Elements', []))
+        raise KeyError(element_id)
+
+    def original(self, photo_id):
+        return self._originals[photo_id]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers={}):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        fake = self.server.fake
+        try:
+            data = fake.original(int(self.path.split("/")[-1]))
+        except (KeyError, ValueError):
+            self._send(404, "")
+            return
+        start = 0
+        status = 200
+        if ( self.headers.get("Range") ):
+            start = int(self.headers["Range"].split("=")[1].split("-")[0])
+            status = 206
+        self._send(status, data[start:])
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        url = urlparse.urlparse(self.path)
+        if ( url.path.startswith("/upload/") ):
+            filename = urlparse.parse_qs(url.query)['filename'][0]
+            with fake.lock:
+                photo = fake.upload(int(url.path.split("/")[-1]), filename,
+                                    body)
+            self._send(200, str(photo['Id']),
+                       {"Content-Type": "text/plain"})
+            return
+        request = json.loads(body)
+        try:
+            with fake.lock:
+                result = fake.call(request['method'], request['params'])
+            response = {'result': result, 'error': None, 'id': request['id']}
+        except KeyError as e:
+            response = {'result': None, 'id': request['id'],
+                        'error': {'code': "E_INVALIDPARAM",
+                                  'message': str(e)}}
+        self._send(200, json.dumps(response),
+                   {"Content-Type": "application/json"})
@@ -0,0 +1,123 @@
+#    Tests for zf-restore, against a stand-in Zenfolio server
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+# Run from the top of the tree with: python -m unittest discover tests
+
+from zucla.commands.restore import Restore
+from zucla.zfrestore import unique_name
+from fakezf import FakeZenfolio
+
+import os
+import os.path
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+class UniqueNameTest(unittest.TestCase):
+
+    def test_first_keeps_its_name(self):
+        used = set()
+        self.assertEqual(unique_name("IMG_1.jpg", 7, used), "IMG_1.jpg")
+        self.assertEqual(used, set(["img_1.jpg"]))
+
+    def test_duplicates_get_their_id(self):
+        used = set()
+        unique_name("IMG_1.jpg", 7, used)
+        self.assertEqual(unique_name("IMG_1.jpg", 8, used), "IMG_1-8.jpg")
+        self.assertEqual(unique_name("img_1.JPG", 9, used), "img_1-9.JPG")
+
+    def test_taken_suffix(self):
+        used = set(["a.jpg", "a-5.jpg"])
+        self.assertEqual(unique_name("a.jpg", 5, used), "a-5-2.jpg")
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class RestoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeZenfolio()
+        photos = self.fake.add_group(self.fake.root, "Photos")
+        self.gallery = self.fake.add_gallery(photos, "Trip")
+        self.fake.start()
+        self.local = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.fake.stop()
+        shutil.rmtree(self.local)
+
+    def restore(self, *args):
+        """
+        Run zf-restore with the given arguments; returns its output.
+        """
+        argv = sys.argv
+        stdout = sys.stdout
+        sys.argv = ["zf-restore", "-u", "me", "--password", "pw", "--nossl",
+                    "--host", self.fake.host] + list(args)
+        sys.stdout = StringIO.StringIO()
+        try:
+            Restore().run()
+            return sys.stdout.getvalue()
+        finally:
+            sys.argv = argv
+            sys.stdout = stdout
+
+    def read(self, *path):
+        with open(os.path.join(self.local, *path), "rb") as f:
+            return f.read()
+
+    def test_restore(self):
+        self.fake.add_photo(self.gallery, "a.jpg", "a" * 1000)
+        self.fake.add_photo(self.gallery, "b.jpg", "b" * 70000)
+        self.restore("/root/Photos", self.local)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.local, "Trip"))),
+                         ["a.jpg", "b.jpg"])
+        self.assertEqual(self.read("Trip", "b.jpg"), "b" * 70000)
+
+        output = self.restore("/root/Photos", self.local)
+        self.assertIn("Skipped     2 files already present", output)
+
+    def test_same_file_names(self):
+        self.fake.add_photo(self.gallery, "IMG_1.jpg", "1" * 5000)
+        second = self.fake.add_photo(self.gallery, "IMG_1.jpg", "2" * 6000)
+        self.restore("-j", "2", "/root/Photos/Trip", self.local)
+        second_name = "IMG_1-{:d}.jpg".format(second['Id'])
+        self.assertEqual(sorted(os.listdir(self.local)),
+                         sorted(["IMG_1.jpg", second_name]))
+        self.assertEqual(self.read("IMG_1.jpg"), "1" * 5000)
+        self.assertEqual(self.read(second_name), "2" * 6000)
+
+        # The next run finds both where it left them.
+        output = self.restore("/root/Photos/Trip", self.local)
+        self.assertIn("Skipped     2 files already present", output)
+
+    def test_resume_part_file(self):
+        photo = self.fake.add_photo(self.gallery, "a.jpg", "0123456789" * 100)
+        os.makedirs(os.path.join(self.local, "Trip"))
+        with open(os.path.join(self.local, "Trip", "a.jpg.part"), "wb") as f:
+            f.write("0123456789" * 40)
+        output = self.restore("/root/Photos", self.local)
+        self.assertIn("resumed at 400 bytes", output)
+        self.assertEqual(self.read("Trip", "a.jpg"), self.fake.original(
+            photo['Id']))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+#    Tests for zf-upload reading its file list from a file or stdin
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+# Run from the top of the tree with: python -m unittest discover tests
+
+from zucla.commands.upload import Upload
+
+import os
+import StringIO
+import sys
+import tempfile
+import unittest
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class RecordingUpload(Upload):
+    """
+    zf-upload with the Zenfolio calls replaced: it is logged in, knows
+    the galleries in urls, and records what it looks up and uploads.
+    """
+
+    def __init__(self, urls):
+        Upload.__init__(self)
+        self.urls = urls
+        self.lookups = []
+        self.uploads = []
+
+    def get_password(self):
+        return 1
+
+    def get_upload_url(self, gallery):
+        self.lookups.append(gallery)
+        return self.urls.get(gallery)
+
+    def UploadPhotoToURL(self, filepath, url, source=None):
+        self.uploads.append((filepath, url))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class UploadListTest(unittest.TestCase):
+
+    def setUp(self):
+        self.upload = RecordingUpload({"/Photos/A": "url-a",
+                                       "/Photos/B": "url-b"})
+
+    def run_upload(self, args, stdin=""):
+        """
+        Run zf-upload with the given arguments and standard input;
+        returns its output.
+        """
+        saved = (sys.argv, sys.stdin, sys.stdout)
+        sys.argv = ["zf-upload", "-u", "me"] + args
+        sys.stdin = StringIO.StringIO(stdin)
+        sys.stdout = StringIO.StringIO()
+        try:
+            self.upload.run()
+            return sys.stdout.getvalue()
+        finally:
+            sys.argv, sys.stdin, sys.stdout = saved
+
+    def test_from_file(self):
+        fd, manifest = tempfile.mkstemp()
+        os.write(fd, "a1.jpg\n"
+                     "b1.jpg\t/Photos/B\n"
+                     "\n"
+                     "a2.jpg\t/Photos/A\n"
+                     "b2.jpg\t/Photos/B\n")
+        os.close(fd)
+        try:
+            output = self.run_upload(["--from-file", manifest, "/Photos/A"])
+        finally:
+            os.remove(manifest)
+        # Grouped by gallery, each looked up once.
+        self.assertEqual(self.upload.uploads,
+                         [("a1.jpg", "url-a"), ("a2.jpg", "url-a"),
+                          ("b1.jpg", "url-b"), ("b2.jpg", "url-b")])
+        self.assertEqual(self.upload.lookups, ["/Photos/A", "/Photos/B"])
+        self.assertIn("4 images uploaded.", output)
+
+    def test_from_stdin_with_arguments(self):
+        output = self.run_upload(["--from-stdin", "x.jpg", "/Photos/B"],
+                                 "a1.jpg\t/Photos/A\ny.jpg\n")
+        self.assertEqual(self.upload.uploads,
+                         [("x.jpg", "url-b"), ("y.jpg", "url-b"),
+                          ("a1.jpg", "url-a")])
+        self.assertIn("3 images uploaded.", output)
+
+    def test_missing_gallery(self):
+        output = self.run_upload(["--from-stdin"],
+                                 "a1.jpg\t/Photos/A\n"
+                                 "c1.jpg\t/Photos/C\n"
+                                 "c2.jpg\t/Photos/C\n")
+        self.assertEqual(self.upload.uploads, [("a1.jpg", "url-a")])
+        self.assertEqual(self.upload.lookups, ["/Photos/A", "/Photos/C"])
+        self.assertIn("2 images skipped (no gallery).", output)
+
+    def test_line_without_gallery(self):
+        output = self.run_upload(["--from-stdin"],
+                                 "a1.jpg\t/Photos/A\nb1.jpg\n")
+        self.assertEqual(self.upload.uploads, [])
+        self.assertIn("line 2: no gallery for b1.jpg", output)
+        self.assertIn("0 images uploaded.", output)
+
+if __name__ == "__main__":
+    unittest.main()
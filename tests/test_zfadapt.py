@@ -0,0 +1,139 @@
+#    Tests for zfadapt
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+from zucla import zfadapt
+from zucla.zfadapt import AdaptiveLimit, parse_range, percentile
+from zucla.zflib import ZfLibException
+
+import unittest
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Clock:
+    """
+    Stands in for the time module: the time moves only when a test
+    says so, so that latencies and throughput come out the same on
+    every run.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class AdaptiveLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.saved = zfadapt.time
+        zfadapt.time = self.clock
+
+    def tearDown(self):
+        zfadapt.time = self.saved
+
+    def make(self, start=4, low=1, high=8):
+        # No waiting for a window: adjust after every 4 calls.
+        self.changes = []
+        return AdaptiveLimit("uploads", start, low, high, window=0,
+                             min_samples=4,
+                             report=lambda limit, old:
+                                 self.changes.append((old, limit.limit)))
+
+    def calls(self, limit, count, latency=0.0, failed=0):
+        """
+        Run count calls (no more than the limit), all at once, taking
+        latency seconds; the first failed of them fail.
+        """
+        started = [limit.acquire() for i in range(count)]
+        self.clock.now += latency
+        for i, start in enumerate(started):
+            limit.release(start, 1000, i < failed)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range("2-8"), (2, 8))
+        for text in ["8-2", "0-3", "3", "a-b"]:
+            self.assertRaises(ZfLibException, parse_range, text)
+
+    def test_percentile(self):
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 0.5), 3)
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 0.9), 5)
+        self.assertEqual(percentile([7], 0.9), 7)
+
+    def test_start_within_bounds(self):
+        self.assertEqual(AdaptiveLimit("x", 20, 1, 8).limit, 8)
+        self.assertEqual(AdaptiveLimit("x", 0, 2, 8).limit, 2)
+
+    def test_grows_while_saturated(self):
+        limit = self.make()
+        self.calls(limit, 4, 0.1)
+        self.assertEqual(limit.limit, 5)
+        self.calls(limit, 5, 0.1)
+        self.assertEqual(limit.limit, 6)
+        self.assertEqual(self.changes, [(4, 5), (5, 6)])
+        self.assertEqual(limit.highest, 6)
+
+    def test_holds_when_not_used(self):
+        limit = self.make()
+        for i in range(4):
+            self.calls(limit, 1, 0.1)
+        self.assertEqual(limit.limit, 4)
+
+    def test_errors_halve(self):
+        limit = self.make(start=8)
+        self.calls(limit, 4, 0.1, failed=1)
+        self.assertEqual(limit.limit, 4)
+        self.assertEqual(limit.error_rate, 1.0 / 4)
+        self.assertEqual(limit.decreases, 1)
+
+    def test_recovered_errors_count(self):
+        limit = self.make(start=8)
+        limit.error()
+        self.calls(limit, 3, 0.1)
+        self.assertEqual(limit.limit, 4)
+        self.assertEqual(limit.error_rate, 1.0 / 4)
+
+    def test_latency_backs_off(self):
+        limit = self.make(start=4)
+        self.calls(limit, 4, 0.1)
+        # Four times the latency, with no more throughput
+        self.calls(limit, 5, 0.4)
+        self.assertEqual(limit.limit, 3)
+        self.assertEqual(self.changes, [(4, 5), (5, 3)])
+
+    def test_stays_within_bounds(self):
+        limit = self.make(start=2, low=2, high=3)
+        for i in range(3):
+            self.calls(limit, 2, 0.1, failed=2)
+            self.calls(limit, 2, 0.1, failed=2)
+        self.assertEqual(limit.limit, 2)
+        self.assertEqual(limit.lowest, 2)
+
+    def test_cancel_is_no_sample(self):
+        limit = self.make()
+        for i in range(10):
+            limit.acquire()
+            limit.cancel()
+        self.assertEqual(limit.limit, 4)
+        self.assertEqual(self.changes, [])
+
+if __name__ == "__main__":
+    unittest.main()
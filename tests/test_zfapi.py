@@ -0,0 +1,100 @@
+#    Tests for the connection handling of zfapi
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+from zucla.zfapi import ZfAPI
+
+import httplib
+import socket
+import threading
+import time
+import unittest
+
+RESPONSE = ("HTTP/1.1 200 OK\r\nContent-Length: 2\r\n" +
+            "Connection: keep-alive\r\n\r\nok")
+
+class OneShotServer:
+    """
+    A server that reads one request per connection and then, with
+    respond, answers it before it closes the connection (like a server
+    that drops idle connections), or else closes it without an answer.
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = 0
+        self._socket = socket.socket()
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(5)
+        self.host = "127.0.0.1:{:d}".format(self._socket.getsockname()[1])
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        while ( True ):
+            try:
+                conn = self._socket.accept()[0]
+            except socket.error:
+                return
+            data = ""
+            while ( "\r\n\r\n" not in data ):
+                data += conn.recv(4096)
+            self.requests += 1
+            if ( self.respond ):
+                conn.sendall(RESPONSE)
+            conn.close()
+
+    def close(self):
+        self._socket.close()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class RequestTest(unittest.TestCase):
+
+    def connect(self, server):
+        api = ZfAPI(ssl=0, zf_host=server.host)
+        api.keep_alive = True
+        return api
+
+    def test_reopens_dropped_connection(self):
+        server = OneShotServer(True)
+        api = self.connect(server)
+        try:
+            for i in range(3):
+                self.assertEqual(api._request("GET", "/", None, {}).read(),
+                                 "ok")
+                # Let the server's close arrive.
+                time.sleep(0.1)
+        finally:
+            server.close()
+        self.assertEqual(server.requests, 3)
+
+    def test_sent_request_not_resent(self):
+        server = OneShotServer(False)
+        api = self.connect(server)
+        try:
+            self.assertRaises((httplib.HTTPException, socket.error),
+                              api._request, "POST", "/", "{}", {})
+        finally:
+            server.close()
+        self.assertEqual(server.requests, 1)
+
+if __name__ == "__main__":
+    unittest.main()
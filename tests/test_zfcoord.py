@@ -0,0 +1,145 @@
+#    Tests for the coordination of sharded backups
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+# Run from the top of the tree with: python -m unittest discover tests
+
+from zucla.zfcoord import Coordinator, ShardRules, parse_shard, shard_of
+from zucla.zflib import ZfLibException
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class FakeSession:
+    """
+    Just enough of a ZfLib for Coordinator.create: the hierarchy is a
+    dict of (path, type) -> element, shared by the sessions of several
+    shards.
+    """
+
+    def __init__(self, elements):
+        self.elements = elements
+        self.reloads = 0
+
+    def retrieve_group_hierarchy(self):
+        self.reloads += 1
+
+    def element_index(self):
+        return self.elements
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ShardTest(unittest.TestCase):
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("2/4"), (2, 4))
+        self.assertEqual(parse_shard("1/1"), (1, 1))
+        for text in ("0/4", "5/4", "1/0", "2", "a/b", "1/2/3"):
+            self.assertRaises(ZfLibException, parse_shard, text)
+
+    def test_shard_of(self):
+        self.assertEqual(shard_of("", 4), 1)
+        self.assertEqual(shard_of(".", 4, "hash"), 1)
+        for rpath in ("a", "b", os.path.join("c", "d")):
+            self.assertIn(shard_of(rpath, 4), range(1, 5))
+        # By top-level directory, a tree stays in one shard.
+        self.assertEqual(shard_of(os.path.join("a", "x", "y"), 4),
+                         shard_of("a", 4))
+        self.assertEqual(shard_of("anything", 1, "hash"), 1)
+
+    def test_shards_cover_the_tree(self):
+        names = ["dir{:d}".format(i) for i in range(20)]
+        seen = []
+        for index in range(1, 4):
+            rules = ShardRules(index, 3)
+            seen += [name for name in names
+                     if not rules.prune_dir("", name)]
+            # Only top-level directories are pruned.
+            self.assertFalse(rules.prune_dir("dir0", "sub"))
+        self.assertEqual(sorted(seen), sorted(names))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class CoordinatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "coord.db")
+        self.open = []
+
+    def tearDown(self):
+        for coordinator in self.open:
+            coordinator.close()
+        shutil.rmtree(self.dir)
+
+    def coordinator(self, index, count=2):
+        coordinator = Coordinator(self.filename, index, count, timeout=5.0)
+        self.open.append(coordinator)
+        return coordinator
+
+    def test_totals(self):
+        first = self.coordinator(1)
+        second = self.coordinator(2)
+        self.assertEqual(first.run, second.run)
+        first.report({"added": 3, "old": 1})
+        second.report({"added": 2, "failed": 1}, finished=True)
+        totals, finished = first.totals()
+        self.assertEqual((totals["added"], totals["old"], totals["failed"]),
+                         (5, 1, 1))
+        self.assertEqual(finished, 1)
+
+    def test_new_run(self):
+        first = self.coordinator(1)
+        first.report({"added": 3}, finished=True)
+        self.coordinator(2).report({"added": 2}, finished=True)
+
+        # Starting shard 1 again starts a new run without the old rows.
+        again = self.coordinator(1)
+        self.assertEqual(again.run, first.run + 1)
+        totals, finished = again.totals()
+        self.assertEqual((totals["added"], finished), (0, 0))
+
+        # A shard of the old run that reports late doesn't count.
+        first.report({"added": 10}, finished=True)
+        self.assertEqual(again.totals()[0]["added"], 0)
+
+    def test_create_once(self):
+        elements = {}
+        sessions = [FakeSession(elements), FakeSession(elements)]
+        coordinators = [self.coordinator(1), self.coordinator(2)]
+        created = []
+        def create():
+            created.append(True)
+            elements[("/Photos/Trip", "PhotoSet")] = {'Id': 42}
+            return "new"
+
+        result = coordinators[0].create(sessions[0], "PhotoSet", "/Photos",
+                                        "Trip", create)
+        self.assertEqual(result, ("new", True))
+        result = coordinators[1].create(sessions[1], "PhotoSet", "/Photos",
+                                        "Trip", create)
+        self.assertEqual(result, ({'Id': 42}, False))
+        self.assertEqual(len(created), 1)
+        self.assertEqual(sessions[1].reloads, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+#    Tests for zfdiff
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+from zucla.zfdiff import LocalDir, LocalTree, diff_tree, zf_path_for
+
+import os.path
+import unittest
+
+ROOT = "/root/Photos"
+
+def photo(photo_id, name, size):
+    return {'Id': photo_id, 'FileName': name, 'Size': size}
+
+def photoset(*photos):
+    return {'Id': 1, 'Photos': list(photos)}
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class DiffTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = LocalTree("/local")
+        # An element index as ZfLib.element_index makes it
+        self.index = {(ROOT, "Group"): {'Id': 2},
+                      (ROOT, "PhotoSet"): {'Id': 3}}
+
+    def diff(self, snapshots, mirror=False):
+        return diff_tree(self.tree, ROOT, self.index, snapshots, mirror)
+
+    def test_zf_path_for(self):
+        self.assertEqual(zf_path_for("/root/Photos/", ""), ROOT)
+        self.assertEqual(zf_path_for(ROOT, os.path.join("a", "b")),
+                         ROOT + "/a/b")
+
+    def test_add(self):
+        self.tree.add(LocalDir("", [], {'a.jpg': (10, 0), 'b.jpg': (20, 0)}))
+        changes = self.diff({ROOT: photoset(photo(5, "a.jpg", 10))})
+        self.assertEqual(changes.add, [("/local/b.jpg", ROOT, 20)])
+        self.assertEqual(changes.unchanged, 1)
+        self.assertEqual(changes.upload_bytes(), 20)
+
+    def test_replace(self):
+        self.tree.add(LocalDir("", [], {'a.jpg': (11, 0)}))
+        old = photo(5, "a.jpg", 10)
+        changes = self.diff({ROOT: photoset(old)})
+        self.assertEqual(changes.replace, [("/local/a.jpg", ROOT, 11, old)])
+        self.assertEqual(changes.add, [])
+        self.assertEqual(changes.unchanged, 0)
+
+    def test_delete_only_when_mirroring(self):
+        self.tree.add(LocalDir("", [], {'a.jpg': (10, 0)}))
+        stale = photo(6, "gone.jpg", 10)
+        snapshots = {ROOT: photoset(photo(5, "a.jpg", 10), stale)}
+        self.assertEqual(self.diff(snapshots).delete, [])
+        self.assertEqual(self.diff(snapshots, True).delete, [(ROOT, stale)])
+
+    def test_excluded_files_are_not_deleted(self):
+        self.tree.add(LocalDir("", [], {'a.jpg': (10, 0)},
+                               excluded=set(["skip.jpg"])))
+        snapshots = {ROOT: photoset(photo(5, "a.jpg", 10),
+                                    photo(6, "skip.jpg", 10))}
+        changes = self.diff(snapshots, True)
+        self.assertEqual(changes.delete, [])
+        self.assertTrue(changes.is_empty())
+
+    def test_duplicate_names(self):
+        # The first photo of a name counts, as in a backup; the other
+        # is neither replaced nor deleted.
+        self.tree.add(LocalDir("", [], {'a.jpg': (10, 0)}))
+        snapshots = {ROOT: photoset(photo(5, "a.jpg", 10),
+                                    photo(6, "a.jpg", 99))}
+        changes = self.diff(snapshots, True)
+        self.assertEqual(changes.unchanged, 1)
+        self.assertEqual(changes.replace, [])
+        self.assertEqual(changes.delete, [])
+
+        snapshots = {ROOT: photoset(photo(6, "a.jpg", 99),
+                                    photo(5, "a.jpg", 10))}
+        changes = self.diff(snapshots, True)
+        self.assertEqual([op[3]['Id'] for op in changes.replace], [6])
+
+    def test_mirror_deletes_every_stale_duplicate(self):
+        self.tree.add(LocalDir("", [], {}))
+        snapshots = {ROOT: photoset(photo(5, "a.jpg", 10),
+                                    photo(6, "a.jpg", 99),
+                                    photo(7, "b.jpg", 10))}
+        changes = self.diff(snapshots, True)
+        self.assertEqual([op[1]['Id'] for op in changes.delete], [5, 6, 7])
+
+    def test_missing_galleries_and_groups(self):
+        self.tree.add(LocalDir("", ["new", "old"], {}))
+        self.tree.add(LocalDir("new", ["deeper"], {'a.jpg': (10, 0)}))
+        self.tree.add(LocalDir(os.path.join("new", "deeper"), [],
+                               {'b.jpg': (20, 0)}))
+        self.tree.add(LocalDir("old", [], {'c.jpg': (30, 0)}))
+        self.index[(ROOT + "/old", "PhotoSet")] = {'Id': 4}
+        changes = self.diff({})
+        self.assertEqual(changes.groups, [ROOT + "/new"])
+        self.assertEqual(changes.galleries,
+                         [ROOT + "/new", ROOT + "/new/deeper"])
+        # Everything in a gallery without a snapshot is uploaded.
+        self.assertEqual(sorted([op[0] for op in changes.add]),
+                         ["/local/new/a.jpg", "/local/new/deeper/b.jpg",
+                          "/local/old/c.jpg"])
+
+    def test_empty_directory_needs_nothing(self):
+        self.tree.add(LocalDir("empty", [], {}, others=2))
+        changes = self.diff({})
+        self.assertTrue(changes.is_empty())
+        self.assertEqual(changes.others, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#    Tests for zfexec
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+from zucla.zfexec import UploadPool, UploadTask
+
+import httplib
+import threading
+import unittest
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class FakeAPI:
+    """
+    Stands in for a ZfAPI session: each upload takes the next of a list
+    of outcomes (an Id, None for an upload whose Id is unknown, or an
+    exception to raise).
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.uploads = []
+        self.deleted = []
+        self.reconnects = 0
+        self._last_id = None
+        self._lock = threading.Lock()
+
+    def clone(self):
+        return self
+
+    def _open_connection(self):
+        self.reconnects += 1
+
+    def UploadPhotoToURL(self, filepath, url, source=None):
+        with self._lock:
+            self.uploads.append(filepath)
+            outcome = self.outcomes.pop(0)
+        if ( isinstance(outcome, Exception) ):
+            raise outcome
+        self._last_id = outcome
+        return 1
+
+    def last_upload_id(self):
+        return self._last_id
+
+    def DeletePhoto(self, photo_id):
+        self.deleted.append(photo_id)
+        return True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class UploadPoolTest(unittest.TestCase):
+
+    def run_pool(self, api, tasks):
+        self.done = []
+        pool = UploadPool(api, jobs=1,
+                          done=lambda task, photo_id:
+                              self.done.append((task.local_path, photo_id)))
+        pool.start()
+        for task in tasks:
+            pool.submit(task)
+        pool.close()
+        return pool
+
+    def test_replace(self):
+        api = FakeAPI([2001])
+        pool = self.run_pool(api, [UploadTask("a.jpg", "u", 10,
+                                              replace_id=1001)])
+        self.assertEqual(api.deleted, [1001])
+        self.assertEqual(self.done, [("a.jpg", 2001)])
+        self.assertEqual(pool.uploaded, 1)
+
+    def test_replace_keeps_old_without_new_id(self):
+        api = FakeAPI([None])
+        self.run_pool(api, [UploadTask("a.jpg", "u", 10, replace_id=1001)])
+        self.assertEqual(api.deleted, [])
+
+    def test_retry_reset(self):
+        api = FakeAPI([IOError(104, "Connection reset by peer"), 2001])
+        pool = self.run_pool(api, [UploadTask("a.jpg", "u", 10)])
+        self.assertEqual(api.uploads, ["a.jpg", "a.jpg"])
+        self.assertEqual(api.reconnects, 1)
+        self.assertEqual(pool.retries, 1)
+        self.assertEqual(self.done, [("a.jpg", 2001)])
+
+    def test_no_retry_after_sending(self):
+        # The server may have stored the photo before the bad answer.
+        api = FakeAPI([httplib.BadStatusLine(""), 2001])
+        pool = self.run_pool(api, [UploadTask("a.jpg", "u", 10)])
+        self.assertEqual(api.uploads, ["a.jpg"])
+        self.assertEqual(pool.retries, 0)
+        self.assertEqual(len(pool.failed), 1)
+        self.assertEqual(self.done, [])
+
+if __name__ == "__main__":
+    unittest.main()
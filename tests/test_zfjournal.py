@@ -0,0 +1,110 @@
+#    Tests for zfjournal
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+from zucla.zfjournal import Journal
+from zucla.zflib import ZfLibException
+
+import os
+import shutil
+import tempfile
+import unittest
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "journal")
+        self.local = os.path.join(self.dir, "Caf\xc3\xa9")
+        os.mkdir(self.local)
+        self.photo = os.path.join(self.local, "cr\xc3\xaape.jpg")
+        photo_file = open(self.photo, 'w')
+        photo_file.write("jpeg")
+        photo_file.close()
+        self.header = {'user': "user", 'local_path': self.local,
+                       'group_path': "/Photos/Caf\xc3\xa9"}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self):
+        journal = Journal(self.filename)
+        journal.open(self.header)
+        journal.file_done(self.photo, os.stat(self.photo), 1001)
+        journal.dir_done(self.local)
+        journal.close()
+
+    def test_resume(self):
+        self.write()
+        journal = Journal(self.filename)
+        journal.open(self.header, resume=True)
+        self.assertEqual(journal.resumed_files, 1)
+        self.assertEqual(journal.resumed_dirs, 1)
+        self.assertTrue(journal.is_file_done(self.photo,
+                                             os.stat(self.photo)))
+        self.assertTrue(journal.directory_unchanged(
+            self.local, {"cr\xc3\xaape.jpg": os.stat(self.photo)}))
+        journal.close()
+
+    def test_resume_changed_file(self):
+        self.write()
+        photo_file = open(self.photo, 'a')
+        photo_file.write("more")
+        photo_file.close()
+        journal = Journal(self.filename)
+        journal.open(self.header, resume=True)
+        self.assertFalse(journal.is_file_done(self.photo,
+                                              os.stat(self.photo)))
+        journal.close()
+
+    def test_resume_torn_line(self):
+        self.write()
+        journal_file = open(self.filename, 'a')
+        journal_file.write("{\"t\": \"file\", \"pa")
+        journal_file.close()
+        journal = Journal(self.filename)
+        journal.open(self.header, resume=True)
+        self.assertEqual(journal.resumed_files, 1)
+        journal.dir_done(self.dir)
+        journal.close()
+
+        journal = Journal(self.filename)
+        journal.open(self.header, resume=True)
+        self.assertTrue(journal.is_dir_done(self.dir))
+        journal.close()
+
+    def test_different_backup(self):
+        self.write()
+        header = dict(self.header)
+        header['group_path'] = "/Photos/Th\xc3\xa9"
+        journal = Journal(self.filename)
+        self.assertRaises(ZfLibException, journal.open, header, True)
+
+    def test_resume_without_journal(self):
+        journal = Journal(self.filename)
+        journal.open(self.header, resume=True)
+        self.assertEqual(journal.resumed_files, 0)
+        journal.remove()
+        self.assertFalse(os.path.exists(self.filename))
+
+if __name__ == "__main__":
+    unittest.main()
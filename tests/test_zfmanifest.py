@@ -0,0 +1,74 @@
+#    Tests for zfmanifest
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+from zucla.zflib import ZfLibException
+from zucla.zfmanifest import batches, read_manifest
+
+import unittest
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ManifestTest(unittest.TestCase):
+
+    def test_read(self):
+        lines = ["/p/a.jpg\n",
+                 "\n",
+                 "/p/b.jpg\t/Photos/2013\r\n",
+                 "   \n",
+                 "/p/c d.jpg\t \n"]
+        self.assertEqual(list(read_manifest(lines, "/Photos")),
+                         [("/p/a.jpg", "/Photos"),
+                          ("/p/b.jpg", "/Photos/2013"),
+                          ("/p/c d.jpg", "/Photos")])
+
+    def test_no_gallery(self):
+        entries = read_manifest(["/p/a.jpg\t/Photos\n", "/p/b.jpg\n"])
+        self.assertEqual(entries.next(), ("/p/a.jpg", "/Photos"))
+        self.assertRaises(ZfLibException, entries.next)
+
+    def test_batches(self):
+        entries = [("a", "/x"), ("b", "/y"), ("c", "/x"),
+                   ("d", "/y"), ("e", "/z")]
+        self.assertEqual(list(batches(entries, 3)),
+                         [[("/x", ["a", "c"]), ("/y", ["b"])],
+                          [("/y", ["d"]), ("/z", ["e"])]])
+        self.assertEqual(list(batches(entries)),
+                         [[("/x", ["a", "c"]), ("/y", ["b", "d"]),
+                           ("/z", ["e"])]])
+
+    def test_batches_exact(self):
+        entries = [("a", "/x"), ("b", "/x")]
+        self.assertEqual(list(batches(entries, 2)), [[("/x", ["a", "b"])]])
+        self.assertEqual(list(batches([], 2)), [])
+
+    def test_batches_are_lazy(self):
+        # Only a batch's worth of the manifest is read at a time.
+        read = []
+        def entries():
+            for name in "abcdef":
+                read.append(name)
+                yield (name, "/x")
+        groups = batches(entries(), 2)
+        self.assertEqual(groups.next(), [("/x", ["a", "b"])])
+        self.assertEqual(read, ["a", "b"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+#    Tests for the zf-backup --jobs pipeline, against a stand-in server
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+# Run from the top of the tree with: python -m unittest discover tests
+
+from zucla.commands.backup import Backup
+from fakezf import FakeZenfolio
+
+import os
+import os.path
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeZenfolio()
+        self.fake.add_group(self.fake.root, "Photos")
+        self.fake.start()
+        # b has images and a subdirectory, so it is both a group and a
+        # gallery.
+        self.local = tempfile.mkdtemp()
+        for rpath in ("a", "b", os.path.join("b", "c")):
+            os.makedirs(os.path.join(self.local, rpath))
+            for i in range(3):
+                self.write(os.path.join(rpath, "img{:d}.jpg".format(i)),
+                           rpath * (100 + i))
+
+    def tearDown(self):
+        self.fake.stop()
+        shutil.rmtree(self.local)
+
+    def write(self, rpath, data):
+        with open(os.path.join(self.local, rpath), "wb") as f:
+            f.write(data)
+
+    def backup(self, *args):
+        """
+        Run zf-backup of the local tree to /root/Photos/Tree with the
+        given options; returns its output.
+        """
+        argv = sys.argv
+        stdout = sys.stdout
+        sys.argv = ["zf-backup", "-u", "me", "--password", "pw", "--nossl",
+                    "--host", self.fake.host] + list(args) + \
+                   [self.local, "/root/Photos/Tree"]
+        sys.stdout = StringIO.StringIO()
+        try:
+            Backup().run()
+            return sys.stdout.getvalue()
+        finally:
+            sys.argv = argv
+            sys.stdout = stdout
+
+    def galleries(self):
+        """
+        Get the galleries on the server; returns a dict of path ->
+        sorted list of (file name, contents).
+        """
+        galleries = {}
+        def walk(element, path):
+            for child in element['Elements']:
+                child_path = path + "/" + child['Title']
+                if ( child['$type'] == "Group" ):
+                    walk(child, child_path)
+                else:
+                    galleries[child_path] = sorted(
+                        [(photo['FileName'], self.fake.original(photo['Id']))
+                         for photo in self.fake.photos(child)])
+        walk(self.fake.root, "")
+        return galleries
+
+    def test_backup(self):
+        output = self.backup("--jobs", "3")
+        self.assertIn("Added       9 image files", output)
+        self.assertNotIn("Fail", output)
+        galleries = self.galleries()
+        self.assertEqual(sorted(galleries.keys()),
+                         ["/Photos/Tree/a", "/Photos/Tree/b",
+                          "/Photos/Tree/b/c"])
+        self.assertEqual(galleries["/Photos/Tree/b/c"][2],
+                         ("img2.jpg", os.path.join("b", "c") * 102))
+
+        output = self.backup("--jobs", "3")
+        self.assertIn("Skipped     9 old image files", output)
+        self.assertEqual(self.fake.calls.count("Upload"), 9)
+
+    def test_same_as_serial(self):
+        self.backup("--jobs", "3", "--meta-jobs", "2")
+        pipelined = self.galleries()
+        self.fake.stop()
+        self.fake = FakeZenfolio()
+        self.fake.add_group(self.fake.root, "Photos")
+        self.fake.start()
+        self.backup()
+        self.assertEqual(self.galleries(), pipelined)
+
+    def test_update(self):
+        self.backup("--jobs", "3")
+        self.write(os.path.join("a", "img1.jpg"), "changed" * 50)
+        output = self.backup("--jobs", "3")
+        self.assertIn("Updated     1 image files", output)
+        self.assertIn("Skipped     8 old image files", output)
+        # The new version replaces the old one.
+        self.assertEqual(self.galleries()["/Photos/Tree/a"][1],
+                         ("img1.jpg", "changed" * 50))
+        self.assertEqual(len(self.galleries()["/Photos/Tree/a"]), 3)
+
+if __name__ == "__main__":
+    unittest.main()
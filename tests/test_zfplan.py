@@ -0,0 +1,81 @@
+#    Tests for zfplan
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+from zucla.zfdiff import ChangeSet
+from zucla.zflib import ZfLibException
+from zucla.zfplan import format_plan, make_plan, read_plan, write_plan
+
+from urllib import urlencode
+import os
+import shutil
+import tempfile
+import unittest
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class PlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "plan.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        changes = ChangeSet()
+        changes.galleries = ["/Photos/Caf\xc3\xa9"]
+        changes.add = [("/local/Caf\xc3\xa9/cr\xc3\xaape.jpg",
+                        "/Photos/Caf\xc3\xa9", 100)]
+        changes.delete = [("/Photos/Caf\xc3\xa9",
+                           {'Id': 7, 'FileName': u"th\xe9.jpg"})]
+        changes.unchanged = 3
+        plan = make_plan(changes, "user", "/local/Caf\xc3\xa9",
+                         "/Photos/Caf\xc3\xa9", 1e6)
+        write_plan(plan, self.filename)
+
+        loaded = read_plan(self.filename)
+        self.assertEqual(loaded['totals'], plan['totals'])
+        self.assertEqual(len(loaded['operations']), 3)
+        self.assertEqual(type(loaded['local_path']), str)
+        add = loaded['operations'][1]
+        self.assertEqual(add['file'], "/local/Caf\xc3\xa9/cr\xc3\xaape.jpg")
+        self.assertEqual(type(add['file']), str)
+        self.assertEqual(loaded['operations'][2]['filename'],
+                         "th\xc3\xa9.jpg")
+
+        # What --execute does with it must not trip over the encoding.
+        self.assertTrue(format_plan(loaded).startswith(
+            "Plan for /local/Caf\xc3\xa9 -> /Photos/Caf\xc3\xa9"))
+        urlencode({"filename": os.path.basename(add['file'])})
+
+    def test_not_a_plan(self):
+        plan_file = open(self.filename, 'w')
+        plan_file.write("{\"version\": 99, \"operations\": []}")
+        plan_file.close()
+        self.assertRaises(ZfLibException, read_plan, self.filename)
+        plan_file = open(self.filename, 'w')
+        plan_file.write("not json")
+        plan_file.close()
+        self.assertRaises(ZfLibException, read_plan, self.filename)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+#    Tests for zfscan
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+from zucla import zfscan
+
+import os
+import shutil
+import tempfile
+import unittest
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class WalkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for name in ["a/x.jpg", "a/y.jpg", "a/notes.txt", "b/z.jpg",
+                     "top.jpg"]:
+            path = os.path.join(self.dir, name)
+            if ( not os.path.isdir(os.path.dirname(path)) ):
+                os.makedirs(os.path.dirname(path))
+            photo_file = open(path, 'w')
+            photo_file.write(name)
+            photo_file.close()
+        os.symlink(os.path.join(self.dir, "b"), os.path.join(self.dir, "c"))
+        os.symlink(os.path.join(self.dir, "a", "x.jpg"),
+                   os.path.join(self.dir, "link.jpg"))
+        os.symlink(os.path.join(self.dir, "gone.jpg"),
+                   os.path.join(self.dir, "dangling.jpg"))
+
+        # Count the stat calls, in case scandir is not available.
+        self.calls = []
+        self.saved = (os.stat, os.lstat, zfscan.scandir)
+        def counted(func):
+            def call(path):
+                if ( path.startswith(self.dir) ):
+                    self.calls.append(path)
+                return func(path)
+            return call
+        os.stat = counted(os.stat)
+        os.lstat = counted(os.lstat)
+
+    def tearDown(self):
+        os.stat, os.lstat, zfscan.scandir = self.saved
+        shutil.rmtree(self.dir)
+
+    def walk(self):
+        return dict([(os.path.relpath(scan_dir.path, self.dir), scan_dir)
+                     for scan_dir in zfscan.walk(self.dir, 2)])
+
+    def check(self, walked):
+        self.assertEqual(sorted(walked), [".", "a", "b"])
+        top = walked["."]
+        self.assertEqual(top.dirs, ["a", "b", "c"])
+        self.assertEqual(top.files, ["dangling.jpg", "link.jpg", "top.jpg"])
+        self.assertEqual(sorted(top.images), ["link.jpg", "top.jpg"])
+        self.assertEqual(top.images["link.jpg"].st_size, len("a/x.jpg"))
+        self.assertEqual(walked["a"].files, ["notes.txt", "x.jpg", "y.jpg"])
+        self.assertEqual(sorted(walked["a"].images), ["x.jpg", "y.jpg"])
+
+    def test_walk(self):
+        self.check(self.walk())
+
+    def test_walk_without_scandir(self):
+        zfscan.scandir = None
+        self.check(self.walk())
+        # One lstat per entry, and a stat for each symbolic link only.
+        links = [os.path.join(self.dir, name)
+                 for name in ["c", "link.jpg", "dangling.jpg"]]
+        for path in set(self.calls):
+            self.assertEqual(self.calls.count(path),
+                             ( path in links and 2 or 1 ), path)
+
+    def test_chunks_without_scandir(self):
+        zfscan.scandir = None
+        chunks = list(zfscan.scan_chunks(os.path.join(self.dir, "a"), 2))
+        entries = sorted(sum(chunks, []))
+        self.assertEqual([name for name, stat in entries],
+                         ["notes.txt", "x.jpg", "y.jpg"])
+        self.assertEqual(entries[0][1], None)
+        self.assertEqual(entries[1][1].st_size, len("a/x.jpg"))
+        for path in set(self.calls):
+            self.assertEqual(self.calls.count(path), 1, path)
+
+if __name__ == "__main__":
+    unittest.main()
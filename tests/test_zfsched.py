@@ -0,0 +1,137 @@
+#    Tests for zfsched
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+from zucla.zfexec import UploadPool, UploadTask
+from zucla.zflib import ZfLibException
+from zucla.zfsched import UploadScheduler, parse_priority
+from test_zfexec import FakeAPI
+
+import threading
+import time
+import unittest
+
+def task(name, size, gallery="/root/Photos"):
+    return UploadTask(name, "http://upload", size, gallery)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class UploadSchedulerTest(unittest.TestCase):
+
+    def order(self, scheduler, tasks):
+        for t in tasks:
+            scheduler.put(t)
+        scheduler.close()
+        names = []
+        while ( True ):
+            t = scheduler.get()
+            if ( t == None ):
+                return names
+            names.append(t.local_path)
+            scheduler.task_done(t)
+
+    def test_orders(self):
+        tasks = [task("b", 20), task("a", 10), task("d", 40), task("c", 30)]
+        self.assertEqual(self.order(UploadScheduler("fifo"), tasks),
+                         ["b", "a", "d", "c"])
+        self.assertEqual(self.order(UploadScheduler("smallest"), tasks),
+                         ["a", "b", "c", "d"])
+        self.assertEqual(self.order(UploadScheduler("largest"), tasks),
+                         ["d", "c", "b", "a"])
+        self.assertEqual(self.order(UploadScheduler("mixed"), tasks),
+                         ["d", "a", "c", "b"])
+
+    def test_unknown_order(self):
+        self.assertRaises(ZfLibException, UploadScheduler, "random")
+
+    def test_priorities(self):
+        scheduler = UploadScheduler("smallest",
+                                    priorities=[("/root/Photos/2013*", 10),
+                                                ("/root/Photos/*", 5)])
+        tasks = [task("old", 1, "/root/Photos/2012"),
+                 task("new-big", 50, "/root/Photos/2013/Spring"),
+                 task("new", 2, "/root/Photos/2013"),
+                 task("other", 1, "/elsewhere")]
+        self.assertEqual(self.order(scheduler, tasks),
+                         ["new", "new-big", "old", "other"])
+
+    def test_parse_priority(self):
+        self.assertEqual(parse_priority("/a/b=c*=3"), ("/a/b=c*", 3))
+        self.assertRaises(ZfLibException, parse_priority, "/a/b")
+        self.assertRaises(ZfLibException, parse_priority, "=3")
+
+    def test_max_bytes(self):
+        scheduler = UploadScheduler("fifo", max_bytes=100)
+        for t in [task("a", 60), task("b", 60), task("c", 500)]:
+            scheduler.put(t)
+        a = scheduler.get()
+        self.assertEqual(scheduler.in_flight, 60)
+
+        # "b" does not fit next to "a" until "a" is done.
+        got = []
+        thread = threading.Thread(target=lambda: got.append(scheduler.get()))
+        thread.daemon = True
+        thread.start()
+        thread.join(0.2)
+        self.assertEqual(got, [])
+        scheduler.task_done(a)
+        thread.join(2)
+        self.assertEqual(got[0].local_path, "b")
+
+        # A task larger than the limit still goes, on its own.
+        scheduler.task_done(got[0])
+        self.assertEqual(scheduler.get().local_path, "c")
+        self.assertEqual(scheduler.in_flight, 500)
+
+    def test_bounded_window(self):
+        scheduler = UploadScheduler("fifo", queue_size=2)
+        scheduler.put(task("a", 1))
+        scheduler.put(task("b", 1))
+        done = []
+        def put():
+            scheduler.put(task("c", 1))
+            done.append(True)
+        thread = threading.Thread(target=put)
+        thread.daemon = True
+        thread.start()
+        thread.join(0.2)
+        self.assertEqual(done, [])
+        scheduler.get()
+        thread.join(2)
+        self.assertEqual(done, [True])
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class PoolOrderTest(unittest.TestCase):
+
+    def test_pool_follows_scheduler(self):
+        api = FakeAPI([1001, 1002, 1003, 1004])
+        scheduler = UploadScheduler("smallest",
+                                    priorities=[("/root/Photos/new", 1)])
+        pool = UploadPool(api, jobs=1, scheduler=scheduler)
+        # Queued before the worker starts, so that all of them compete.
+        for t in [task("b", 20), task("a", 10), task("d", 40),
+                  task("c", 30, "/root/Photos/new")]:
+            pool.submit(t)
+        pool.start()
+        pool.close()
+        self.assertEqual(api.uploads, ["c", "a", "b", "d"])
+        self.assertEqual(pool.bytes, 100)
+
+if __name__ == "__main__":
+    unittest.main()
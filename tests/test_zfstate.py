@@ -0,0 +1,130 @@
+#    Tests for the local state database
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+# Run from the top of the tree with: python -m unittest discover tests
+
+from zucla.zfstate import ZfState
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ZfStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.state = ZfState(os.path.join(self.dir, "state.db"))
+
+    def tearDown(self):
+        self.state.close()
+        shutil.rmtree(self.dir)
+
+    def make(self, name, data="x"):
+        """
+        Write a file in the temporary directory; returns its path and
+        os.stat result.
+        """
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path, os.stat(path)
+
+    def test_record_file(self):
+        path, stat = self.make("a.jpg")
+        self.state.record_file(path, stat, 7, 3, "h1")
+        self.assertEqual(self.state.directory_files(self.dir),
+                         {"a.jpg": (stat.st_size, stat.st_mtime,
+                                    stat.st_ino, "h1", 7, 3, None)})
+        self.assertTrue(self.state.has_photo(path))
+        self.assertEqual(self.state.photo_path(7), path)
+
+    def test_keeps_hash_of_same_file(self):
+        path, stat = self.make("a.jpg")
+        self.state.record_file(path, stat, 7, 3, "h1")
+        self.state.record_file(path, stat, 8, 3)
+        self.assertEqual(self.state.directory_files(self.dir)["a.jpg"][3:5],
+                         ("h1", 8))
+
+        # A changed file loses its old hash.
+        path, stat = self.make("a.jpg", "longer")
+        self.state.record_file(path, stat, 9, 3)
+        self.assertEqual(self.state.directory_files(self.dir)["a.jpg"][3],
+                         None)
+
+    def test_directory_unchanged(self):
+        a, a_stat = self.make("a.jpg")
+        b, b_stat = self.make("b.jpg", "bb")
+        stats = {"a.jpg": a_stat, "b.jpg": b_stat}
+        self.assertFalse(self.state.directory_unchanged(self.dir, {}))
+        self.state.record_file(a, a_stat, 7, 3)
+        self.assertFalse(self.state.directory_unchanged(self.dir, stats))
+        self.state.record_file(b, b_stat, 8, 3)
+        self.assertTrue(self.state.directory_unchanged(self.dir, stats))
+
+        b, b_stat = self.make("b.jpg", "changed")
+        stats["b.jpg"] = b_stat
+        self.assertFalse(self.state.directory_unchanged(self.dir, stats))
+
+    def test_duplicate(self):
+        a, a_stat = self.make("a.jpg")
+        b, b_stat = self.make("b.jpg")
+        self.state.record_file(a, a_stat, 7, 3, "h1")
+        self.state.record_file(b, b_stat, None, 3, "h1", duplicate_of=a)
+        stats = {"a.jpg": a_stat, "b.jpg": b_stat}
+        self.assertFalse(self.state.has_photo(b))
+        self.assertTrue(self.state.directory_unchanged(self.dir, stats))
+        self.assertEqual(self.state.find_hash("h1", b), (a, 7, 3))
+        self.assertEqual(self.state.find_hash("h1", a), None)
+
+        # The duplicate has to be uploaded once its original is gone.
+        self.state.forget_file(a)
+        self.assertFalse(self.state.directory_unchanged(self.dir, stats))
+
+    def test_find_moved(self):
+        old, stat = self.make("old.jpg")
+        self.state.record_file(old, stat, 7, 3)
+        new = os.path.join(self.dir, "new.jpg")
+        self.assertEqual(self.state.find_moved(new, stat), None)
+        os.rename(old, new)
+        self.assertEqual(self.state.find_moved(new, stat), (old, 7, 3))
+
+    def test_hashes(self):
+        self.state.record_hash(1, 2, 3, 4.0, "h1")
+        self.assertEqual(self.state.cached_hash(1, 2, 3, 4.0), "h1")
+        self.state.record_hash(1, 2, 5, 6.0, "h2")
+        self.assertEqual(self.state.cached_hash(1, 2, 3, 4.0), None)
+        self.assertEqual(self.state.cached_hash(1, 2, 5, 6.0), "h2")
+
+    def test_reopen(self):
+        path, stat = self.make("a.jpg")
+        self.state.record_file(path, stat, 7, 3)
+        self.state.record_group(self.dir, 11)
+        self.state.close()
+        self.state = ZfState(os.path.join(self.dir, "state.db"))
+        self.assertTrue(self.state.has_photo(path))
+        self.assertEqual(self.state.group_id(self.dir), 11)
+        self.assertEqual(self.state.group_id("/nowhere"), None)
+
+if __name__ == "__main__":
+    unittest.main()
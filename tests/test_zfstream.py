@@ -0,0 +1,63 @@
+#    Tests for zfstream
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+from zucla.zfstream import PhotoIndex
+
+import unittest
+
+def photo(photo_id, name, size):
+    return {'Id': photo_id, 'FileName': name, 'Size': size,
+            'FileHash': None}
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class PhotoIndexTest(unittest.TestCase):
+
+    def check(self, max_entries):
+        index = PhotoIndex(max_entries)
+        try:
+            for p in [photo(1, "b.jpg", 10), photo(2, "a.jpg", 20),
+                      photo(3, "b.jpg", 30), photo(4, "c.jpg", 40),
+                      photo(5, "c.jpg", 50)]:
+                index.add(p)
+            self.assertEqual(index.spilled, max_entries < 5)
+            self.assertEqual(index.total, 5)
+            self.assertEqual(len(index), 5)
+
+            # The first photo of a name counts; the others go with it.
+            self.assertEqual(index.pop("b.jpg"), photo(1, "b.jpg", 10))
+            self.assertEqual(index.pop("b.jpg"), None)
+            self.assertEqual(len(index), 3)
+
+            # What is left is deleted by a mirror, duplicates and all.
+            self.assertEqual([p['Id'] for p in index.remaining()],
+                             [2, 4, 5])
+        finally:
+            index.close()
+
+    def test_in_memory(self):
+        self.check(100)
+
+    def test_spilled(self):
+        self.check(2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+#    A class to create a Zenfolio command-line interface
+# 
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, Bryan Mason
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to 
+#    access the Zenfiolo service.
+#
+###############################################################################
+
+
+from zucla.zfcli import ZfCLI
+from zucla.commands.shell import COMMANDS
+from zucla import zfagent
+
+import argparse
+import httplib
+import signal
+import socket
+import sys
+import time
+
+class Agent(ZfCLI):
+
+    def __init__(self):
+        ZfCLI.__init__(self, "agent")
+        self._parser.add_argument("--socket", action="store",
+                                  metavar="PATH",
+                                  help="Listen on PATH (default " + \
+                                      "$XDG_RUNTIME_DIR/zucla/USER.sock " + \
+                                      "or /tmp/zucla-UID/USER.sock, " + \
+                                      "where the zf-* commands look).")
+        self._parser.add_argument("--idle-timeout", action="store",
+                                  type=float, dest="idle_timeout",
+                                  metavar="SECONDS",
+                                  help="Exit after SECONDS without a " + \
+                                      "command (default: run until " + \
+                                      "stopped).")
+        self._parser.add_argument("--refresh", action="store", type=float,
+                                  default=60, metavar="SECONDS",
+                                  help="Load the group hierarchy again " + \
+                                      "before a command if it was " + \
+                                      "loaded more than SECONDS ago " + \
+                                      "(default 60; 0 loads it before " + \
+                                      "every command).")
+        self._loaded = None
+        
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def accept(self, args):
+        """
+        Decide whether a command line can run in this session.
+
+        Parameters:
+        args: the command's arguments.
+
+        Returns: None, or why the client must run it itself.
+        """
+        parser = argparse.ArgumentParser(add_help=False)
+        parser.add_argument("--host", action="store", dest="zf_host",
+                            default="www.zenfolio.com")
+        parser.add_argument("--nossl", action="store_false", dest="ssl")
+        known, rest = parser.parse_known_args(args)
+        if ( known.zf_host != self._zf_host or
+             bool(known.ssl) != bool(self._ssl) ):
+            return "the agent is connected to another host"
+        return None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def refresh(self):
+        """
+        Get the session ready for a command: load the group hierarchy
+        again if it is older than --refresh allows (it may have been
+        changed elsewhere), and log in again if that fails, as it does
+        once the login has expired or the connection has gone.
+
+        Returns: nonzero if the session can be used.
+        """
+        if ( self._loaded != None and
+             time.time() - self._loaded < self.the_args.refresh ):
+            return 1
+        self._loaded = None
+        loaded = 0
+        try:
+            loaded = self.retrieve_group_hierarchy()
+        except (IOError, httplib.HTTPException):
+            pass
+        if ( not loaded ):
+            # Nobody is there to type the password again.
+            self.reset()
+            if ( not (self.login(self._password, self.the_args.user) and
+                      self.retrieve_group_hierarchy()) ):
+                return 0
+        self._loaded = time.time()
+        return 1
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run_command(self, command_class, args):
+        """
+        Run a client's command in the session (see ZfCLI.run_command),
+        refreshing the session first.
+        """
+        try:
+            ready = self.refresh()
+        except (IOError, httplib.HTTPException):
+            ready = 0
+        if ( not ready ):
+            print "The agent could not log in to Zenfolio again."
+            return 1
+        status = ZfCLI.run_command(self, command_class, args)
+        if ( status != 0 ):
+            # The login may have expired; check before the next command.
+            self._loaded = None
+        return status
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def run(self):
+        self.parse_args()
+        self.keep_alive = True
+
+        if ( self.get_password() ):
+            if ( not self.retrieve_group_hierarchy() ):
+                print "Could not load the group hierarchy"
+                return
+            self._loaded = time.time()
+
+            path = ( self.the_args.socket or
+                     zfagent.socket_path(self.the_args.user) )
+            # Clean up the socket when stopped.
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            print "Agent for", self.the_args.user, "listening on", path
+            sys.stdout.flush()
+            try:
+                zfagent.serve(self, path, COMMANDS,
+                              self.the_args.idle_timeout, self.accept)
+            except (socket.error, OSError) as e:
+                print e
+            except KeyboardInterrupt:
+                print
@@ -28,29 +28,287 @@
 #
 ###############################################################################
 
+from zucla.zfapi import ZfAPI
 from zucla.zfcli import ZfCLI, ZfCLIException
 from zucla.zflib import ZfLibException
+from zucla.zfexec import PlanExecutor
+from zucla.zfpipeline import BackupPipeline
+from zucla.zfprefetch import PhotosetPrefetcher
+from zucla.zfstate import ZfState
+from zucla.zfhash import Hasher, HashCache
+from zucla.zfjournal import Journal
+from zucla.zfwatch import TreeWatcher
+from zucla.zffilter import parse_size
+from zucla.zfcoord import Coordinator, ShardRules, parse_shard, shard_of
+from zucla.zfdedupe import DuplicateIndex, POLICIES
+from zucla.zfsched import UploadScheduler, ORDERS, parse_priority
+from zucla.zfadapt import AdaptiveLimit, parse_range
+from zucla.zfstream import PhotoIndex, index_entries, set_memory_limit
+from zucla import zfdiff
+from zucla import zffilter
+from zucla import zfplan
+from zucla import zfscan
+from zucla import zftransform
 
 import argparse
-from os.path import relpath, basename, dirname, getsize
+from collections import deque
+from os.path import relpath, basename, dirname
 import os.path
 import os
 import sys
-import mimetypes
+import thread
+import time
+
+def _jobs(args):
+    """
+    INTERNAL: Does the backup run in a BackupPipeline (--jobs N, N > 1)?
+    """
+    return (args.jobs or 1) > 1
+
+# Options that cannot be used together, as (test, message), checked in
+# order by Backup.check_options.  --dedupe and --track-moves keep their
+# state in the Backup itself and work only in a serial backup; --execute
+# carries out the plan as written and reads nothing else.
+OPTION_CONFLICTS = [
+    (lambda a: a.shard and (a.plan or a.execute or a.watch),
+     "--shard cannot be combined with --plan, --execute or --watch"),
+    (lambda a: a.shard and not a.coord,
+     "--shard needs --coord"),
+    (lambda a: a.coord and not a.shard,
+     "--coord needs --shard"),
+    (lambda a: a.dedupe and (a.plan or a.execute or _jobs(a)),
+     "--dedupe cannot be combined with --plan, --execute or --jobs"),
+    (lambda a: a.track_moves and not a.state,
+     "--track-moves needs --state"),
+    (lambda a: a.track_moves and (a.plan or a.execute or _jobs(a)),
+     "--track-moves cannot be combined with --plan, --execute or --jobs"),
+    (lambda a: a.adaptive and (a.plan or not (a.execute or _jobs(a))),
+     "--adaptive needs --jobs or --execute"),
+    (lambda a: a.adaptive_meta and (a.plan or a.execute or not _jobs(a)),
+     "--adaptive-meta needs --jobs"),
+    (lambda a: a.execute and (a.state or a.journal or a.resume or a.watch or
+                              a.hash or a.verify_hash or a.chunk != None or
+                              a.resize != None or a.quality != None),
+     "--execute cannot be combined with --state, --journal, --resume, " +
+     "--watch, --hash, --verify-hash, --chunk, --resize or --quality"),
+    (lambda a: not a.execute and (a.local_path == None or
+                                  a.group_path == None),
+     "local_path and group_path are required"),
+    (lambda a: a.watch and (a.mirror or a.journal or a.plan or _jobs(a)),
+     "--watch cannot be combined with --mirror, --journal, --plan or --jobs"),
+    (lambda a: a.resume and not a.journal,
+     "--resume needs --journal"),
+    (lambda a: a.journal and a.plan,
+     "--journal cannot be combined with --plan"),
+    (lambda a: a.chunk != None and (a.plan or a.execute or _jobs(a)),
+     "--chunk cannot be combined with --plan, --execute or --jobs"),
+    (lambda a: a.chunk != None and a.chunk < 1,
+     "--chunk must be at least 1"),
+    (lambda a: (a.resize != None or a.quality != None) and
+               (a.plan or a.hash or a.verify_hash),
+     "--resize and --quality cannot be combined with --plan, --hash " +
+     "or --verify-hash"),
+]
 
 class Backup(ZfCLI):
 
     def __init__(self):
         ZfCLI.__init__(self, "backup")
-        self._parser.add_argument("local_path", action="store", \
+        self._parser.add_argument("--mirror", action="store_true",
+                                  help="Delete photos from each visited " + \
+                                      "gallery that no longer exist " + \
+                                      "locally.")
+        self._parser.add_argument("--dry-run", action="store_true",
+                                  dest="dry_run",
+                                  help="With --mirror, only show the " + \
+                                      "photos that would be deleted.")
+        self._parser.add_argument("--max-delete", action="store",
+                                  dest="max_delete", type=int, default=25,
+                                  metavar="PERCENT",
+                                  help="With --mirror, leave a gallery " + \
+                                      "alone if more than PERCENT of its " + \
+                                      "photos would be deleted (default " + \
+                                      "25, 100 disables the check).")
+        self._parser.add_argument("--delete-batch", action="store",
+                                  dest="delete_batch", type=int, default=100,
+                                  metavar="N",
+                                  help="With --mirror, delete up to N " + \
+                                      "photos per API call (default 100).")
+        self._parser.add_argument("--plan", action="store", metavar="FILE",
+                                  help="Compare the local tree with " + \
+                                      "Zenfolio and write what would be " + \
+                                      "done to FILE, without uploading.")
+        self._parser.add_argument("--execute", action="store",
+                                  metavar="FILE",
+                                  help="Carry out a plan written by " + \
+                                      "--plan.  No paths are needed.")
+        self._parser.add_argument("-j", "--jobs", action="store", type=int,
+                                  metavar="N",
+                                  help="Upload N files at a time.  With " + \
+                                      "N > 1, galleries are also looked " + \
+                                      "up and created concurrently " + \
+                                      "(default 1; 4 with --execute).")
+        self._parser.add_argument("--meta-jobs", action="store", type=int,
+                                  dest="meta_jobs", default=4, metavar="N",
+                                  help="With --jobs, look up N " + \
+                                      "galleries at a time (default 4).")
+        self._parser.add_argument("--order", action="store",
+                                  default="fifo", choices=ORDERS,
+                                  help="With --jobs or --execute, upload " + \
+                                      "the files waiting in the queue in " + \
+                                      "this order: as found (fifo, the " + \
+                                      "default), smallest or largest " + \
+                                      "first, or mixed (alternately).")
+        self._parser.add_argument("--priority", action="append",
+                                  default=[], metavar="GLOB=N",
+                                  help="With --jobs or --execute, upload " + \
+                                      "to galleries whose Zenfolio path " + \
+                                      "matches GLOB with priority N " + \
+                                      "(higher first; default 0).  May " + \
+                                      "be given more than once.")
+        self._parser.add_argument("--max-in-flight", action="store",
+                                  dest="max_in_flight", metavar="SIZE",
+                                  help="With --jobs or --execute, upload " + \
+                                      "at most SIZE bytes at a time (for " + \
+                                      "example, 200M).")
+        self._parser.add_argument("--upload-queue", action="store",
+                                  type=int, dest="upload_queue", metavar="N",
+                                  help="With --jobs or --execute, order " + \
+                                      "up to N waiting files (default: 4 " + \
+                                      "per job, or 256 per job with " + \
+                                      "--order other than fifo).")
+        self._parser.add_argument("--adaptive", action="store",
+                                  metavar="MIN-MAX",
+                                  help="With --jobs or --execute, adjust " + \
+                                      "the number of concurrent uploads " + \
+                                      "between MIN and MAX, starting " + \
+                                      "from --jobs: fewer when uploads " + \
+                                      "fail, are retried or slow down, " + \
+                                      "more while throughput grows.")
+        self._parser.add_argument("--adaptive-meta", action="store",
+                                  dest="adaptive_meta", metavar="MIN-MAX",
+                                  help="With --jobs, adjust the number " + \
+                                      "of concurrent gallery lookups " + \
+                                      "between MIN and MAX in the same " + \
+                                      "way, starting from --meta-jobs.")
+        self._parser.add_argument("--rate", action="store", type=float,
+                                  default=1.0, metavar="MBPS",
+                                  help="With --plan, the expected upload " + \
+                                      "rate in MB/s used to estimate " + \
+                                      "the duration (default 1.0).")
+        self._parser.add_argument("--prefetch", action="store", type=int,
+                                  default=4, metavar="K",
+                                  help="Load the galleries of the next K " + \
+                                      "directories in the background " + \
+                                      "(default 4, 0 disables).")
+        zffilter.add_arguments(self._parser)
+        self._parser.add_argument("--state", action="store", metavar="FILE",
+                                  help="Record uploaded files in the " + \
+                                      "sqlite database FILE, and skip " + \
+                                      "directories that have not " + \
+                                      "changed since they were recorded.")
+        self._parser.add_argument("--track-moves", action="store_true",
+                                  dest="track_moves",
+                                  help="With --state, recognize files " + \
+                                      "that were moved or renamed since " + \
+                                      "they were recorded and move or " + \
+                                      "rename their photos on Zenfolio " + \
+                                      "instead of uploading them again.")
+        self._parser.add_argument("--journal", action="store",
+                                  metavar="FILE",
+                                  help="Record finished files and " + \
+                                      "directories in FILE, so that an " + \
+                                      "interrupted backup can be " + \
+                                      "resumed.  FILE is deleted when " + \
+                                      "the backup finishes.")
+        self._parser.add_argument("--resume", action="store_true",
+                                  help="Continue the backup recorded in " + \
+                                      "--journal, skipping the work it " + \
+                                      "finished.")
+        self._parser.add_argument("--watch", action="store_true",
+                                  help="After backing up, keep watching " + \
+                                      "local_path (with inotify) and " + \
+                                      "upload new image files as they " + \
+                                      "appear.")
+        self._parser.add_argument("--settle", action="store", type=float,
+                                  default=2.0, metavar="SECONDS",
+                                  help="With --watch, wait until a file " + \
+                                      "has not changed for SECONDS " + \
+                                      "before uploading it (default 2).")
+        self._parser.add_argument("--rescan", action="store", type=float,
+                                  default=3600.0, metavar="SECONDS",
+                                  help="With --watch, walk the whole " + \
+                                      "tree again every SECONDS " + \
+                                      "(default 3600).")
+        self._parser.add_argument("--shard", action="store", metavar="I/N",
+                                  help="Back up only shard I of N of the " + \
+                                      "tree, so that N processes (on " + \
+                                      "one host or several) can share " + \
+                                      "it.  Needs --coord.")
+        self._parser.add_argument("--shard-by", action="store",
+                                  dest="shard_by", default="top",
+                                  choices=["top", "hash"],
+                                  help="With --shard, split the tree by " + \
+                                      "top-level directory (the default) " + \
+                                      "or by a hash of each directory's " + \
+                                      "path.")
+        self._parser.add_argument("--coord", action="store", metavar="FILE",
+                                  help="With --shard, the sqlite database " + \
+                                      "FILE (on a file system all the " + \
+                                      "shards can reach) through which " + \
+                                      "the shards create groups and " + \
+                                      "galleries and merge their counts.")
+        self._parser.add_argument("--hash", action="store_true",
+                                  help="Also compare content hashes of " + \
+                                      "files whose size has not changed.")
+        self._parser.add_argument("--verify-hash", action="store_true",
+                                  dest="verify_hash",
+                                  help="Like --hash, but read every " + \
+                                      "file again instead of trusting " + \
+                                      "cached hashes or --state.")
+        self._parser.add_argument("--dedupe", action="store",
+                                  choices=POLICIES, metavar="POLICY",
+                                  help="Find image files whose content " + \
+                                      "is already on Zenfolio (uploaded " + \
+                                      "from another directory, now or " + \
+                                      "according to --state), and " + \
+                                      "\"skip\" them, \"link\" the " + \
+                                      "existing photo (into collections " + \
+                                      "only; otherwise skip) or just " + \
+                                      "\"report\" them.  Implies --hash.")
+        self._parser.add_argument("--hash-jobs", action="store", type=int,
+                                  dest="hash_jobs", metavar="N",
+                                  help="Hash with N processes (default: " + \
+                                      "one per CPU).")
+        self._parser.add_argument("--chunk", action="store", type=int,
+                                  metavar="N",
+                                  help="Back up directories with more " + \
+                                      "than N files N files at a time, " + \
+                                      "paging through their galleries " + \
+                                      "instead of loading them whole " + \
+                                      "(default: off; 10000 with " + \
+                                      "--max-memory).")
+        self._parser.add_argument("--max-memory", action="store",
+                                  dest="max_memory", metavar="SIZE",
+                                  help="Stop with an error rather than " + \
+                                      "use more than SIZE of memory " + \
+                                      "(address space, for example 2G), " + \
+                                      "and keep the photo lists of " + \
+                                      "large galleries on disk well " + \
+                                      "below that.")
+        self._parser.add_argument("--scan-jobs", action="store", type=int,
+                                  dest="scan_jobs", default=8, metavar="N",
+                                  help="Read directories with N threads " + \
+                                      "(default 8).")
+        zftransform.add_arguments(self._parser)
+        self._parser.add_argument("local_path", action="store", nargs="?", \
                                    help="Path to back up")
-        self._parser.add_argument("group_path", action="store", \
+        self._parser.add_argument("group_path", action="store", nargs="?", \
                                    help="Group to back up to, specified " + \
                                    "as a path delimited with slashes " + \
                                    "(\"/\") For example: " + \
                                    "\"/All Photographs/Soccer/Earthquakes\".")
 
-        mimetypes.init()
         self.max_socket_retries = 3
 
         self._add_files = 0
@@ -60,6 +318,33 @@ class Backup(ZfCLI):
         self._new_galleries = 0
         self._new_groups = 0
         self._total_retries = 0
+        self._del_files = 0
+        self._kept_galleries = 0
+        self._failed_files = 0
+        self._state_db = None
+        self._hasher = None
+        self._prefetcher = None
+        self._early_walk = None
+        self._limits = []
+        self._meta_limit = None
+        self._journal = None
+        self._failed_dirs = 0
+        self._rules = None
+        self._walk_rules = None
+        self._coord = None
+        self._shard = None
+        self._coord_reported = 0
+        self._dedupe = None
+        self._moved_files = 0
+        self._moved_bytes = 0
+        self._moved_ids = set()
+        self._deferred = {}
+        self._priorities = []
+        self._max_in_flight = None
+        self._chunk = None
+        self._max_memory = None
+        self._streamed_dirs = 0
+        self._transformer = None
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def is_image_file(self, filename):
@@ -72,17 +357,8 @@ class Backup(ZfCLI):
         Returns: True (nonzero) if the file is an image file.  False otherwise.
         """
 
-        if ( os.path.exists(filename) ):
-            type, encoding = mimetypes.guess_type(filename)
-            if ( type == None ):
-                return False
-            else:
-                if ( "image/" in type ):
-                    return True
-                else:
-                    return False
-        else:
-            return False
+        return ( zfscan.is_image_name(filename) and 
+                 os.path.exists(filename) )
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def print_summary(self):
@@ -103,7 +379,69 @@ class Backup(ZfCLI):
         print "  Skipped {:5d} old image files".format(self._old_files)
         print "  Added   {:5d} image files".format(self._add_files)
         print "  Updated {:5d} image files".format(self._new_files)
+        print "  Deleted {:5d} remote image files".format(self._del_files)
+        if ( self.the_args.track_moves ):
+            print "  Moved   {:5d} photos ({:.1f} MB not sent again)".format(
+                self._moved_files, self._moved_bytes / 1e6)
+        if ( self._failed_files ):
+            print "  Failed  {:5d} image files".format(self._failed_files)
+        if ( self._kept_galleries ):
+            print "  Spared  {:5d} galleries over the --max-delete limit".\
+                format(self._kept_galleries)
         print "  Retried {:5d} operations".format(self._total_retries)
+        for limit in self._limits:
+            print "  Ran     {:5d} {:s} at a time at the end ({:d} to {:d}; " \
+                "{:d} up, {:d} down)".format(
+                    limit.limit, limit.name, limit.lowest, limit.highest,
+                    limit.increases, limit.decreases)
+        if ( self._rules != None ):
+            print " Excluded {:5d} files and {:d} directories by rule".format(
+                self._rules.excluded_files, self._rules.excluded_dirs)
+        if ( self._hasher != None ):
+            print "   Hashed {:5d} files ({:d} hashes cached)".format(
+                self._hasher.hashed, self._hasher.cached)
+        if ( self._journal != None and self._journal.resumed_files ):
+            print "  Resumed {:5d} files from {:s}".format(
+                self._journal.resumed_files, self._journal.filename)
+        if ( self._prefetcher != None ):
+            print "  Fetched {:5d} galleries ahead ({:d} misses)".format(
+                self._prefetcher.hits, self._prefetcher.misses)
+        if ( self._transformer != None ):
+            print "  Resized {:5d} images ({:d} cached, {:d} sent as they " \
+                "were; {:.1f} MB smaller)".format(
+                    self._transformer.transformed, self._transformer.cached,
+                    self._transformer.kept,
+                    self._transformer.saved_bytes / 1e6)
+        if ( self._streamed_dirs ):
+            print " Streamed {:5d} large directories in chunks of {:d}".\
+                format(self._streamed_dirs, self._chunk)
+        if ( self._dedupe != None ):
+            if ( self._dedupe.policy == "report" ):
+                saved = "could be saved"
+            else:
+                saved = "saved"
+            print "    Found {:5d} duplicates ({:.1f} MB {:s})".format(
+                self._dedupe.duplicates, self._dedupe.saved_bytes / 1e6, saved)
+            if ( self._dedupe.linked ):
+                print "   Linked {:5d} duplicates into collections".format(
+                    self._dedupe.linked)
+
+        if ( self._coord != None ):
+            totals, finished = self._coord.totals()
+            print ""
+            print "All {:d} shards ({:d} finished):".format(self._coord.count,
+                                                          finished)
+            print "  Created {:5d} new groups".format(totals['groups'])
+            print "      and {:5d} new galleries".format(totals['galleries'])
+            print "  Skipped {:5d} non-image files".format(totals['skipped'])
+            print "  Skipped {:5d} old image files".format(totals['old'])
+            print "  Added   {:5d} image files".format(totals['added'])
+            print "  Updated {:5d} image files".format(totals['updated'])
+            print "  Deleted {:5d} remote image files".format(
+                totals['deleted'])
+            if ( totals['failed'] ):
+                print "  Failed  {:5d} image files".format(totals['failed'])
+            print "  Retried {:5d} operations".format(totals['retried'])
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def print_action(self, action, filename):
@@ -122,170 +460,1463 @@ class Backup(ZfCLI):
             print "          to:", self._zf_path
 
 
-        print "{:4s} {:4d}/{:4d}: {:s}".format(action, 
-                                               self._cur_file, 
-                                               self._num_files, 
-                                               filename)
+        if ( self._num_files == None ):
+            # Streaming; the number of files is not known.
+            print "{:4s} {:4d}: {:s}".format(action, self._cur_file, filename)
+        else:
+            print "{:4s} {:4d}/{:4d}: {:s}".format(action, 
+                                                   self._cur_file, 
+                                                   self._num_files, 
+                                                   filename)
+        sys.stdout.flush()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def with_retries(self, func, *args, **kwargs):
+        """
+        Call func, retrying (after logging in again) if the connection
+        is broken or reset by the server.
+
+        Parameters:
+            func: the function to call
+            args, kwargs: arguments to pass to func
+
+        Returns: Whatever func returns.
+        """
+
+        retries = 0
+        while ( True ):
+            try:
+                result = func(*args, **kwargs)
+            except IOError as e:
+                # Broken pipe or Connection reset by peer
+                if ( retries < self.max_socket_retries \
+                     and (e.errno == 32 or e.errno == 104) ):
+                    retries += 1
+                    self._total_retries += 1
+                    print "{:s}!  Retry #{:d} - ".format(e.strerror, retries),
+                    self.reset()
+                    if ( not self.get_password() ):
+                        raise e
+                # Not something we want to handle
+                else:
+                    raise e
+            else:
+                # A call that fails in the end counts as one error (when
+                # it is released), however often it was retried.
+                if ( self._meta_limit != None ):
+                    for i in range(retries):
+                        self._meta_limit.error()
+                return result
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def create_group(self, group_path, title, caption='', custom_reference=''):
+        """
+        Create a group, through the coordination database when sharded
+        (--shard) so that only one shard creates it.
+
+        Parameters and return value as for ZfLib.create_group.
+        """
+
+        create = lambda: ZfCLI.create_group(self, group_path, title,
+                                            caption, custom_reference)
+        if ( self._coord == None ):
+            return create()
+        group, created = self._coord.create(self, "Group", group_path,
+                                            title, create)
+        if ( not created ):
+            # Counted by the shard that did create it
+            self._new_groups -= 1
+        return group
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def create_gallery(self, group_path, title, caption='', keywords=[],
+                       categories=[], custom_reference=''):
+        """
+        Create a gallery, through the coordination database when sharded
+        (--shard) so that only one shard creates it.
+
+        Parameters and return value as for ZfLib.create_gallery.
+        """
+
+        create = lambda: ZfCLI.create_gallery(self, group_path, title,
+                                              caption, keywords, categories,
+                                              custom_reference)
+        if ( self._coord == None ):
+            return create()
+        photoset, created = self._coord.create(self, "PhotoSet", group_path,
+                                               title, create)
+        if ( not created ):
+            # Counted by the shard that did create it
+            self._new_galleries -= 1
+        return photoset
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def load_photoset(self, include_photos="True"):
+        """
+        Get the photoset for the current Zenfolio path, from the
+        prefetcher if it has it.
+
+        Parameters:
+            include_photos: "False" to leave out the photos (which a
+                streamed directory pages through instead).
+
+        Returns: A photoset snapshot including its photos, or None if
+            there is no gallery at the current path.
+        """
+
+        photoset = None
+        if ( self._prefetcher != None and include_photos == "True" ):
+            photoset = self._prefetcher.get(self._zf_path)
+        if ( photoset == None ):
+            photoset = self.get_photoset(self._zf_path,
+                                         level="Level2",
+                                         include_photos=include_photos)
+        return photoset
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def find_or_create_photoset(self, include_photos="True"):
+        """
+        Find the photoset for the current Zenfolio path, creating the
+        gallery if it doesn't exist.
+
+        Parameters:
+            include_photos: as for load_photoset.
+
+        Returns: A photoset snapshot including its photos.
+        """
+
+        # Find the photoset for this location
+        photoset = self.load_photoset(include_photos)
+
+        # Create it if it doesn't exist
+        if ( photoset == None ):
+            self._new_galleries += 1
+            print " New gallery:", self._zf_path
+            self.with_retries(self.create_gallery,
+                              dirname(self._zf_path),
+                              basename(self._zf_path))
+            photoset = self.get_photoset(self._zf_path,
+                                         level="Level2",
+                                         include_photos=include_photos)
+        return photoset
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def load_index(self, photoset):
+        """
+        Page the photos of a photoset into a PhotoIndex (--chunk).
+
+        Parameters:
+            photoset: photoset snapshot (without photos).
+
+        Returns: The PhotoIndex.  The caller closes it.
+        """
+
+        index = PhotoIndex(index_entries(self._max_memory))
+        try:
+            while ( True ):
+                photos = self.with_retries(self.LoadPhotoSetPhotos,
+                                           photoset['Id'], index.total,
+                                           self._chunk)
+                if ( photos == None ):
+                    raise ZfLibException("load_index",
+                                         "Could not load the photos of " +
+                                         self._zf_path)
+                for photo in photos:
+                    index.add(photo)
+                if ( len(photos) < self._chunk ):
+                    break
+        except:
+            index.close()
+            raise
+        return index
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def over_delete_limit(self, stale, total):
+        """
+        Check --max-delete, which keeps us from emptying a gallery just
+        because, for example, a disk wasn't mounted.
+
+        Parameters:
+            stale: number of photos that would be deleted.
+            total: number of photos in the gallery.
+
+        Returns: True (and says so) if the gallery must be left alone.
+        """
+
+        if ( self.the_args.max_delete < 100 and 
+             stale * 100 > self.the_args.max_delete * total ):
+            self._kept_galleries += 1
+            print "Keep {:4d}/{:4d}: more than {:d}% would be deleted".format(
+                stale, total, self.the_args.max_delete)
+            return True
+        return False
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def mirror_photoset(self, photoset, local_files):
+        """
+        Delete the photos in a photoset that have no local counterpart.
+
+        Parameters:
+            photoset: photoset snapshot (including photos) to prune.
+            local_files: set of the image file names in the local directory
+                (including files left out by filter rules).
+
+        Returns: Nothing
+        """
+
+        if ( photoset == None or photoset['Photos'] == [] ):
+            return
+
+        stale = [photo for photo in photoset['Photos']
+                 if photo['FileName'] not in local_files and
+                    photo['Id'] not in self._moved_ids]
+        if ( stale == [] ):
+            return
+
+        if ( self.over_delete_limit(len(stale), len(photoset['Photos'])) ):
+            return
+
+        # A photo whose file has gone may turn up in a directory that
+        # hasn't been visited yet.  Leave it until the end of the run.
+        if ( self.the_args.track_moves ):
+            deferred = [photo for photo in stale
+                        if self.may_have_moved(photo)]
+            for photo in deferred:
+                self._deferred[photo['Id']] = photo
+                stale.remove(photo)
+
+        for photo in stale:
+            if ( self.the_args.dry_run ):
+                print "Del? {:s}".format(photo['FileName'])
+            else:
+                print "Del  {:s}".format(photo['FileName'])
+        sys.stdout.flush()
+
+        if ( not self.the_args.dry_run ):
+            self._del_files += self.with_retries(self.delete_photos, stale,
+                                                 self.the_args.delete_batch)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def may_have_moved(self, photo):
+        """
+        Check whether the file a photo was uploaded from is gone from
+        where the state database recorded it (--track-moves).
+
+        Parameters:
+            photo: the photo from a photoset snapshot
+
+        Returns: True if the file may have been moved elsewhere.
+        """
+
+        path = self._state_db.photo_path(photo['Id'])
+        return ( path != None and not os.path.exists(path) )
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def delete_deferred(self):
+        """
+        Delete the photos that --mirror left for the end of the run
+        because their files might have moved, and that did not turn up.
+
+        Parameters:
+            None.
+
+        Returns: Nothing
+        """
+
+        stale = [photo for photo_id, photo in sorted(self._deferred.items())
+                 if photo_id not in self._moved_ids]
+        self._deferred = {}
+        if ( stale == [] ):
+            return
+        for photo in stale:
+            if ( self.the_args.dry_run ):
+                print "Del? {:s}".format(photo['FileName'])
+            else:
+                print "Del  {:s}".format(photo['FileName'])
+        sys.stdout.flush()
+        if ( not self.the_args.dry_run ):
+            self._del_files += self.with_retries(self.delete_photos, stale,
+                                                 self.the_args.delete_batch)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def move_photo(self, f, photo_path, stat, moved, photoset):
+        """
+        Move and/or rename the photo of a file that was moved or renamed
+        locally, instead of uploading it again (--track-moves).
+
+        Parameters:
+            f: name of the file
+            photo_path: local path of the file
+            stat: os.stat result for the file
+            moved: (old path, photo_id, photoset_id) from the state
+                database
+            photoset: the current photoset
+
+        Returns: True if the photo was moved; False if it has to be
+            uploaded after all.
+        """
+
+        old_path, photo_id, old_photoset_id = moved
+        # "Move 123/123:"
+        self.print_action("Move", f)
+        print "        from:", old_path
+        if ( old_photoset_id != photoset['Id'] and
+             not self.with_retries(self.MovePhoto, old_photoset_id,
+                                   photo_id, photoset['Id'],
+                                   len(photoset.get('Photos') or []) or
+                                   photoset.get('PhotoCount', 0)) ):
+            # Probably deleted on Zenfolio since
+            print "              (could not move it; uploading)"
+            return False
+        if ( basename(old_path) != f ):
+            self.with_retries(self.UpdatePhoto, photo_id,
+                              ZfAPI.PhotoUpdater(file_name=f))
+
+        self._moved_files += 1
+        self._moved_bytes += stat.st_size
+        self._moved_ids.add(photo_id)
+        self._state_db.forget_file(old_path)
+        self.record_file(photo_path, stat, photo_id, photoset['Id'])
+        return True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def record_file(self, photo_path, stat, photo_id, photoset_id,
+                    duplicate_of=None):
+        """
+        Record a file that is on Zenfolio in the state database, the
+        journal and the duplicate index (if any).
+
+        Parameters:
+            photo_path: local path of the file
+            stat: os.stat result for the file
+            photo_id: Id of the photo on Zenfolio (None for a duplicate)
+            photoset_id: Id of the photoset that holds the photo
+            duplicate_of: path of the file whose photo a duplicate uses
+
+        Returns: Nothing
+        """
+
+        digest = None
+        if ( self._hasher != None ):
+            digest = self._hasher.result(photo_path, stat)
+        if ( self._state_db != None ):
+            self._state_db.record_file(photo_path, stat, photo_id, 
+                                       photoset_id, digest, duplicate_of)
+        if ( self._dedupe != None ):
+            self._dedupe.add(digest, os.path.abspath(photo_path), photo_id,
+                             photoset_id)
+        # Without a photo, --resume has to try the file again.
+        if ( self._journal != None and photo_id != None ):
+            self._journal.file_done(photo_path, stat, photo_id)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def skip_unchanged(self, dirs, files, images):
+        """
+        Check the current directory against the state database.
+
+        Parameters:
+            dirs: list of subdirectories of the current directory
+            files: list of files in the current directory
+            images: dict of image file name -> os.stat result
+
+        Returns: True (after counting its files) if the directory is
+            already backed up as it is now.
+        """
+
+        if ( dirs != [] and self._state_db.group_id(self._local_path) == None ):
+            return False
+
+        if ( images != {} and
+             not self._state_db.directory_unchanged(self._local_path, images) ):
+            return False
+
+        self._old_files += len(images)
+        self._skip_files += len(files) - len(images)
+        print "   Unchanged: {:d} image files".format(len(images))
+        return True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def skip_journaled(self, files, images):
+        """
+        Check the current directory against the journal (--resume).
+
+        Parameters:
+            files: list of files in the current directory
+            images: dict of image file name -> os.stat result
+
+        Returns: True (after counting its files) if the directory was
+            finished by an earlier run and its images have not changed.
+        """
+
+        if ( not self._journal.directory_unchanged(self._local_path, images) ):
+            return False
+
+        self._old_files += len(images)
+        self._skip_files += len(files) - len(images)
+        print "    Finished: {:d} image files".format(len(images))
+        return True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def content_changed(self, photo_path, stat, photo, known):
+        """
+        Compare the content hash of a local file with its photo.
+
+        Parameters:
+            photo_path: local path of the file
+            stat: os.stat result for the file
+            photo: the photo from the photoset snapshot
+            known: state database records for the current directory
+
+        Returns: True if the hashes differ.  False if they match, or if
+            the photo's hash is not known.
+        """
+
+        return self.hashes_differ(self._hasher.result(photo_path, stat),
+                                  photo, known.get(basename(photo_path)))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def hashes_differ(self, local_hash, photo, row):
+        """
+        Compare a content hash with that of a photo, which is in the
+        photoset snapshot or, failing that, in the state database.
+
+        Parameters:
+            local_hash: hex digest of the local file
+            photo: the photo from the photoset snapshot
+            row: state database record of the file, or None
+
+        Returns: True if the hashes differ.  False if they match, or if
+            the photo's hash is not known.
+        """
+
+        remote_hash = photo.get('FileHash')
+        if ( remote_hash == None and row != None and row[4] == photo['Id'] ):
+            remote_hash = row[3]
+        if ( remote_hash == None ):
+            return False
+        return local_hash.lower() != remote_hash.lower()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def find_duplicate(self, photo_path, stat):
+        """
+        Look for a photo on Zenfolio with the same content as a file
+        (--dedupe).
+
+        Parameters:
+            photo_path: local path of the file
+            stat: os.stat result for the file
+
+        Returns: (path, photo_id, photoset_id) of the file the photo was
+            uploaded from, or None.
+        """
+
+        original = self._dedupe.find(self._hasher.result(photo_path, stat),
+                                     os.path.abspath(photo_path),
+                                     stat.st_size)
+        if ( original != None ):
+            print "   Duplicate: {:s} is the same as {:s}".format(
+                basename(photo_path), original[0])
+        return original
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def use_duplicate(self, f, photo_path, stat, original, photoset):
+        """
+        Use the photo already on Zenfolio instead of uploading a
+        duplicate: link it into the current photoset if that is a
+        collection and --dedupe is "link", otherwise just skip the file.
+
+        Parameters:
+            f: name of the file
+            photo_path: local path of the file
+            stat: os.stat result for the file
+            original: (path, photo_id, photoset_id) from find_duplicate
+            photoset: the current photoset
+
+        Returns: Nothing
+        """
+
+        photo_id = original[1]
+        photoset_id = original[2]
+        if ( self._dedupe.policy == "link" and 
+             photoset.get('Type') == "Collection" ):
+            # "Link 123/123:"
+            self.print_action("Link", f)
+            if ( self.with_retries(self.CollectionAddPhoto, photoset['Id'],
+                                   photo_id) ):
+                self._dedupe.linked += 1
+                photoset_id = photoset['Id']
+        else:
+            # " Dup 123/123:"
+            self.print_action("Dup", f)
+        self._old_files += 1
+        # Recorded without a photo of its own: the photo belongs to the
+        # original, and goes if the original does.
+        self.record_file(photo_path, stat, None, photoset_id, original[0])
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def backup_directory(self, dirs, files, images, excluded=()):
+        """
+        Back up the files in the current local directory.
+
+        Parameters:
+            dirs: list of subdirectories of the current directory
+            files: list of files in the current directory
+            images: dict of image file name -> os.stat result
+            excluded: names of the files left out by filter rules,
+                whose photos --mirror keeps
+
+        Returns: Nothing
+        """
+
+        print "   Archiving:", self._local_path
+        print "          to:", self._zf_path
+
+        # Nothing to ask Zenfolio about if nothing changed since the
+        # last run.  (Mirroring and verifying need the remote photos
+        # regardless.)
+        if ( self._state_db != None and not self.the_args.mirror and
+             not self.the_args.verify_hash and
+             self.skip_unchanged(dirs, files, images) ):
+            return
+        if ( self._journal != None and self.skip_journaled(files, images) ):
+            return
+
+        # Start hashing while the first files upload.
+        known = {}
+        if ( self._hasher != None ):
+            self._hasher.submit([(os.path.join(self._local_path, f), 
+                                  images[f]) for f in sorted(images)])
+            if ( self._state_db != None ):
+                known = self._state_db.directory_files(self._local_path)
+        if ( self._transformer != None ):
+            self._transformer.submit([(os.path.join(self._local_path, f),
+                                       images[f]) for f in sorted(images)])
+
+        # If there are directories in this location, then 
+        # find/create a group for this location
+        if ( dirs != [] ):
+            self.find_or_create_group()
+
+        self._num_files = len(files)
+        self._cur_file = 0
+        photoset = None
+        for f in files:
+            self._cur_file += 1
+            # If the file is an image file, then find or create
+            # A photoset for it.
+            photo_path = os.path.join(self._local_path, f)
+            if ( f in images and self._journal != None and
+                 self._journal.is_file_done(photo_path, images[f]) ):
+                # Finished by the run we are resuming
+                self._old_files += 1
+                self.print_action("Done", f)
+            elif ( f in images ):
+                if ( photoset == None ):
+                    photoset = self.find_or_create_photoset()
+                self.backup_file(f, images[f], 
+                                 self.get_photo(photoset, f), photoset, 
+                                 known)
+
+            # Not an image file
+            else:
+                self._skip_files += 1
+                # "Skip 123/123:"
+                self.print_action("Skip", f)
+
+        # Remove what has been deleted locally.  A directory without
+        # images may still have a gallery full of stale photos.
+        if ( self.the_args.mirror ):
+            if ( photoset == None ):
+                photoset = self.load_photoset()
+            self.mirror_photoset(photoset, set(images) | set(excluded))
+
+        if ( self._journal != None ):
+            self._journal.dir_done(self._local_path)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def find_or_create_group(self):
+        """
+        Find the group for the current Zenfolio path, creating it if it
+        doesn't exist, and record it in the state database.
+
+        Parameters:
+            None.
+
+        Returns: Nothing
+        """
+
+        group = self.get_group(self._zf_path)
+        if ( group == None):
+            self._new_groups += 1
+            print "   New group:", self._zf_path
+            group = self.with_retries(self.create_group,
+                                      dirname(self._zf_path),
+                                      basename(self._zf_path))
+        if ( self._state_db != None and group != None ):
+            self._state_db.record_group(self._local_path, group['Id'])
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def backup_file(self, f, stat, photo, photoset, known):
+        """
+        Back up an image file of the current directory: upload it if
+        its photo is missing or different, unless it was moved or is a
+        duplicate.
+
+        Parameters:
+            f: name of the file
+            stat: os.stat result for the file
+            photo: its photo in the photoset, or None
+            photoset: the current photoset
+            known: state database records for the current directory
+
+        Returns: Nothing
+        """
+
+        photo_path = os.path.join(self._local_path, f)
+        moved = None
+        if ( photo == None and self.the_args.track_moves ):
+            digest = None
+            if ( self._hasher != None ):
+                digest = self._hasher.result(photo_path, stat)
+            moved = self._state_db.find_moved(photo_path, stat, digest)
+        if ( moved != None and
+             self.move_photo(f, photo_path, stat, moved, photoset) ):
+            return
+        original = None
+        if ( photo == None and self._dedupe != None ):
+            original = self.find_duplicate(photo_path, stat)
+        if ( original != None and self._dedupe.policy != "report" ):
+            self.use_duplicate(f, photo_path, stat, original, photoset)
+        elif ( photo == None ):
+            # "Add 123/123:"
+            self._add_files += 1
+            self.print_action("Add", f)
+            if ( self.with_retries(self.upload_file, photo_path, stat) ):
+                self.record_file(photo_path, stat, 
+                                 self.last_upload_id(), photoset['Id'])
+            else:
+                # Not recorded, so that the next run tries again.
+                self._failed_files += 1
+                self.print_action("Fail", f)
+        # If the photo exists, but is different, then update it.
+        elif ( self.upload_size(photo_path, stat) != photo['Size'] or
+               ( self._hasher != None and
+                 self.content_changed(photo_path, stat, photo, known) ) ):
+            # " New 123/123:"
+            self._new_files += 1
+            self.print_action("New", f)
+            if ( self.with_retries(self.upload_file, photo_path, stat) ):
+                photo_id = self.last_upload_id()
+                self.record_file(photo_path, stat, photo_id, photoset['Id'])
+                # Keep the old photo unless the new one surely exists.
+                if ( photo_id != None ):
+                    self.delete_photos([photo])
+            else:
+                self._failed_files += 1
+                self.print_action("Fail", f)
+        else:
+            # " Old 123/123:"
+            self._old_files += 1
+            self.print_action("Old", f)
+            self.record_file(photo_path, stat, photo['Id'], photoset['Id'])
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def upload_size(self, photo_path, stat):
+        """
+        Find the size the photo of a file has once uploaded: that of
+        the file or, with --resize or --quality, of its copy.
+
+        Parameters:
+            photo_path: local path of the file
+            stat: os.stat result for the file
+
+        Returns: The size in bytes.
+        """
+
+        if ( self._transformer == None ):
+            return stat.st_size
+        return self._transformer.result(photo_path, stat)[1]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def upload_file(self, photo_path, stat):
+        """
+        Upload a file to the current gallery, or its copy with --resize
+        or --quality.
+
+        Parameters:
+            photo_path: local path of the file
+            stat: os.stat result for the file
+
+        Returns: nonzero on success, zero on failure
+        """
+
+        if ( self._transformer == None ):
+            return self.upload_to_path(photo_path, self._zf_path)
+        upload_path = self._transformer.result(photo_path, stat)[0]
+        return self.upload_to_path(upload_path, self._zf_path, photo_path)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def backup_streamed(self, dirs, local_root):
+        """
+        Back up the files in the current local directory a chunk at a
+        time (--chunk), for a directory too large to list at once.
+
+        Parameters:
+            dirs: list of subdirectories of the current directory
+            local_root: local path being backed up
+
+        Returns: Nothing
+        """
+
+        print "   Archiving:", self._local_path, "(in chunks)"
+        print "          to:", self._zf_path
+        self._streamed_dirs += 1
+
+        if ( dirs != [] ):
+            self.find_or_create_group()
+
+        self._num_files = None
+        self._cur_file = 0
+        photoset = None
+        index = None
+        if ( self.the_args.mirror ):
+            # Load the photos first, so that the photos of files left out
+            # by filter rules can be taken out of the index as they are
+            # found.
+            photoset = self.load_photoset("False")
+            if ( photoset != None ):
+                index = self.load_index(photoset)
+
+        def excluded(name):
+            if ( index != None ):
+                index.pop(name)
+
+        try:
+            for chunk in zfscan.scan_chunks(self._local_path, self._chunk,
+                                            self._walk_rules, local_root,
+                                            excluded):
+                if ( self._hasher != None ):
+                    self._hasher.submit([(os.path.join(self._local_path, f),
+                                          stat) for f, stat in chunk
+                                         if stat != None])
+                if ( self._transformer != None ):
+                    self._transformer.submit(
+                        [(os.path.join(self._local_path, f), stat)
+                         for f, stat in chunk if stat != None])
+                for f, stat in chunk:
+                    self._cur_file += 1
+                    photo_path = os.path.join(self._local_path, f)
+                    if ( stat == None ):
+                        self._skip_files += 1
+                        # "Skip 123:"
+                        self.print_action("Skip", f)
+                    elif ( self._journal != None and
+                           self._journal.is_file_done(photo_path, stat) ):
+                        self._old_files += 1
+                        self.print_action("Done", f)
+                        # Its photo is there; --mirror must not delete it.
+                        # (With --mirror, the index is loaded already.)
+                        if ( index != None ):
+                            index.pop(f)
+                    else:
+                        if ( photoset == None ):
+                            photoset = self.find_or_create_photoset("False")
+                            index = self.load_index(photoset)
+                        self.backup_file(f, stat, index.pop(f), photoset, {})
+
+            if ( self.the_args.mirror and index != None ):
+                self.mirror_index(index)
+        finally:
+            if ( index != None ):
+                index.close()
+
+        if ( self._journal != None ):
+            self._journal.dir_done(self._local_path)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def mirror_index(self, index):
+        """
+        Delete the photos left in the PhotoIndex of a streamed
+        directory, which have no local counterpart.
+
+        Parameters:
+            index: the PhotoIndex, from which the photos of the local
+                files have been taken.
+
+        Returns: Nothing
+        """
+
+        stale = 0
+        for photo in index.remaining():
+            if ( photo['Id'] not in self._moved_ids ):
+                stale += 1
+        if ( stale == 0 or self.over_delete_limit(stale, index.total) ):
+            return
+
+        batch = []
+        for photo in index.remaining():
+            if ( photo['Id'] in self._moved_ids ):
+                continue
+            if ( self.the_args.track_moves and self.may_have_moved(photo) ):
+                self._deferred[photo['Id']] = photo
+                continue
+            if ( self.the_args.dry_run ):
+                print "Del? {:s}".format(photo['FileName'])
+                continue
+            print "Del  {:s}".format(photo['FileName'])
+            batch.append(photo)
+            if ( len(batch) >= self.the_args.delete_batch ):
+                sys.stdout.flush()
+                self._del_files += self.with_retries(self.delete_photos, 
+                                                     batch,
+                                                     self.the_args.delete_batch)
+                batch = []
         sys.stdout.flush()
+        if ( batch != [] ):
+            self._del_files += self.with_retries(self.delete_photos, batch,
+                                                 self.the_args.delete_batch)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def needs_photoset(self, scan_dir):
+        """
+        Guess whether backing up a directory will load its photoset
+        (that is, it will not be skipped as unchanged).
+
+        Parameters:
+            scan_dir: the zfscan.ScanDir
+
+        Returns: True if the photoset is worth prefetching.
+        """
+
+        # A streamed directory pages through its photos instead.
+        if ( scan_dir.images == None ):
+            return False
+        if ( self._journal != None and
+             self._journal.directory_unchanged(scan_dir.path,
+                                               scan_dir.images) ):
+            return False
+        if ( scan_dir.images == {} ):
+            return self.the_args.mirror
+        if ( self._state_db != None and not self.the_args.mirror and
+             not self.the_args.verify_hash ):
+            return not self._state_db.directory_unchanged(scan_dir.path,
+                                                          scan_dir.images)
+        return True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def prefetch_walk(self, local_root, zf_root):
+        """
+        Walk the local tree, running --prefetch directories ahead of
+        the caller and asking the prefetcher for their photosets.
+
+        Parameters:
+            local_root: local path to back up
+            zf_root: group to back up to
+
+        Returns: A generator of zfscan.ScanDir.
+        """
+
+        # The walk may have been started before logging in.
+        walker = self._early_walk
+        self._early_walk = None
+        if ( walker == None ):
+            walker = zfscan.walk(local_root, self.the_args.scan_jobs,
+                                 self._walk_rules, max_files=self._chunk)
+        if ( self._prefetcher == None ):
+            for scan_dir in walker:
+                if ( self.owns(local_root, scan_dir.path) ):
+                    yield scan_dir
+            return
+
+        ahead = deque()
+        for scan_dir in walker:
+            if ( not self.owns(local_root, scan_dir.path) ):
+                continue
+            ahead.append(scan_dir)
+            if ( self.needs_photoset(scan_dir) ):
+                rpath = relpath(scan_dir.path, local_root)
+                self._prefetcher.request(zfdiff.zf_path_for(zf_root, rpath))
+            if ( len(ahead) > self.the_args.prefetch ):
+                yield ahead.popleft()
+        while ( ahead ):
+            yield ahead.popleft()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def print_upload(self, action, task):
+        """
+        Print a line describing an upload done by an UploadPool.
+
+        Parameters:
+            action: "Add", "New" or "Fail"
+            task: the UploadTask
+
+        Returns: Nothing
+        """
+
+        if ( action == "Add" ):
+            self._add_files += 1
+        elif ( action == "New" ):
+            self._new_files += 1
+        else:
+            self._failed_files += 1
+        print "{:4s} {:s}".format(action, task.local_path)
+        sys.stdout.flush()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def print_limit(self, limit, old):
+        """
+        Print a line saying that an AdaptiveLimit has changed.
+
+        Parameters:
+            limit: the AdaptiveLimit
+            old: its limit before the change
+
+        Returns: Nothing
+        """
+
+        # One write: this is called from the worker threads.
+        sys.stdout.write("Concurrency: " + limit.status(old) + "\n")
+        sys.stdout.flush()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def make_limit(self, text, start, name, unit="/s", scale=1.0):
+        """
+        Make an AdaptiveLimit from --adaptive or --adaptive-meta.
+
+        Parameters:
+            text: the option's value (already checked), or None
+            start: the limit to start from
+            name, unit, scale: passed on to AdaptiveLimit
+
+        Returns: The AdaptiveLimit, or None if text is None.
+        """
+
+        if ( text == None ):
+            return None
+        low, high = parse_range(text)
+        limit = AdaptiveLimit(name, start, low, high, unit=unit, scale=scale,
+                              report=self.print_limit)
+        self._limits.append(limit)
+        return limit
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def write_plan(self, local_root, zf_root):
+        """
+        Compare the local tree with Zenfolio and write a plan (--plan).
+
+        Parameters:
+            local_root: local path to back up
+            zf_root: group to back up to
+
+        Returns: Nothing
+        """
+
+        # The plan may be carried out from another directory.
+        local_root = os.path.abspath(local_root)
+        print "    Scanning:", local_root
+        tree = zfdiff.scan_tree(local_root, self.the_args.scan_jobs,
+                                self._rules)
+        snapshots = zfdiff.load_snapshots(self, tree, zf_root,
+                                          self.the_args.mirror)
+        changes = zfdiff.diff_tree(tree, zf_root, self.element_index(),
+                                   snapshots, self.the_args.mirror)
+
+        # Apply --max-delete to each gallery.
+        if ( changes.delete != [] ):
+            stale = {}
+            for gallery, photo in changes.delete:
+                stale.setdefault(gallery, []).append(photo)
+            changes.delete = []
+            for gallery in sorted(stale):
+                total = len(snapshots[gallery]['Photos'])
+                if ( not self.over_delete_limit(len(stale[gallery]), total) ):
+                    changes.delete.extend([(gallery, photo)
+                                           for photo in stale[gallery]])
+
+        plan = zfplan.make_plan(changes, self.the_args.user, local_root,
+                                zf_root, int(self.the_args.rate * 1e6),
+                                self.the_args.jobs or 4)
+        zfplan.write_plan(plan, self.the_args.plan)
+        print zfplan.format_plan(plan)
+        print "Plan written to", self.the_args.plan
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def execute_plan(self, plan):
+        """
+        Carry out a plan written by --plan (--execute).
+
+        Parameters:
+            plan: the plan, as read by zfplan.read_plan
+
+        Returns: Nothing
+        """
+
+        print zfplan.format_plan(plan)
+        self._old_files += plan['totals']['unchanged']
+        jobs = self.the_args.jobs or 4
+        limit = self.make_limit(self.the_args.adaptive, jobs, "uploads",
+                                "MB/s", 1e6)
+        if ( limit != None ):
+            jobs = limit.high
+        executor = PlanExecutor(self, jobs=jobs,
+                                with_retries=self.with_retries,
+                                report=self.print_upload,
+                                scheduler=self.make_scheduler(jobs),
+                                limit=limit)
+        try:
+            executor.run(plan)
+        finally:
+            self._new_groups += executor.groups
+            self._new_galleries += executor.galleries
+            self._del_files += executor.deleted
+            if ( executor.pool != None ):
+                self._total_retries += executor.pool.retries
+            for missing in executor.missing:
+                print "Gone", missing
+            self._skip_files += len(executor.missing)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run_pipeline(self, local_root, zf_root):
+        """
+        Back up the tree with a BackupPipeline (--jobs N, N > 1).
+
+        Parameters:
+            local_root: local path to back up
+            zf_root: group to back up to
+
+        Returns: Nothing
+        """
+
+        jobs = self.the_args.jobs
+        meta_jobs = self.the_args.meta_jobs
+        limit = self.make_limit(self.the_args.adaptive, jobs, "uploads",
+                                "MB/s", 1e6)
+        if ( limit != None ):
+            jobs = limit.high
+        self._meta_limit = self.make_limit(self.the_args.adaptive_meta,
+                                           meta_jobs, "lookups", "dirs/s")
+        if ( self._meta_limit != None ):
+            meta_jobs = self._meta_limit.high
+        pipeline = BackupPipeline(self, jobs=jobs, meta_jobs=meta_jobs,
+                                  queue_size=meta_jobs * 4,
+                                  scheduler=self.make_scheduler(jobs),
+                                  limit=limit, meta_limit=self._meta_limit)
+        try:
+            pipeline.run(local_root, zf_root)
+        finally:
+            if ( pipeline.pool != None ):
+                self._total_retries += pipeline.pool.retries
+            self._failed_dirs += pipeline.errors
+            if ( pipeline.errors ):
+                print "  {:d} directories could not be backed up".format(
+                    pipeline.errors)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def finish_journal(self):
+        """
+        Delete the journal of a backup that finished without failures.
+        If anything failed, keep it so that --resume retries only that.
+
+        Parameters:
+            None.
+
+        Returns: Nothing
+        """
+
+        if ( self._journal == None ):
+            return
+        if ( self._failed_files == 0 and self._failed_dirs == 0 ):
+            self._journal.remove()
+        else:
+            self._journal.close()
+            print "Journal kept in", self._journal.filename
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def set_paths(self, local_root, zf_root, local_path):
+        """
+        Make a local directory the current one.
+
+        Parameters:
+            local_root: local path being backed up
+            zf_root: group being backed up to
+            local_path: the directory
+
+        Returns: Nothing
+        """
+
+        self._local_path = local_path
+
+        # Calculate the path from the one specified on the 
+        # command line to our current position.  Then
+        # Join it to the Zenfolio root path.
+        rpath = relpath(self._local_path, local_root)
+        if ( rpath == "." ):
+            self._zf_path = zf_root
+        else:
+            self._zf_path = os.path.join(zf_root, rpath)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def owns(self, local_root, local_path):
+        """
+        Is a directory ours to back up?  Always, unless sharded.
+
+        Parameters:
+            local_root: local path being backed up
+            local_path: the directory
+
+        Returns: True if this shard backs up the directory.
+        """
+
+        if ( self._shard == None ):
+            return True
+        index, count = self._shard
+        return shard_of(relpath(local_path, local_root), count,
+                        self.the_args.shard_by) == index
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def report_shard(self, finished=False):
+        """
+        Publish this shard's counters in the coordination database: at
+        most every 30 seconds while running, and when finished.  Each
+        time, print the progress of all the shards.
+
+        Parameters:
+            finished: this shard is done.
+
+        Returns: Nothing
+        """
+
+        if ( self._coord == None ):
+            return
+        if ( not finished and time.time() - self._coord_reported < 30 ):
+            return
+        self._coord_reported = time.time()
+        self._coord.report({'groups': self._new_groups,
+                            'galleries': self._new_galleries,
+                            'skipped': self._skip_files,
+                            'old': self._old_files,
+                            'added': self._add_files,
+                            'updated': self._new_files,
+                            'deleted': self._del_files,
+                            'failed': self._failed_files,
+                            'retried': self._total_retries}, finished)
+        if ( not finished ):
+            totals, done = self._coord.totals()
+            print "      Shards: {:d} added, {:d} updated, {:d} old, " \
+                "{:d} failed ({:d}/{:d} finished)".format(
+                totals['added'], totals['updated'], totals['old'],
+                totals['failed'], done, self._coord.count)
+            sys.stdout.flush()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def backup_tree(self, local_root, zf_root):
+        """
+        Back up every directory of the local tree, one after another.
+
+        Parameters:
+            local_root: local path to back up
+            zf_root: group to back up to
+
+        Returns: Nothing
+        """
+
+        for scan_dir in self.prefetch_walk(local_root, zf_root):
+            # The shard that owns the parent directories may not have
+            # got to them yet.
+            if ( self._coord != None ):
+                self.ensure_groups(local_root, zf_root, scan_dir.path)
+            self.set_paths(local_root, zf_root, scan_dir.path)
+            if ( scan_dir.files == None ):
+                self.backup_streamed(scan_dir.dirs, local_root)
+            else:
+                self.backup_directory(scan_dir.dirs, scan_dir.files,
+                                      scan_dir.images, scan_dir.excluded)
+            self.report_shard()
+        self.delete_deferred()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def ensure_groups(self, local_root, zf_root, local_path):
+        """
+        Create the group for the local root and the groups for the
+        directories between it and a directory, if they don't exist yet.
+
+        Parameters:
+            local_root: local path being backed up
+            zf_root: group being backed up to
+            local_path: the directory (whose own group is not created)
+
+        Returns: Nothing
+        """
+
+        rpath = relpath(local_path, local_root)
+        if ( rpath == "." ):
+            return
+        zf_root = zf_root.rstrip("/")
+        zf_path = dirname(zf_root)
+        for part in [basename(zf_root)] + rpath.split(os.sep)[:-1]:
+            parent = zf_path
+            zf_path = os.path.join(zf_path, part)
+            if ( self.get_group(zf_path) == None ):
+                self._new_groups += 1
+                print "   New group:", zf_path
+                self.with_retries(self.create_group, parent, part)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def watch_tree(self, local_root, zf_root):
+        """
+        Upload image files as they appear in the local tree (--watch).
+        Runs until interrupted.
+
+        Parameters:
+            local_root: local path to back up
+            zf_root: group to back up to
+
+        Returns: Nothing
+        """
+
+        watcher = TreeWatcher(local_root, self.the_args.settle, self._rules)
+        try:
+            # Anything that arrived while the watches were being set up
+            # is picked up by this pass.
+            self.backup_tree(local_root, zf_root)
+            next_rescan = time.time() + self.the_args.rescan
+            last_call = time.time()
+            print "    Watching:", local_root
+            sys.stdout.flush()
+
+            while ( True ):
+                timeout = next_rescan - time.time()
+                deadline = watcher.next_deadline()
+                if ( deadline != None ):
+                    timeout = min(timeout, deadline - time.time())
+                watcher.wait(max(0, timeout))
+
+                if ( watcher.overflowed or time.time() >= next_rescan ):
+                    watcher.overflowed = False
+                    print "  Rescanning:", local_root
+                    self.with_retries(self.retrieve_group_hierarchy)
+                    self.backup_tree(local_root, zf_root)
+                    next_rescan = time.time() + self.the_args.rescan
+                    last_call = time.time()
+                    continue
+
+                batches = watcher.ready()
+                if ( batches == {} ):
+                    continue
+
+                # The server drops idle connections; don't find out by
+                # having the first upload fail.
+                if ( time.time() - last_call > 60 ):
+                    self._open_connection()
+
+                for local_path in sorted(batches):
+                    images = batches[local_path]
+                    self.ensure_groups(local_root, zf_root, local_path)
+                    self.set_paths(local_root, zf_root, local_path)
+                    self.backup_directory([], sorted(images), images)
+                if ( self._state_db != None ):
+                    self._state_db.commit()
+                last_call = time.time()
+        finally:
+            watcher.close()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def make_rules(self):
+        """
+        Compile --include, --exclude and the size and age limits.
+
+        Parameters:
+            None.
+
+        Returns: FilterRules, or None if there are no rules.  Exits with
+            a usage error if a rule is invalid.
+        """
+
+        try:
+            return zffilter.from_args(self.the_args)
+        except ZfLibException as e:
+            self._parser.error(e.msg)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def make_scheduler(self, jobs):
+        """
+        Make the scheduler for the uploads from --order, --priority,
+        --max-in-flight and --upload-queue.
+
+        Parameters:
+            jobs: number of concurrent uploads.
+
+        Returns: An UploadScheduler.
+        """
+
+        args = self.the_args
+        queue_size = args.upload_queue
+        if ( queue_size == None ):
+            if ( args.order == "fifo" ):
+                queue_size = jobs * 4
+            else:
+                queue_size = jobs * 256
+        return UploadScheduler(args.order, self._max_in_flight, queue_size,
+                               self._priorities)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def check_options(self):
+        """
+        Refuse the first combination of options in OPTION_CONFLICTS that
+        was given (parser.error exits).
+
+        Returns: Nothing
+        """
+
+        for conflict, message in OPTION_CONFLICTS:
+            if ( conflict(self.the_args) ):
+                self._parser.error(message)
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def run(self):
         self.parse_args()
 
+        self.check_options()
+        plan = None
+        if ( self.the_args.execute ):
+            try:
+                plan = zfplan.read_plan(self.the_args.execute)
+            except (IOError, ZfLibException) as e:
+                self._parser.error(getattr(e, "msg", None) or str(e))
+            if ( plan['user'] != self.the_args.user ):
+                self._parser.error("plan was made for user " + plan['user'])
+
         local_root = self.the_args.local_path
         zf_root = self.the_args.group_path
+        self._rules = self.make_rules()
+        try:
+            self._priorities = [parse_priority(text)
+                                for text in self.the_args.priority]
+            self._max_in_flight = ( self.the_args.max_in_flight and
+                                    parse_size(self.the_args.max_in_flight) )
+            self._max_memory = ( self.the_args.max_memory and
+                                 parse_size(self.the_args.max_memory) )
+            for text in [self.the_args.adaptive, self.the_args.adaptive_meta]:
+                if ( text != None ):
+                    parse_range(text)
+            if ( self._max_memory != None ):
+                set_memory_limit(self._max_memory)
+        except ZfLibException as e:
+            self._parser.error(e.msg)
+        self._chunk = self.the_args.chunk
+        if ( self._chunk == None and self._max_memory != None and
+             not (self.the_args.plan or self.the_args.execute or
+                  _jobs(self.the_args)) ):
+            self._chunk = 10000
+        self._walk_rules = self._rules
+        if ( self.the_args.shard ):
+            try:
+                self._shard = parse_shard(self.the_args.shard)
+            except ZfLibException as e:
+                self._parser.error(e.msg)
+            if ( self.the_args.shard_by == "top" ):
+                # Don't even read the other shards' top-level directories.
+                self._walk_rules = ShardRules(self._shard[0], self._shard[1],
+                                              self._rules)
+
+        # Start reading the tree while logging in (and while the password
+        # is typed).  With --watch, the tree is only walked once it is
+        # being watched, so that no new file goes unnoticed.
+        if ( plan == None and not self.the_args.plan and
+             not self.the_args.watch and not _jobs(self.the_args) ):
+            self._early_walk = zfscan.WalkAhead(
+                zfscan.walk(local_root, self.the_args.scan_jobs,
+                            self._walk_rules, max_files=self._chunk))
 
-        if ( self.get_password() ):
+        logged_in = 0
+        try:
+            logged_in = self.get_password()
+        finally:
+            if ( not logged_in and self._early_walk != None ):
+                self._early_walk.close()
+        if ( logged_in ):
+            if ( self.the_args.state ):
+                self._state_db = ZfState(self.the_args.state)
+            if ( self._shard != None ):
+                self._coord = Coordinator(self.the_args.coord, *self._shard)
+                self._coord_reported = time.time()
+            if ( self.the_args.hash or self.the_args.verify_hash or
+                 self.the_args.dedupe ):
+                self._hasher = Hasher(self.the_args.hash_jobs,
+                                      HashCache(self._state_db),
+                                      self.the_args.verify_hash)
+            if ( self.the_args.dedupe ):
+                self._dedupe = DuplicateIndex(self.the_args.dedupe,
+                                              self._state_db)
             try:
+                self._transformer = zftransform.from_args(
+                    self.the_args, HashCache(self._state_db))
+                if ( plan != None ):
+                    self.execute_plan(plan)
+                    self.print_summary()
+                    return
+                if ( self.the_args.plan ):
+                    self.write_plan(local_root, zf_root)
+                    return
+                if ( self.the_args.journal ):
+                    self._journal = Journal(self.the_args.journal)
+                    self._journal.open({'user': self.the_args.user,
+                                        'local_path': 
+                                            os.path.abspath(local_root),
+                                        'group_path': 
+                                            zfdiff.zf_path_for(zf_root, "")},
+                                       self.the_args.resume)
+                if ( _jobs(self.the_args) ):
+                    self.run_pipeline(local_root, zf_root)
+                    self.report_shard(True)
+                    self.print_summary()
+                    self.finish_journal()
+                    return
 
                 # Walk the directory structure
-                for self._local_path, dirs, files in os.walk(local_root, 
-                                                       topdown = True):
-                    # Sort the directories for neatness.
-                    dirs.sort()
-
-                    # Calculate the path from the one specified on the 
-                    # command line to our current position.  Then
-                    # Join it to the Zenfolio root path.
-                    rpath = relpath(self._local_path, local_root)
-                    if ( rpath == "." ):
-                        self._zf_path = zf_root
-                    else:
-                        self._zf_path = os.path.join(zf_root, rpath)
-
-                    print "   Archiving:", self._local_path
-                    print "          to:", self._zf_path
-
-                    # If there are directories in this location, then 
-                    # find/create a group for this location
-                    if ( dirs != [] ):
-                        group = self.get_group(self._zf_path)
-                        if ( group == None):
-                            self._new_groups += 1
-                            retries = 0
-                            while ( retries < self.max_socket_retries ):
-                                try:
-                                    print "   New group:", self._zf_path
-                                    self.create_group(dirname(self._zf_path),
-                                                      basename(self._zf_path))
-                                except IOError as e:
-                                    # Broken pipe or Connection reset by peer
-                                    if ( retries < self.max_socket_retries \
-                                         and (e.errno == 32 or e.errno == 104) ):
-                                        retries += 1
-                                        self._total_retries += 1
-                                        print "{:s}!  Retry #{:d} - ".format(e.strerror, retries),
-                                        self.reset()
-                                        if ( not self.get_password() ):
-                                            raise e
-                                    # Not something we want to handle
-                                    else:
-                                        raise e
-                                # No exception, break from the while
-                                else:
-                                    break
-
-                    self._num_files = len(files)
-                    self._cur_file = 0
-                    photoset = None
-                    for f in sorted(files):
-                        self._cur_file += 1
-                        # If the file is an image file, then find or create
-                        # A photoset for it.
-                        photo_path = os.path.join(self._local_path, f)
-                        if ( self.is_image_file(photo_path) ):
-                            if ( photoset == None ):
-                                # Find the photoset for this location
-                                photoset = \
-                                    self.get_photoset(self._zf_path,
-                                                      level="Level2",
-                                                      include_photos="True")
-
-                                # Create it if it doesn't exist
-                                if ( photoset == None ):
-                                    self._new_galleries += 1
-                                    retries = 0
-                                    while ( retries < self.max_socket_retries ):
-                                        try:
-                                            print " New gallery:", self._zf_path
-                                            self.create_gallery(dirname(self._zf_path),
-                                                                basename(self._zf_path))
-                                        except IOError as e:
-                                            # Broken pipe or Connection reset by peer
-                                            if ( retries < self.max_socket_retries \
-                                                 and (e.errno == 32 or e.errno == 104)):
-                                                retries += 1
-                                                self._total_retries += 1
-                                                print "{:s}!  Retry #{:d} - ".format(e.strerror, retries),
-                                                self.reset()
-                                                if ( not self.get_password() ):
-                                                    raise e
-                                            # Not something we want to handle
-                                            else:
-                                                raise e
-                                        # No exception, break from the while
-                                        else:
-                                            break
-                                    photoset = \
-                                        self.get_photoset(self._zf_path,
-                                                          level="Level2",
-                                                          include_photos="True")
-
-                            # If the photo doesn't exist in the photoset,
-                            # then upload it.
-                            photo = self.get_photo(photoset, f)
-                            if ( photo == None ):
-                                retries = 0
-                                # Retry three times
-                                while ( retries < self.max_socket_retries ):
-                                    try:
-                                        # "Add 123/123:"
-                                        self._add_files += 1
-                                        self.print_action("Add", f)
-                                        self.upload_to_path(photo_path, self._zf_path)
-                                    except IOError as e:
-                                        # Broken pipe or Connection reset by peer
-                                        if ( retries < self.max_socket_retries \
-                                             and (e.errno == 32 or e.errno == 104)):
-                                            retries += 1
-                                            self._total_retries += 1
-                                            print "{:s}!  Retry #{:d} - ".format(e.strerror, retries),
-                                            self.reset()
-                                            if ( not self.get_password() ):
-                                                raise e
-                                        # Not something we want to catch
-                                        else:
-                                            raise e
-                                    # No error, break from the while
-                                    else:
-                                        break
-                            else:
-                                # If the photo exists, but is different, then
-                                # update it.
-                                if ( getsize(photo_path) != photo['Size'] ):
-                                    # " New 123/123:"
-                                    self._new_files += 1
-                                    self.print_action("New", f)
-                                    self.upload_to_path(photo_path, self._zf_path)
-                                    self.delete_photo(photoset, f)
-                                else:
-                                    # " Old 123/123:"
-                                    self._old_files += 1
-                                    self.print_action("Old", f)
-
-                        # Not an image file
-                        else:
-                            self._skip_files += 1
-                            # "Skip 123/123:"
-                            self.print_action("Skip", f)
+                if ( self.the_args.prefetch > 0 ):
+                    self._prefetcher = PhotosetPrefetcher(
+                        self, self.the_args.prefetch)
+                if ( self.the_args.watch ):
+                    self.watch_tree(local_root, zf_root)
+                else:
+                    self.backup_tree(local_root, zf_root)
+
                 # Done
+                self.report_shard(True)
                 self.print_summary()
+                self.finish_journal()
 
             except (KeyboardInterrupt):
                 print ""
                 print "Interrupt!"
+                if ( self._coord != None ):
+                    self._coord_reported = 0
+                    self.report_shard()
                 self.print_summary()
                                     
+            except (MemoryError, thread.error):
+                print ""
+                print "Out of memory (--max-memory {:s})!".format(
+                    self.the_args.max_memory)
+                self.print_summary()
+
             except (ZfCLIException, ZfLibException) as e:
                 print
                 print e.msg
+
+            finally:
+                if ( self._early_walk != None ):
+                    self._early_walk.close()
+                if ( self._prefetcher != None ):
+                    self._prefetcher.close()
+                if ( self._journal != None ):
+                    self._journal.close()
+                if ( self._hasher != None ):
+                    self._hasher.close()
+                if ( self._transformer != None ):
+                    self._transformer.close()
+                if ( self._state_db != None ):
+                    self._state_db.close()
+                if ( self._coord != None ):
+                    self._coord.close()
@@ -0,0 +1,270 @@
+#    A class to create a Zenfolio command-line interface
+# 
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, Bryan Mason
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to 
+#    access the Zenfiolo service.
+#
+###############################################################################
+
+
+from zucla.zfcli import ZfCLI, ZfCLIException
+from zucla.zflib import ZfLibException
+from zucla.zffilter import parse_size
+from zucla.zfrestore import DownloadPool, DownloadTask, RateLimiter
+from zucla.zfrestore import local_name, restore_targets, unique_name
+from zucla import zfdiff
+
+import argparse
+import os
+import os.path
+import sys
+
+class Restore(ZfCLI):
+
+    def __init__(self):
+        ZfCLI.__init__(self, "restore")
+        self._parser.add_argument("-j", "--jobs", action="store", type=int,
+                                  default=4, metavar="N",
+                                  help="Download N files at a time " + \
+                                      "(default 4).")
+        self._parser.add_argument("--limit-rate", action="store",
+                                  dest="limit_rate", metavar="SIZE",
+                                  help="Download at most SIZE bytes per " + \
+                                      "second in all (for example, 2M).")
+        self._parser.add_argument("--overwrite", action="store_true",
+                                  help="Download files that exist " + \
+                                      "locally with a different size " + \
+                                      "(by default they are left alone).")
+        self._parser.add_argument("--dry-run", action="store_true",
+                                  dest="dry_run",
+                                  help="Only show what would be " + \
+                                      "downloaded.")
+        self._parser.add_argument("group_path", action="store",
+                                  help="Group or gallery to restore, " + \
+                                  "specified as a path delimited with " + \
+                                  "slashes (\"/\") For example: " + \
+                                  "\"/All Photographs/Soccer/Earthquakes\".")
+        self._parser.add_argument("local_path", action="store",
+                                  help="Directory to restore into")
+
+        self._present_files = 0
+        self._differ_files = 0
+        self._skipped_photos = 0
+        self._new_dirs = 0
+        self._failed_galleries = 0
+        self._pending_files = 0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def print_download(self, action, task, message):
+        """
+        Print a line describing a download done by the DownloadPool.
+
+        Parameters:
+            action: "Get" or "Fail"
+            task: the DownloadTask
+            message: why it failed, or None
+
+        Returns: Nothing
+        """
+
+        if ( action == "Get" and task.resumed ):
+            print "{:4s} {:s} (resumed at {:d} bytes)".format(
+                action, task.local_path, task.resumed)
+        elif ( action == "Get" ):
+            print "{:4s} {:s}".format(action, task.local_path)
+        else:
+            print "{:4s} {:s}: {:s}".format(action, task.local_path, message)
+        sys.stdout.flush()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def restore_gallery(self, pool, zf_path, element, local_dir, used):
+        """
+        Queue the downloads of the photos of a gallery that are missing
+        locally.
+
+        Parameters:
+            pool: the DownloadPool (None with --dry-run)
+            zf_path: Zenfolio path of the gallery
+            element: the gallery's element from the hierarchy
+            local_dir: the directory to restore it into
+            used: set of the names used in local_dir so far (see
+                unique_name)
+
+        Returns: Nothing
+        """
+
+        photoset = self.LoadPhotoSet(element['Id'], "Level1", "True")
+        if ( photoset == None ):
+            self._failed_galleries += 1
+            print "Fail {:s}: could not load the gallery".format(zf_path)
+            return
+
+        for photo in photoset['Photos']:
+            name = local_name(photo.get('FileName'))
+            url = photo.get('OriginalUrl')
+            if ( name == None or url == None ):
+                self._skipped_photos += 1
+                print "Skip {:s}/{:s}: no original".format(
+                    zf_path, photo.get('FileName') or str(photo['Id']))
+                continue
+            local_path = os.path.join(local_dir,
+                                      unique_name(name, photo['Id'], used))
+            size = photo.get('Size')
+            if ( os.path.isfile(local_path) ):
+                local_size = os.path.getsize(local_path)
+                if ( local_size == size ):
+                    self._present_files += 1
+                    continue
+                if ( not self.the_args.overwrite ):
+                    self._differ_files += 1
+                    print "Diff {:s} ({:d} bytes, {:d} on Zenfolio)".format(
+                        local_path, local_size, size or 0)
+                    continue
+            if ( pool == None ):
+                self._pending_files += 1
+                print "Get? {:s}".format(local_path)
+                continue
+            pool.submit(DownloadTask(url, local_path, size, zf_path))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def restore_tree(self, pool, zf_root, local_root):
+        """
+        Recreate the groups and galleries under a Zenfolio path as
+        local directories and download their photos.
+
+        Parameters:
+            pool: the DownloadPool (None with --dry-run)
+            zf_root: Zenfolio path to restore
+            local_root: directory to restore into
+
+        Returns: Nothing
+        """
+
+        targets = restore_targets(self.element_index(), zf_root)
+        if ( targets == [] ):
+            raise ZfCLIException("restore_tree", 
+                                 "Group or gallery not found: " + zf_root)
+
+        # Galleries with the same title share a directory too.
+        used = {}
+        for rpath, etype, element in targets:
+            if ( rpath == "" ):
+                local_dir = local_root
+                zf_path = zf_root
+            else:
+                local_dir = os.path.join(local_root, *rpath.split("/"))
+                zf_path = zf_root.rstrip("/") + "/" + rpath
+            if ( not os.path.isdir(local_dir) ):
+                self._new_dirs += 1
+                print "   New directory:", local_dir
+                if ( pool != None ):
+                    os.makedirs(local_dir)
+            if ( etype == "PhotoSet" ):
+                print "   Restoring:", zf_path
+                sys.stdout.flush()
+                self.restore_gallery(pool, zf_path, element, local_dir,
+                                     used.setdefault(local_dir, set()))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def print_summary(self, pool):
+        """
+        Print a summary of everything that has been done.
+
+        Parameters:
+            pool: the DownloadPool (None with --dry-run)
+
+        Returns: Nothing
+        """
+
+        print ""
+        print "Summary:"
+        print "  Created {:5d} directories".format(self._new_dirs)
+        if ( pool != None ):
+            print "  Fetched {:5d} files ({:.1f} MB, {:d} resumed)".format(
+                pool.downloaded, pool.bytes / 1e6, pool.resumed)
+        else:
+            print "    Would {:5d} files be fetched".format(
+                self._pending_files)
+        print "  Skipped {:5d} files already present".format(
+            self._present_files)
+        if ( self._differ_files ):
+            print "     Kept {:5d} local files of a different size".format(
+                self._differ_files)
+        if ( self._skipped_photos ):
+            print "  Skipped {:5d} photos without an original".format(
+                self._skipped_photos)
+        if ( pool != None and pool.failed ):
+            print "   Failed {:5d} files".format(len(pool.failed))
+        if ( self._failed_galleries ):
+            print "   Failed {:5d} galleries".format(self._failed_galleries)
+        if ( pool != None ):
+            print "  Retried {:5d} downloads".format(pool.retries)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run(self):
+        self.parse_args()
+
+        limiter = None
+        if ( self.the_args.jobs < 1 ):
+            self._parser.error("--jobs must be at least 1")
+        if ( self.the_args.limit_rate ):
+            try:
+                limiter = RateLimiter(parse_size(self.the_args.limit_rate))
+            except ZfLibException as e:
+                self._parser.error(e.msg)
+
+        zf_root = zfdiff.zf_path_for(self.the_args.group_path, "")
+        local_root = self.the_args.local_path
+
+        if ( self.get_password() ):
+            pool = None
+            if ( not self.the_args.dry_run ):
+                pool = DownloadPool(self, self.the_args.jobs, limiter,
+                                    report=self.print_download)
+                pool.start()
+            try:
+                self.restore_tree(pool, zf_root, local_root)
+                if ( pool != None ):
+                    pool.close()
+                self.print_summary(pool)
+
+            except (KeyboardInterrupt):
+                print ""
+                print "Interrupt!"
+                # Files being downloaded are finished; .part files of
+                # the others are resumed by the next run.
+                if ( pool != None ):
+                    pool.stop()
+                    pool.close()
+                self.print_summary(pool)
+                                    
+            except (ZfCLIException, ZfLibException) as e:
+                print
+                print e.msg
+
+            finally:
+                if ( pool != None ):
+                    pool.stop()
+                    pool.close()
@@ -0,0 +1,286 @@
+#    A class to create a Zenfolio command-line interface
+# 
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, Bryan Mason
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to 
+#    access the Zenfiolo service.
+#
+###############################################################################
+
+
+from zucla.zfcli import ZfCLI
+from zucla.zfapi import ZfAPIException
+from zucla.zflib import ZfLibException
+from zucla.commands.backup import Backup
+from zucla.commands.create_gallery import CreateGallery
+from zucla.commands.create_group import CreateGroup
+from zucla.commands.restore import Restore
+from zucla.commands.upload import Upload
+from zucla.commands.verify import Verify
+
+import argparse
+import cmd
+import glob
+import os.path
+import shlex
+
+# The commands that can be run in the shell, which share its session.
+COMMANDS = {"backup": Backup,
+            "create-gallery": CreateGallery,
+            "create-group": CreateGroup,
+            "restore": Restore,
+            "upload": Upload,
+            "verify": Verify}
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def current_word(line):
+    """
+    Find the word being typed at the end of a command line, as shlex
+    will split it.
+
+    Parameters:
+    line: the line up to the cursor.
+
+    Returns: (word, quote): the word without quotes or escapes, and the
+        quote character it is inside of, or None.
+    """
+    word = ""
+    quote = None
+    escaped = False
+    for ch in line:
+        if ( escaped ):
+            word += ch
+            escaped = False
+        elif ( ch == "\\" and quote != "'" ):
+            escaped = True
+        elif ( quote != None ):
+            if ( ch == quote ):
+                quote = None
+            else:
+                word += ch
+        elif ( ch in "\"'" ):
+            quote = ch
+        elif ( ch.isspace() ):
+            word = ""
+        else:
+            word += ch
+    return (word, quote)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ShellLoop(cmd.Cmd):
+    """
+    The read-eval loop of zf-shell.  Lines that don't name a built-in
+    command run one of COMMANDS with the shell's session.
+    """
+
+    prompt = "zf> "
+
+    def __init__(self, shell):
+        cmd.Cmd.__init__(self)
+        self._shell = shell
+        self._photosets = {}
+
+    def preloop(self):
+        try:
+            import readline
+            # Zenfolio paths are completed whole, spaces and all.
+            readline.set_completer_delims(" \t\n\"'")
+        except ImportError:
+            pass
+
+    def emptyline(self):
+        pass
+
+    def default(self, line):
+        try:
+            args = shlex.split(line)
+        except ValueError as e:
+            print "Syntax error:", e
+            return
+        if ( args == [] ):
+            return
+        command = COMMANDS.get(args[0])
+        if ( command == None ):
+            print "Unknown command:", args[0], "(try \"help\")"
+            return
+        self._shell.run_command(command, args[1:])
+        # Whatever the command changed is not in the cached photosets.
+        self._photosets = {}
+
+    def do_ls(self, arg):
+        """
+        ls [PATH]: List a group or gallery (default: the root group).
+        """
+        try:
+            args = shlex.split(arg)
+        except ValueError as e:
+            print "Syntax error:", e
+            return
+        index = self._shell.element_index()
+        if ( index == {} ):
+            print "Could not load the group hierarchy"
+            return
+        path = ( args and args[0].rstrip("/") ) or \
+            "/" + self._shell.group_hierarchy()['Title']
+        group = index.get((path, "Group"))
+        photoset = index.get((path, "PhotoSet"))
+        try:
+            if ( group != None ):
+                for element in group.get('Elements') or []:
+                    if ( element['$type'] == "Group" ):
+                        print "  " + element['Title'] + "/"
+                    else:
+                        print "  {:s}  ({:d} photos)".format(
+                            element['Title'], element.get('PhotoCount', 0))
+            elif ( photoset != None ):
+                if ( photoset['Id'] not in self._photosets ):
+                    self._photosets[photoset['Id']] = \
+                        self._shell.LoadPhotoSet(photoset['Id'], "Level1",
+                                                 "True")
+                for photo in self._photosets[photoset['Id']].get('Photos') \
+                        or []:
+                    print "  {:s}  {:d}".format(photo['FileName'],
+                                                photo['Size'])
+            else:
+                print "Not found:", path
+        except (ZfAPIException, ZfLibException) as e:
+            print e.msg
+
+    def do_refresh(self, arg):
+        """
+        refresh: Load the group hierarchy from Zenfolio again (after
+        changes made elsewhere).
+        """
+        self._photosets = {}
+        if ( not self._shell.retrieve_group_hierarchy() ):
+            print "Could not load the group hierarchy"
+
+    def do_help(self, arg):
+        if ( arg in COMMANDS ):
+            self._shell.run_command(COMMANDS[arg], ["--help"])
+        else:
+            cmd.Cmd.do_help(self, arg)
+            if ( arg == "" ):
+                print "Commands sharing the session (\"help COMMAND\" " \
+                    "for their options):"
+                print "  " + "  ".join(sorted(COMMANDS))
+
+    def do_quit(self, arg):
+        """
+        quit: Leave the shell.
+        """
+        return True
+
+    do_exit = do_quit
+
+    def do_EOF(self, arg):
+        print
+        return True
+
+    def completenames(self, text, *ignored):
+        return ( cmd.Cmd.completenames(self, text, *ignored) +
+                 [name for name in sorted(COMMANDS) if name.startswith(text)] )
+
+    def completedefault(self, text, line, begidx, endidx):
+        word, quote = current_word(line[:endidx])
+        # readline replaces only text, the end of the word.
+        keep = len(word) - len(text)
+        matches = []
+        for match in self._shell.complete_path(word):
+            rest = match[keep:]
+            if ( quote == None ):
+                rest = rest.replace(" ", "\\ ")
+            matches.append(rest)
+        return matches
+
+    complete_ls = completedefault
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Shell(ZfCLI):
+    """
+    zf-shell: log in once and run commands in the same session, so that
+    each one costs only its own calls to Zenfolio.
+    """
+
+    def __init__(self):
+        ZfCLI.__init__(self, "shell")
+        self._parser.add_argument("--no-keep-alive", action="store_false",
+                                  dest="keep_alive",
+                                  help="Open a new connection for " + \
+                                      "each call to Zenfolio.")
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def complete_path(self, word):
+        """
+        Complete a Zenfolio path from the cached hierarchy, or a local
+        path.
+
+        Parameters:
+        word: the beginning of the path.
+
+        Returns: A sorted list of completions, one level at a time;
+            groups and directories end with a slash.
+        """
+        matches = set()
+        if ( word.startswith("/") and self._group_hierarchy != None ):
+            for path, etype in self.element_index():
+                if ( not path.startswith(word) ):
+                    continue
+                slash = path.find("/", len(word))
+                if ( slash >= 0 ):
+                    matches.add(path[:slash + 1])
+                elif ( etype == "Group" ):
+                    matches.add(path + "/")
+                else:
+                    matches.add(path)
+        for path in glob.glob(os.path.expanduser(word) + "*"):
+            if ( os.path.isdir(path) ):
+                path += "/"
+            if ( word.startswith("~") ):
+                path = word + path[len(os.path.expanduser(word)):]
+            matches.add(path)
+        return sorted(matches)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def run(self):
+        self.parse_args()
+        self.keep_alive = self.the_args.keep_alive
+
+        if ( self.get_password() ):
+            if ( not self.retrieve_group_hierarchy() ):
+                print "Could not load the group hierarchy"
+                return
+
+            loop = ShellLoop(self)
+            intro = "Logged in as " + self.the_args.user + \
+                ".  Type \"help\" for a list of commands."
+            while ( True ):
+                try:
+                    loop.cmdloop(intro)
+                    break
+                except KeyboardInterrupt:
+                    # Abandon the line being typed, not the shell.
+                    print
+                    intro = ""
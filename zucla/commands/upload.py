@@ -31,9 +31,13 @@
 from zucla.zfcli import ZfCLI, ZfCLIException
 from zucla.zfapi import ZfAPIException
 from zucla.zflib import ZfLibException
+from zucla import zfmanifest
+from zucla import zftransform
 
 import argparse
+from itertools import chain
 from os.path import basename, dirname
+import os
 import sys
 
 class Upload(ZfCLI):
@@ -45,13 +49,27 @@ class Upload(ZfCLI):
         self._parser.add_argument("-p", "--parents", action="store_true",
                                   help="Create parent groups as needed.",
                                   required=False)
-        self._parser.add_argument("images", metavar="file", nargs="+", 
-                                  help="Path(s) to image file(s) to upload.")
-        self._parser.add_argument("gallery", action="store", \
-                                  help="Destination gallery, specified " + \
+        source = self._parser.add_mutually_exclusive_group()
+        source.add_argument("--from-file", action="store", dest="from_file",
+                            metavar="FILE",
+                            help="Also upload the files listed in FILE, " + \
+                                "one per line, each optionally followed " + \
+                                "by a tab and its own destination gallery.")
+        source.add_argument("--from-stdin", action="store_true",
+                            dest="from_stdin",
+                            help="Like --from-file, reading the list " + \
+                                "from standard input.")
+        zftransform.add_arguments(self._parser)
+        self._parser.add_argument("images", metavar="file", nargs="*", 
+                                  help="Path(s) to image file(s) to " + \
+                                      "upload, followed by the " + \
+                                      "destination gallery, specified " + \
                                       "as a path delimited with slashes "+ \
                                       "(\"/\"). For example: " + \
-                                      "\"/All Photographs/Soccer/Earthquakes\".")
+                                      "\"/All Photographs/Soccer/Earthquakes\"." + \
+                                      "  With --from-file or --from-stdin, " + \
+                                      "the gallery is the default for " + \
+                                      "lines that don't name one.")
         
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -62,43 +80,156 @@ class Upload(ZfCLI):
             print "Sorry, -p/--parents not implemented yet."
             exit()
 
+        # The last positional argument is the gallery.
+        images = self.the_args.images
+        gallery = None
+        if ( images != [] ):
+            gallery = images.pop()
+        listed = ( self.the_args.from_file or self.the_args.from_stdin )
+        if ( not listed and images == [] ):
+            self._parser.error("file(s) and gallery are required")
+
+        manifest = None
+        if ( self.the_args.from_file ):
+            try:
+                manifest = open(self.the_args.from_file, 'r')
+            except IOError as e:
+                self._parser.error(self.the_args.from_file + ": " +
+                                   e.strerror)
+        elif ( self.the_args.from_stdin ):
+            manifest = sys.stdin
+
         if ( self.get_password() ):
-            
-            # If we are supposed to create the gallery . . . 
-            if ( self.the_args.create ):
-                # And the gallery doesn't exist, then create it.
-                if ( self.get_group(self.the_args.gallery) == None ):
-                    gallery_title = basename(self.the_args.gallery)
-                    parent_path = dirname(self.the_args.gallery)
-                    print "Creating gallery \"" + gallery_title + "\" "
-                    print "  in group \"" + parent_path + "\""
-                    self.create_gallery(parent_path, gallery_title)
-                
-            num_images = len(self.the_args.images)
-            print "Uploading", num_images, "images to \"" + \
-                self.the_args.gallery + "\""
-
-            # Upload each image..
-            upload_count = 0
-            for image in self.the_args.images:
-                try:
-                    print "{:3d}/{:3d}: {:s}..".format(upload_count+1, 
-                                                        num_images, image),
-                    sys.stdout.flush()
-                    rv = self.upload_to_path(image, self.the_args.gallery)
-                    upload_count += 1
-                    print "Done." 
-
-                # Handle problems from the library.  Print a message
-                # and stop the upload process.
-                except (ZfCLIException, ZfLibException, ZfAPIException) as e:
-                    print
-                    print e.msg
-                    break
-
-                # Handle problems loading the file.  Just print a message
-                # and move to the next file.
-                except IOError as e:
-                    print e.strerror
-            # End for
-            print upload_count, "images uploaded."
+
+            try:
+                transformer = zftransform.from_args(self.the_args)
+            except ZfLibException as e:
+                print e.msg
+                return
+
+            entries = [(image, gallery) for image in images]
+            if ( manifest != None ):
+                entries = chain(entries,
+                                zfmanifest.read_manifest(manifest, gallery))
+                print "Uploading listed images"
+            else:
+                print "Uploading", len(images), "images to \"" + \
+                    gallery + "\""
+
+            try:
+                self.upload_images(entries, transformer,
+                                   manifest == None and len(images))
+            finally:
+                if ( transformer != None ):
+                    transformer.close()
+                if ( manifest != None and manifest != sys.stdin ):
+                    manifest.close()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def gallery_url(self, gallery, urls):
+        """
+        Find the upload URL of a gallery, creating the gallery with -c.
+
+        Parameters:
+        gallery: slash-delimited path of the gallery.
+        urls: dict of gallery -> upload URL (or None if there is no such
+            gallery) already looked up; updated.
+
+        Returns: The upload URL, or None if the gallery doesn't exist.
+        """
+        if ( gallery in urls ):
+            return urls[gallery]
+        url = self.get_upload_url(gallery)
+        if ( url == None and self.the_args.create ):
+            gallery_title = basename(gallery)
+            parent_path = dirname(gallery)
+            print "Creating gallery \"" + gallery_title + "\" "
+            print "  in group \"" + parent_path + "\""
+            photoset = self.create_gallery(parent_path, gallery_title)
+            url = photoset and photoset.get('UploadUrl')
+        if ( url == None ):
+            print "Gallery \"" + gallery + "\" not found"
+        urls[gallery] = url
+        return url
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def upload_images(self, entries, transformer, num_images):
+        """
+        Upload images, a batch at a time, grouped by gallery.
+
+        Parameters:
+        entries: iterable of (path, gallery).
+        transformer: a zftransform.Transformer making the copies to
+            upload, or None to upload the files themselves.
+        num_images: number of images, or None if not known in advance.
+
+        Returns: Nothing
+        """
+        urls = {}
+        upload_count = 0
+        skip_count = 0
+        count = 0
+        try:
+            for batch in zfmanifest.batches(entries):
+                # Start making the copies of the batch; they upload as
+                # they are ready.
+                stats = {}
+                for gallery, paths in batch:
+                    for image in paths:
+                        try:
+                            stats[image] = os.stat(image)
+                        except OSError:
+                            pass
+                if ( transformer != None ):
+                    transformer.submit([(image, stats[image])
+                                        for gallery, paths in batch
+                                        for image in paths
+                                        if image in stats])
+
+                for gallery, paths in batch:
+                    url = self.gallery_url(gallery, urls)
+                    if ( url == None ):
+                        count += len(paths)
+                        skip_count += len(paths)
+                        continue
+
+                    # Upload each image..
+                    for image in paths:
+                        count += 1
+                        if ( num_images ):
+                            print "{:3d}/{:3d}: {:s}..".format(
+                                count, num_images, image),
+                        else:
+                            print "{:5d}: {:s}..".format(count, image),
+                        sys.stdout.flush()
+                        try:
+                            if ( transformer != None and image in stats ):
+                                upload_path = transformer.result(
+                                    image, stats[image])[0]
+                                rv = self.UploadPhotoToURL(upload_path, url,
+                                                           image)
+                            else:
+                                rv = self.UploadPhotoToURL(image, url)
+                            upload_count += 1
+                            print "Done." 
+
+                        # Handle problems loading the file.  Just print a
+                        # message and move to the next file.
+                        except IOError as e:
+                            print e.strerror
+                    # End for
+
+        # Handle problems from the library (or the list).  Print a
+        # message and stop the upload process.
+        except (ZfCLIException, ZfLibException, ZfAPIException) as e:
+            print
+            print e.msg
+
+        print upload_count, "images uploaded."
+        if ( skip_count ):
+            print skip_count, "images skipped (no gallery)."
+        if ( transformer != None ):
+            print "Resized {:d} images ({:d} cached, {:d} sent as they " \
+                "were; {:.1f} MB smaller)".format(
+                    transformer.transformed, transformer.cached,
+                    transformer.kept, transformer.saved_bytes / 1e6)
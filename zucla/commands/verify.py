@@ -0,0 +1,192 @@
+#    A class to create a Zenfolio command-line interface
+# 
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011, Bryan Mason
+#
+#    Copyright (c) 2011, 2012 Bryan Mason
+#   
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to 
+#    access the Zenfiolo service.
+#
+###############################################################################
+
+
+from zucla.zfcli import ZfCLI, ZfCLIException
+from zucla.zflib import ZfLibException
+from zucla.zfverify import Verifier
+from zucla import zffilter
+from zucla import zfscan
+from zucla import zftransform
+
+import argparse
+import sys
+import time
+
+class Verify(ZfCLI):
+
+    def __init__(self):
+        ZfCLI.__init__(self, "verify")
+        self._parser.add_argument("-j", "--jobs", action="store", type=int,
+                                  default=8, metavar="N",
+                                  help="Load N galleries at a time " + \
+                                      "(default 8).")
+        self._parser.add_argument("--scan-jobs", action="store", type=int,
+                                  dest="scan_jobs", default=8, metavar="N",
+                                  help="Read directories with N threads " + \
+                                      "(default 8).")
+        self._parser.add_argument("--report", action="store",
+                                  metavar="FILE",
+                                  help="Write what was found to FILE " + \
+                                      "as JSON.")
+        self._parser.add_argument("--time-limit", action="store",
+                                  type=float, dest="time_limit",
+                                  metavar="SECONDS",
+                                  help="Stop comparing directories " + \
+                                      "after SECONDS; the report says " + \
+                                      "that it is incomplete.")
+        self._parser.add_argument("--quiet", action="store_true",
+                                  help="Only print the summary.")
+        # The backup's options, so that the same files are expected in
+        # the same sizes.
+        zffilter.add_arguments(self._parser, "verify")
+        zftransform.add_arguments(self._parser)
+        self._parser.add_argument("local_path", action="store",
+                                  help="Path that was backed up")
+        self._parser.add_argument("group_path", action="store",
+                                  help="Group it was backed up to, " + \
+                                  "specified as a path delimited with " + \
+                                  "slashes (\"/\") For example: " + \
+                                  "\"/All Photographs/Soccer/Earthquakes\".")
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def show_problem(self, kind, details):
+        """
+        Print a line describing a problem as it is found.
+
+        Parameters:
+            kind: the kind of problem (see zfverify.PROBLEMS)
+            details: dict describing it
+
+        Returns: Nothing
+        """
+
+        if ( self.the_args.quiet ):
+            return
+        if ( kind == "missing_groups" ):
+            print "No group   {:s}".format(details['group'])
+        elif ( kind == "missing_galleries" ):
+            print "No gallery {:s} ({:d} files)".format(details['gallery'],
+                                                      details['files'])
+        elif ( kind == "missing_files" ):
+            print "Miss {:s}".format(details['path'])
+        elif ( kind == "size_mismatches" ):
+            print "Size {:s} ({:d} bytes, {:d} on Zenfolio)".format(
+                details['path'], details['size'], details['remote_size'])
+        elif ( kind == "extra_photos" ):
+            print "Xtra {:s}/{:s}".format(details['gallery'],
+                                          details['file_name'])
+        elif ( kind == "extra_galleries" ):
+            print "Xtra gallery {:s}".format(details['gallery'])
+        else:
+            print "Fail {:s}: {:s}".format(details['gallery'],
+                                           details['message'])
+        sys.stdout.flush()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def print_summary(self, report):
+        """
+        Print a summary of a verification.
+
+        Parameters:
+            report: the VerifyReport
+
+        Returns: Nothing
+        """
+
+        totals = report.as_dict()['totals']
+        print ""
+        if ( report.complete ):
+            print "Summary:"
+        else:
+            print "Summary (stopped at the time limit):"
+        print " Compared {:5d} directories".format(totals['directories'])
+        print "      and {:5d} image files".format(totals['files'])
+        print "     with {:5d} photos".format(totals['photos'])
+        print "  Matched {:5d} image files".format(totals['ok'])
+        print "  Missing {:5d} image files".format(totals['missing_files'])
+        print "  Missing {:5d} galleries and {:d} groups".format(
+            totals['missing_galleries'], totals['missing_groups'])
+        print "    Sizes {:5d} differ".format(totals['size_mismatches'])
+        print "    Extra {:5d} photos".format(totals['extra_photos'])
+        print "    Extra {:5d} galleries".format(totals['extra_galleries'])
+        if ( totals['errors'] ):
+            print "   Failed {:5d} galleries".format(totals['errors'])
+        print "     Took {:.1f} seconds".format(report.finished -
+                                                report.started)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run(self):
+        self.parse_args()
+
+        if ( self.the_args.jobs < 1 ):
+            self._parser.error("--jobs must be at least 1")
+
+        deadline = None
+        if ( self.the_args.time_limit != None ):
+            deadline = time.time() + self.the_args.time_limit
+        try:
+            rules = zffilter.from_args(self.the_args)
+            transformer = zftransform.from_args(self.the_args)
+        except ZfLibException as e:
+            self._parser.error(e.msg)
+
+        if ( self.get_password() ):
+            try:
+                print "   Verifying:", self.the_args.local_path
+                print "     against:", self.the_args.group_path
+                sys.stdout.flush()
+                verifier = Verifier(self, self.the_args.jobs, deadline,
+                                    self.show_problem, transformer, rules)
+                walker = zfscan.walk(self.the_args.local_path,
+                                     self.the_args.scan_jobs, rules)
+                report = verifier.run(walker, self.the_args.local_path,
+                                      self.the_args.group_path)
+                if ( self.the_args.report ):
+                    report.write(self.the_args.report)
+                self.print_summary(report)
+                if ( self.the_args.report ):
+                    print "Report written to", self.the_args.report
+                if ( report.count() > 0 or not report.complete ):
+                    sys.exit(1)
+
+            except (KeyboardInterrupt):
+                print ""
+                print "Interrupt!"
+                sys.exit(1)
+
+            except (ZfCLIException, ZfLibException) as e:
+                print
+                print e.msg
+                sys.exit(1)
+
+            finally:
+                if ( transformer != None ):
+                    transformer.close()
@@ -0,0 +1,281 @@
+#    Adjust the number of concurrent uploads and API calls (AIMD)
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# An AdaptiveLimit gates a fixed set of worker threads (as many as the
+# upper bound), letting only `limit` of them work at a time.  Every
+# window (a few seconds with enough completed calls) it looks at what
+# the workers observed and adjusts the limit, additive-increase/
+# multiplicative-decrease style:
+#
+#   errors:   more than ERROR_RATE of the calls failed or had to be
+#             retried (broken pipes, resets, throttling): halve it
+#   latency:  p90 latency has grown past LATENCY_FACTOR times the best
+#             p90 seen, and throughput did not grow with it: the server
+#             is queueing our requests, so cut it by a quarter
+#   else:     if the limit was actually used, and throughput grew or
+#             latency stayed close to the best seen (the server has room
+#             to spare), add one; otherwise hold
+#
+# The limit stays within the configured bounds.
+#
+# Function list:
+#
+# parse_range:                          "MIN-MAX" -> (MIN, MAX)
+# percentile:                           Percentile of a sorted list
+# AdaptiveLimit:                        AIMD concurrency limit
+
+from zucla.zflib import ZfLibException
+
+import threading
+import time
+
+# Fraction of failed or retried calls in a window that counts as trouble.
+ERROR_RATE = 0.05
+# p90 latency, relative to the best p90 seen, that counts as queueing.
+# (The p90 rather than the median, so that a mix of small and large
+# files does not look like queueing.)
+LATENCY_FACTOR = 2.0
+# p90 latency, relative to the best p90 seen, that still counts as room.
+ROOM_FACTOR = 1.25
+# Multiplicative decreases, for errors and for latency.
+ERROR_BACKOFF = 0.5
+LATENCY_BACKOFF = 0.75
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def parse_range(text):
+    """
+    Parse a concurrency range "MIN-MAX" (1 <= MIN <= MAX).
+
+    Returns: (MIN, MAX).  Raises ZfLibException if the text is not valid.
+    """
+    try:
+        low, high = [int(part) for part in text.split("-")]
+    except ValueError:
+        raise ZfLibException("parse_range", "not a range: " + text)
+    if ( low < 1 or high < low ):
+        raise ZfLibException("parse_range", "not a range: " + text)
+    return (low, high)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def percentile(values, fraction):
+    """
+    Returns: The value at a fraction (0 to 1) of a sorted, non-empty
+        list (nearest rank).
+    """
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class AdaptiveLimit:
+    """
+    A concurrency limit that adapts to how the server copes.
+
+    Attributes:
+    name: what is being limited, for messages ("uploads")
+    limit: the current limit
+    low, high: the bounds of the limit
+    lowest, highest: the lowest and highest limit so far
+    increases, decreases: number of adjustments made
+    throughput: throughput in the last window, in units per second
+    p50, p90: latency percentiles in the last window, in seconds
+    error_rate: fraction of calls that failed or were retried in the
+        last window
+    """
+
+    def __init__(self, name, start, low, high, window=5.0, min_samples=8,
+                 unit="/s", scale=1.0, report=None):
+        """
+        Initialize the limit.
+
+        Parameters:
+        name: what is being limited, for messages.
+        start: the initial limit (kept within low and high).
+        low, high: the bounds of the limit.
+        window: shortest time between adjustments, in seconds.
+        min_samples: fewest completed calls to adjust on.
+        unit, scale: how throughput is shown: the amounts passed to
+            release() are divided by scale (for example "MB/s" and 1e6
+            for bytes).
+        report: function(limit, old) called when the limit changes.
+        """
+        self.name = name
+        self.low = low
+        self.high = high
+        self.limit = min(high, max(low, start))
+        self._window = window
+        self._min_samples = min_samples
+        self._unit = unit
+        self._scale = scale
+        self._report = report
+        self._cond = threading.Condition()
+        self._active = 0
+        self._best_latency = None
+        self._last_throughput = None
+        self._start_window()
+
+        self.lowest = self.limit
+        self.highest = self.limit
+        self.increases = 0
+        self.decreases = 0
+        self.throughput = 0.0
+        self.p50 = 0.0
+        self.p90 = 0.0
+        self.error_rate = 0.0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _start_window(self):
+        """
+        INTERNAL: Forget the samples of the last window.
+        """
+        self._started = time.time()
+        self._latencies = []
+        self._amount = 0
+        self._errors = 0
+        self._saturated = False
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def acquire(self):
+        """
+        Wait until another call may start, and count it as started.
+
+        Returns: The time it started, to pass to release().
+        """
+        with self._cond:
+            while ( self._active >= self.limit ):
+                self._saturated = True
+                # A timeout keeps KeyboardInterrupt deliverable.
+                self._cond.wait(0.5)
+            self._active += 1
+            if ( self._active >= self.limit ):
+                self._saturated = True
+            return time.time()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def release(self, started, amount=1, failed=False):
+        """
+        Count a call as finished, adjusting the limit if a window has
+        passed.
+
+        Parameters:
+        started: what acquire() returned.
+        amount: work done by the call (bytes uploaded, say).
+        failed: the call failed.
+        """
+        with self._cond:
+            self._active -= 1
+            if ( failed ):
+                self._errors += 1
+            else:
+                self._latencies.append(time.time() - started)
+                self._amount += amount
+            self._adjust()
+            self._cond.notify_all()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def cancel(self):
+        """
+        Count a call as finished without it counting as a sample (there
+        turned out to be nothing to do).
+        """
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def error(self):
+        """
+        Count an error that a call recovered from (a retry).
+        """
+        with self._cond:
+            self._errors += 1
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _adjust(self):
+        """
+        INTERNAL: At the end of a window, work out the statistics and
+        move the limit.  Called with the lock held.
+        """
+        elapsed = time.time() - self._started
+        calls = len(self._latencies) + self._errors
+        if ( elapsed < self._window or calls < self._min_samples ):
+            return
+
+        latencies = sorted(self._latencies)
+        self.error_rate = float(self._errors) / calls
+        self.throughput = self._amount / self._scale / elapsed
+        if ( latencies != [] ):
+            self.p50 = percentile(latencies, 0.5)
+            self.p90 = percentile(latencies, 0.9)
+            if ( self._best_latency == None or
+                 self.p90 < self._best_latency ):
+                self._best_latency = self.p90
+
+        old = self.limit
+        gained = ( self._last_throughput == None or
+                   self.throughput > self._last_throughput * 1.05 )
+        if ( self.error_rate > ERROR_RATE ):
+            self.limit = int(self.limit * ERROR_BACKOFF)
+        elif ( latencies != [] and not gained and
+               self.p90 > self._best_latency * LATENCY_FACTOR ):
+            self.limit = int(self.limit * LATENCY_BACKOFF)
+        elif ( self._saturated and
+               (gained or latencies == [] or
+                self.p90 <= self._best_latency * ROOM_FACTOR) ):
+            self.limit += 1
+        self.limit = min(self.high, max(self.low, self.limit))
+
+        self._last_throughput = self.throughput
+        self._start_window()
+        if ( self.limit > old ):
+            self.increases += 1
+            self.highest = max(self.highest, self.limit)
+        elif ( self.limit < old ):
+            self.decreases += 1
+            self.lowest = min(self.lowest, self.limit)
+        if ( self.limit != old and self._report != None ):
+            self._report(self, old)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def status(self, old=None):
+        """
+        Parameters:
+        old: the limit before the last change, or None.
+
+        Returns: A line describing the limit and the last window, like
+            "uploads 6 at a time (was 5; 2.1 MB/s, p50 0.80 s, p90 1.52 s,
+            0% errors)".
+        """
+        was = ""
+        if ( old != None ):
+            was = "was {:d}; ".format(old)
+        return "{:s} {:d} at a time ({:s}{:.1f} {:s}, p50 {:.2f} s, " \
+            "p90 {:.2f} s, {:.0f}% errors)".format(
+                self.name, self.limit, was, self.throughput, self._unit,
+                self.p50, self.p90, self.error_rate * 100)
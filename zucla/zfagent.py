@@ -0,0 +1,363 @@
+#    Run commands in a background agent that keeps a Zenfolio session
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# zf-agent logs in once and listens on a Unix domain socket; the zf-*
+# scripts call forward() before importing anything else, and if an
+# agent for the user is listening, the command runs there (with the
+# agent's session, hierarchy and open connection) and its output is
+# streamed back.  If there is no agent, or the command is one that must
+# run in the caller's process, forward() returns and the script runs
+# the command itself.  Setting ZUCLA_NO_AGENT in the environment
+# always runs commands in-process.
+#
+# The agent runs one command at a time; other clients wait their turn.
+# Only the owner of the socket's directory (which is created mode 0700)
+# can reach it.
+#
+# Messages in both directions are frames: a kind byte, a 4-byte length
+# and the data.  The client sends one request:
+#
+#   q: JSON {"command", "args", "cwd"}
+#
+# and the agent answers with any number of
+#
+#   o: standard output    e: standard error
+#
+# followed by one of
+#
+#   x: the exit status    r: refused (run it in-process)
+#
+# This module is imported by every script, so it uses nothing but
+# light standard modules.
+#
+# Function list:
+#
+# socket_path:                          Where the agent for a user listens
+# send_frame:                           Send a message
+# recv_frame:                           Receive a message
+# forward:                              Run a command in the agent
+# FrameWriter:                          File object that sends frames
+# serve:                                The agent's loop
+
+import json
+import os
+import os.path
+import socket
+import struct
+import sys
+import threading
+
+FRAME = struct.Struct("!cI")
+
+# Options that only make sense in the caller's own process: reading the
+# caller's standard input, limiting the process's memory, or running
+# until stopped.
+LOCAL_OPTIONS = ["--from-stdin", "--max-memory", "--watch"]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def socket_path(user):
+    """
+    Find where the agent for a Zenfolio user listens:
+    $XDG_RUNTIME_DIR/zucla, or /tmp/zucla-UID, then USER.sock.
+    """
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    if ( base ):
+        base = os.path.join(base, "zucla")
+    else:
+        base = "/tmp/zucla-{:d}".format(os.getuid())
+    return os.path.join(base, user + ".sock")
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def send_frame(sock, kind, data):
+    """
+    Send a message.
+
+    Parameters:
+    sock: the connected socket.
+    kind: one-character message kind.
+    data: the message (str).
+    """
+    sock.sendall(FRAME.pack(kind, len(data)) + data)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _recv_all(sock, size):
+    """
+    INTERNAL: Receive exactly size bytes, or None at end of file.
+    """
+    data = ""
+    while ( len(data) < size ):
+        block = sock.recv(size - len(data))
+        if ( not block ):
+            return None
+        data += block
+    return data
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def recv_frame(sock):
+    """
+    Receive a message.
+
+    Parameters:
+    sock: the connected socket.
+
+    Returns: (kind, data), or None if the other end has gone.
+    """
+    header = _recv_all(sock, FRAME.size)
+    if ( header == None ):
+        return None
+    kind, size = FRAME.unpack(header)
+    data = _recv_all(sock, size)
+    if ( data == None ):
+        return None
+    return (kind, data)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _option_value(args, short, long):
+    """
+    INTERNAL: The value of an option in a command line, or None.
+    """
+    value = None
+    for i, arg in enumerate(args):
+        if ( arg == "--" ):
+            break
+        if ( arg in (short, long) and i + 1 < len(args) ):
+            value = args[i + 1]
+        elif ( arg.startswith(long + "=") ):
+            value = arg[len(long) + 1:]
+        elif ( short != None and arg.startswith(short) and
+               len(arg) > len(short) and not arg.startswith("--") ):
+            value = arg[len(short):]
+    return value
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def forward(command, args=None):
+    """
+    Run a command in the agent of its user, if there is one, and exit
+    with its status.
+
+    Parameters:
+    command: name of the command (for example, "upload").
+    args: its arguments (default: sys.argv[1:]).
+
+    Returns: Only if the command is to be run in-process.
+    """
+    if ( args == None ):
+        args = sys.argv[1:]
+    if ( os.environ.get("ZUCLA_NO_AGENT") ):
+        return
+    for arg in args:
+        if ( arg.split("=")[0] in LOCAL_OPTIONS ):
+            return
+    user = _option_value(args, "-u", "--user")
+    if ( not user ):
+        return
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path(user))
+    except socket.error:
+        sock.close()
+        return
+
+    try:
+        send_frame(sock, "q", json.dumps({'command': command,
+                                          'args': args,
+                                          'cwd': os.getcwd()}))
+        while ( True ):
+            frame = recv_frame(sock)
+            if ( frame == None ):
+                sys.stdout.flush()
+                print >>sys.stderr, "The ZUCLA agent went away."
+                sys.exit(1)
+            kind, data = frame
+            if ( kind == "o" ):
+                sys.stdout.write(data)
+                sys.stdout.flush()
+            elif ( kind == "e" ):
+                sys.stderr.write(data)
+                sys.stderr.flush()
+            elif ( kind == "x" ):
+                sys.exit(int(data))
+            elif ( kind == "r" ):
+                return
+    except KeyboardInterrupt:
+        # Closing the socket interrupts the command in the agent.
+        print
+        print "Interrupt!"
+        sys.exit(130)
+    except socket.error as e:
+        print >>sys.stderr, "The ZUCLA agent went away:", e
+        sys.exit(1)
+    finally:
+        sock.close()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class FrameWriter:
+    """
+    A file-like object that sends what is written to a client, for
+    standing in for sys.stdout or sys.stderr while a command runs.  If
+    the client has gone, writing raises KeyboardInterrupt, which stops
+    the command as an interrupt would.
+    """
+
+    softspace = 0
+    encoding = None
+
+    def __init__(self, sock, kind, lock):
+        self._sock = sock
+        self._kind = kind
+        self._lock = lock
+        self.broken = False
+
+    def write(self, data):
+        if ( isinstance(data, unicode) ):
+            data = data.encode("utf-8")
+        if ( data == "" or self.broken ):
+            return
+        with self._lock:
+            try:
+                send_frame(self._sock, self._kind, data)
+            except socket.error:
+                self.broken = True
+                raise KeyboardInterrupt()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _listen(path):
+    """
+    INTERNAL: Create the agent's socket, in a directory only its owner
+    can use.  Raises socket.error if an agent is already listening.
+    """
+    directory = os.path.dirname(path)
+    if ( not os.path.isdir(directory) ):
+        os.makedirs(directory, 0o700)
+    os.chmod(directory, 0o700)
+
+    if ( os.path.exists(path) ):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            probe.close()
+            raise socket.error("an agent is already listening on " + path)
+        except socket.error as e:
+            if ( not isinstance(e.args[0], int) ):
+                raise
+            # Left behind by an agent that died
+            os.remove(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen(16)
+    return server
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def serve(session, path, commands, idle_timeout=None, accept=None):
+    """
+    Run commands for clients until stopped or idle for too long.
+
+    Parameters:
+    session: the logged-in ZfCLI whose run_command runs the commands.
+    path: where to listen.
+    commands: dict of command name -> ZfCLI subclass.
+    idle_timeout: seconds without a client before the agent exits, or
+        None to run until stopped.
+    accept: function(args) -> None if a command line can run in the
+        session, or the reason why not (it is then refused and the
+        client runs it itself).
+
+    Returns: Nothing
+    """
+    server = _listen(path)
+    server.settimeout(idle_timeout)
+    home = os.getcwd()
+    try:
+        while ( True ):
+            try:
+                client, address = server.accept()
+            except socket.timeout:
+                return
+            try:
+                _serve_client(client, session, commands, accept)
+            except socket.error:
+                # The client went away before it was answered.
+                pass
+            finally:
+                client.close()
+                os.chdir(home)
+    finally:
+        server.close()
+        if ( os.path.exists(path) ):
+            os.remove(path)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _serve_client(client, session, commands, accept):
+    """
+    INTERNAL: Run the command that a client asks for.
+    """
+    client.settimeout(None)
+    frame = recv_frame(client)
+    if ( frame == None or frame[0] != "q" ):
+        return
+    try:
+        request = json.loads(frame[1])
+        command = commands[request['command']]
+        # json gives back unicode; arguments and paths are byte strings.
+        args = [arg.encode("utf-8") for arg in request['args']]
+        os.chdir(request['cwd'].encode("utf-8"))
+    except (ValueError, KeyError, TypeError, AttributeError, UnicodeError,
+            OSError) as e:
+        send_frame(client, "r", str(e))
+        return
+    reason = ( accept and accept(args) )
+    if ( reason ):
+        send_frame(client, "r", reason)
+        return
+
+    lock = threading.Lock()
+    stdout = FrameWriter(client, "o", lock)
+    stderr = FrameWriter(client, "e", lock)
+    saved = (sys.stdout, sys.stderr)
+    sys.stdout, sys.stderr = stdout, stderr
+    try:
+        status = session.run_command(command, args)
+    finally:
+        sys.stdout, sys.stderr = saved
+    if ( not stdout.broken and not stderr.broken ):
+        send_frame(client, "x", str(status))
@@ -34,23 +34,33 @@
 # zf_host:                              Get/set host name
 # api_path:                             Get/Set ZF API Path
 # state:                                Get API state
+# clone:                                Copy the session to a new connection
 # zfapi_error:                          Get API Error object
 # zfapi_response:                       Get last API response
 # success:                              Get success of last method call
+# last_upload_id:                       Id of the last uploaded photo
+# open_url:                             Start downloading a URL
 # _make_call (INTERNAL):                Make a call to the API
 # Authenticate:                         Challenge/Response auth
 # AuthenticatePlain:                    Plain text auth
 # LoadGroupHierarchy:                   Load the complete GroupHierarchy
 # LoadPhotoSet:                         LoadPhotoSet
+# LoadPhotoSetPhotos:                   Load a page of a photoset's photos
 # UploadPhototoURL:                     Upload a photo to the Gallery URL
 # CreatePhotoSet:                       CreatePhotoSet
 # CreateGroup:                          CreateGroup
 # DeletePhoto:                          DeletePhoto
+# DeletePhotos:                         Delete several photos in one call
+# CollectionAddPhoto:                   Add a photo to a collection
+# MovePhoto:                            Move a photo to another photoset
+# UpdatePhoto:                          Change a photo's attributes
 #
 ###############################################################################
 
-import httplib
 import json
+import select
+import socket
+import urlparse
 from hashlib import sha256
 from struct import pack, unpack
 import os
@@ -65,6 +75,7 @@ class ZfAPI:
 
     _last_http_response = None
     _last_zfresponse = None
+    _last_upload_id = None
     _conn = None
     _state = Closed
     _zf_token = None
@@ -74,6 +85,10 @@ class ZfAPI:
     _api_path = "/api/1.4/zfapi.asmx"
     debug = 0
 
+    # Keep the connection open between calls (for long sessions such as
+    # zf-shell) instead of closing it after each one.
+    keep_alive = False
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def __init__(self, 
                  ssl = 1, 
@@ -118,12 +133,61 @@ class ZfAPI:
         if ( self._conn ):
             self._conn.close()
 
+        # httplib (which loads ssl) is imported on first use, so that
+        # commands start quickly.
+        import httplib
+
         # Establish the connection
         if ( self._ssl == 1 ):
             self._conn = httplib.HTTPSConnection(self._zf_host)
         else:
             self._conn = httplib.HTTPConnection(self._zf_host)
 
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _request(self, method, url, body, headers):
+        """
+        INTERNAL_ONLY: Send a request on the connection and get the
+        response.  With keep_alive, a connection that the server has
+        closed while it was idle is opened again first, and a request
+        that cannot be sent on a reused connection is sent again on a
+        new one.  A request that has been sent is never resent, as the
+        server may have carried it out.
+
+        Params: as for httplib.HTTPConnection.request
+        Returns: The httplib.HTTPResponse
+        """
+        import httplib
+        reused = ( self._conn.sock != None )
+        if ( reused and self._dropped() ):
+            self._open_connection()
+            reused = False
+        try:
+            self._conn.request(method, url, body, headers)
+        except (httplib.HTTPException, socket.error):
+            # (A new connection that fails is not going to do better.)
+            if ( not (self.keep_alive and reused) ):
+                raise
+            self._open_connection()
+            if ( hasattr(body, "seek") ):
+                body.seek(0)
+            self._conn.request(method, url, body, headers)
+        return self._conn.getresponse()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _dropped(self):
+        """
+        INTERNAL_ONLY: Check whether the server has closed the idle
+        connection.  An idle connection has nothing to read, so a
+        readable one is at its end (or out of step).
+
+        Params: None
+        Returns: True if the connection should not be used again.
+        """
+        try:
+            return select.select([self._conn.sock], [], [], 0)[0] != []
+        except (select.error, socket.error):
+            return True
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def debug(self, debug=None):
         """
@@ -181,6 +245,22 @@ class ZfAPI:
         """
         return self._state
 
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def clone(self):
+        """
+        Create a new API object with its own connection that shares
+        this object's session (host, user and authentication token).
+        Use one clone per thread; a connection must not be shared.
+
+        Parameters: None
+        Returns: A new ZfAPI object.
+        """
+        api = ZfAPI(ssl=self._ssl, debug=self.debug, username=self._username,
+                    zf_host=self._zf_host, api_path=self._api_path)
+        api._state = self._state
+        api._zf_token = self._zf_token
+        return api
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def reset(self):
         """
@@ -224,6 +304,57 @@ class ZfAPI:
 
         return self._last_zfresponse
         
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def last_upload_id(self):
+        """
+        Get the Id of the photo created by the last UploadPhotoToURL.
+        
+        Parameters: None
+        Returns: the photo Id, or None if unknown
+        """
+
+        return self._last_upload_id
+        
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def open_url(self, url, offset=0):
+        """
+        Start downloading a URL (for example, a photo's OriginalUrl)
+        with this session's authentication, on a connection of its own.
+        
+        Parameters:
+        url: the URL; a URL without a host is on the API host.
+        offset: byte to start from, to resume a download.
+
+        Returns: The httplib.HTTPResponse, which the caller reads and
+            closes.  With an offset, a server that supports ranges
+            answers 206; otherwise it sends the whole file with 200.
+        """
+
+        if ( self.debug ):
+            print ">>>>>> open_url(", url, ",", offset, ")"
+
+        import httplib
+
+        parts = urlparse.urlsplit(url)
+        host = parts.netloc or self._zf_host
+        if ( parts.scheme == "https" or 
+             (parts.scheme == "" and self._ssl == 1) ):
+            conn = httplib.HTTPSConnection(host)
+        else:
+            conn = httplib.HTTPConnection(host)
+
+        headers = {"User-Agent": "PyZFAPI/0.1"}
+        if ( self._zf_token ):
+            headers['X-Zenfolio-Token'] = self._zf_token
+        if ( offset > 0 ):
+            headers['Range'] = "bytes={:d}-".format(offset)
+
+        path = parts.path or "/"
+        if ( parts.query ):
+            path += "?" + parts.query
+        conn.request("GET", path, None, headers)
+        return conn.getresponse()
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def success(self):
         """
@@ -293,8 +424,8 @@ class ZfAPI:
             print "Sending:", jsontext
 
         # Make the call and save the response.
-        self._conn.request("POST", self._api_path, jsontext,  headers)
-        self._last_http_response = self._conn.getresponse()
+        self._last_http_response = self._request("POST", self._api_path,
+                                                 jsontext, headers)
 
         if ( self.debug ):
             print "Response:", self._last_http_response.status, \
@@ -305,6 +436,8 @@ class ZfAPI:
         if self._last_http_response.status == 200:
             self._last_zfresponse = json.load(self._last_http_response)
         else:
+            # (Read anyway, so that the connection can be used again.)
+            self._last_http_response.read()
             self._last_zfresponse = None
 
         # Print some debugging information, if so inclined.
@@ -312,7 +445,8 @@ class ZfAPI:
             print "Received:", json.dumps(self._last_zfresponse, indent=2);
             
         # Close the connection.
-        self._conn.close()
+        if ( not self.keep_alive ):
+            self._conn.close()
         
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def GetChallenge(self, username = ""):
@@ -491,13 +625,45 @@ class ZfAPI:
             return None
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def UploadPhotoToURL(self, filepath, upload_path):
+    def LoadPhotoSetPhotos(self, photoset_id, starting_index, number_of_photos):
+        """
+        Get some of the photos of a photo set, so that a large photo set
+        can be read a page at a time.
+        
+        Parameters:
+        photoset_id: ID of the photoset to load
+        starting_index: index of the first photo to return
+        number_of_photos: maximum number of photos to return
+
+        Returns: A list of photo snapshots (Level2), or None on failure.
+        """
+
+        if ( self.debug ):
+            print ">>>>>> LoadPhotoSetPhotos(", photoset_id, ",", \
+                starting_index, ",", number_of_photos, ")"
+
+        # Check the parameters
+        if ( photoset_id == None or photoset_id == "" ):
+            return None
+
+        self._make_call("LoadPhotoSetPhotos", 
+                        [photoset_id, starting_index, number_of_photos])
+
+        if ( self.success() ):
+            return self._last_zfresponse['result']
+        else:
+            return None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def UploadPhotoToURL(self, filepath, upload_path, source=None):
         """
         Upload an image file to a valid upload URL
 
         Parameters:
         filepath: name of file to upload
         upload_path: Zenfolio URL to upload to
+        source: file whose name and modification date the photo gets,
+            if filepath is a copy of it (default: filepath itself)
 
         Returns: zero on failure, nonzero otherwise
         """
@@ -523,12 +689,14 @@ class ZfAPI:
         file = open(filepath, 'r')
 
         # Get the modification date of the file
-        fstats = os.stat(filepath)
+        if ( source == None ):
+            source = filepath
+        fstats = os.stat(source)
         mod_time = time.strftime("%a, %d %b %Y %H:%M:%S %z", 
                                      time.gmtime(fstats.st_mtime))
 
         # Encode the file name and modification date into a query string
-        filename = os.path.basename(filepath)
+        filename = os.path.basename(source)
         upload_query = urlencode({"filename": filename,
                                   "modified": mod_time})
         
@@ -538,16 +706,28 @@ class ZfAPI:
             print "Sending ", filename , "to", upload_url
 
         # Make the call and save the response.
-        self._conn.request("POST", upload_url, file,  headers)
-        file.close()
-        self._last_http_response = self._conn.getresponse()
+        try:
+            self._last_http_response = self._request("POST", upload_url,
+                                                     file, headers)
+        finally:
+            file.close()
 
         if ( self.debug ):
-            print "Response:", self._last_http_response.status, 
-            self._last_http_response.reason
+            print "Response:", self._last_http_response.status, \
+                self._last_http_response.reason
+
+        # On success the body holds the Id of the new photo.
+        self._last_upload_id = None
+        body = self._last_http_response.read()
+        if ( self._last_http_response.status == 200 ):
+            try:
+                self._last_upload_id = int(body.strip())
+            except ValueError:
+                pass
 
         self._last_zfresponse = None
-        self._conn.close()
+        if ( not self.keep_alive ):
+            self._conn.close()
         return self.success()
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -638,7 +818,7 @@ class ZfAPI:
         """
 
         if ( self.debug ):
-            print ">>>>>> DeletePhoto(", photo_id, ",", gu, ")"
+            print ">>>>>> DeletePhoto(", photo_id, ")"
             
         if ( photo_id == None or photo_id == "" ):
             return 0
@@ -647,6 +827,115 @@ class ZfAPI:
         
         return self.success()
 
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def DeletePhotos(self, photo_ids):
+        """
+        Delete several photos with a single call.
+        
+        Parameters:
+        photo_ids: List of identifiers of the photos to delete.
+
+        Returns:
+        True on success, false otherwise
+        """
+
+        if ( self.debug ):
+            print ">>>>>> DeletePhotos(", photo_ids, ")"
+            
+        if ( photo_ids == None or photo_ids == [] ):
+            return 0
+        
+        self._make_call("DeletePhotos", [photo_ids])
+        
+        return self.success()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def CollectionAddPhoto(self, collection_id, photo_id):
+        """
+        Add an existing photo to a collection.  (Galleries own their
+        photos; only collections can show photos from elsewhere.)
+        
+        Parameters:
+        collection_id: Identifier of the collection.
+        photo_id: Identifier of the photo to add.
+
+        Returns:
+        True on success, false otherwise
+        """
+
+        if ( self.debug ):
+            print ">>>>>> CollectionAddPhoto(", collection_id, ",", \
+                photo_id, ")"
+            
+        if ( collection_id == None or photo_id == None ):
+            return 0
+        
+        self._make_call("CollectionAddPhoto", [collection_id, photo_id])
+        
+        return self.success()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def MovePhoto(self, src_set_id, photo_id, dest_set_id, index):
+        """
+        Move a photo from one photoset to another.
+        
+        Parameters:
+        src_set_id: Identifier of the photoset that holds the photo.
+        photo_id: Identifier of the photo to move.
+        dest_set_id: Identifier of the photoset to move it to.
+        index: position of the photo in the destination photoset.
+
+        Returns:
+        True on success, false otherwise
+        """
+
+        if ( self.debug ):
+            print ">>>>>> MovePhoto(", src_set_id, ",", photo_id, ",", \
+                dest_set_id, ",", index, ")"
+            
+        if ( src_set_id == None or photo_id == None or 
+             dest_set_id == None ):
+            return 0
+        
+        self._make_call("MovePhoto", [src_set_id, photo_id, dest_set_id,
+                                      index])
+        
+        return self.success()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def UpdatePhoto(self, photo_id, pu):
+        """
+        Change the attributes of a photo.
+        
+        Parameters:
+        photo_id: Identifier of the photo to update.
+        pu: PhotoUpdater holding the attributes to change.
+
+        Returns:
+        The updated photo on success, None otherwise
+        """
+
+        if ( self.debug ):
+            print ">>>>>> UpdatePhoto(", photo_id, ",", pu, ")"
+            
+        if ( photo_id == None or pu == None ):
+            return None
+
+        updater = {}
+        if ( pu.Title != None):
+            updater['Title'] = pu.Title
+        if ( pu.Caption != None):
+            updater['Caption'] = pu.Caption
+        if ( pu.FileName != None):
+            updater['FileName'] = pu.FileName
+        
+        self._make_call("UpdatePhoto", [photo_id, updater])
+        
+        if ( self.success() ):
+            return self._last_zfresponse['result']
+        else:
+            return None
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     class PhotoSetUpdater():
         Title = None
@@ -678,6 +967,18 @@ class ZfAPI:
             self.CustomReference = custom_reference
         #END def
     #END class
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    class PhotoUpdater():
+        Title = None
+        Caption = None
+        FileName = None
+
+        def __init__(self, title=None, caption=None, file_name=None):
+            self.Title = title
+            self.Caption = caption
+            self.FileName = file_name
+        #END def
+    #END class
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 class ZfAPIException(Exception):
     """
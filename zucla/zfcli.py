@@ -28,9 +28,12 @@
 #
 ###############################################################################
 
+from zucla.zfapi import ZfAPIException
 from zucla.zflib import ZfLib, ZfLibException
 from getpass import getpass
 import argparse
+import httplib
+import threading
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 class ZfCLI(ZfLib):
@@ -40,6 +43,9 @@ class ZfCLI(ZfLib):
 
     _parser = None
     the_args = None
+    _password = None
+    _session = None
+    _session_args = None
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def __init__(self, description):
@@ -59,6 +65,13 @@ class ZfCLI(ZfLib):
                                   dest='ssl',
                                   help="Disable SSL (default is SSL).",
                                   required=False)
+        self._parser.add_argument("--host", action="store",
+                                  dest="zf_host", default="www.zenfolio.com",
+                                  metavar="HOST[:PORT]",
+                                  help="Zenfolio API host (default " + \
+                                      "www.zenfolio.com); for example, " + \
+                                      "a local test server.",
+                                  required=False)
         self._parser.add_argument("--debug", action="store_true",
                                   help="Show debugging information.",
                                   required=False)
@@ -66,34 +79,191 @@ class ZfCLI(ZfLib):
     def parse_args(self):
 
         # Parse the arguments.
-        self.the_args = self._parser.parse_args()
+        if ( self._session == None ):
+            self.the_args = self._parser.parse_args()
+        else:
+            user = self._session._username
+            self.the_args = self._parser.parse_args(["-u", user] +
+                                                    self._session_args)
+            # Take over the session instead of starting a new one.
+            self.__dict__.update(self._session.session_state())
+            if ( self.the_args.user != user ):
+                self._parser.error("the session is logged in as " + user)
+            return
 
         # Create the Zenfolio Library object
         ZfLib.__init__(self, debug=self.the_args.debug,
                        username=self.the_args.user,
-                       ssl=self.the_args.ssl)
+                       ssl=self.the_args.ssl,
+                       zf_host=self.the_args.zf_host)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def session_state(self):
+        """
+        Get what makes up this command's Zenfolio session: the
+        connection, login, group hierarchy and its index, and the
+        password for logging in again.
+
+        Returns: A dict of attribute name -> value.
+        """
+        state = dict([(name, value) for name, value in vars(self).items()
+                      if hasattr(ZfLib, name)])
+        state['_password'] = self._password
+        return state
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def use_session(self, session, args):
+        """
+        Run this command in the session of another, logged-in command
+        (see zf-shell) rather than logging in itself.  Call end_session
+        when the command is done.
+
+        Parameters:
+        session: the ZfCLI whose session to use.
+        args: the command's arguments (without -u).
+        """
+        self._session = session
+        self._session_args = args
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def end_session(self):
+        """
+        Hand the session (which the command may have logged in again or
+        whose hierarchy it may have reloaded) back to its owner.
+        """
+        if ( self._session != None and self.the_args != None ):
+            self._session.__dict__.update(self.session_state())
+        self._session = None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run_command(self, command_class, args):
+        """
+        Run another command in this command's session (see use_session).
+
+        Parameters:
+        command_class: the ZfCLI subclass of the command.
+        args: its arguments.
+
+        Returns: The command's exit status: 0, what it passed to exit()
+            (2 for bad arguments), 1 after an error or 130 after an
+            interrupt.
+        """
+        command = command_class()
+        command.use_session(self, args)
+        try:
+            command.run()
+            return 0
+        except SystemExit as e:
+            # Bad arguments or --help; argparse has said why.
+            if ( e.code == None or isinstance(e.code, int) ):
+                return e.code or 0
+            print e.code
+            return 1
+        except KeyboardInterrupt:
+            print
+            print "Interrupt!"
+            return 130
+        except (ZfCLIException, ZfLibException, ZfAPIException) as e:
+            print e.msg
+            return 1
+        except (IOError, httplib.HTTPException) as e:
+            # A dropped connection or an unreadable file ends the
+            # command, not the session.
+            print "Error:", e
+            return 1
+        finally:
+            command.end_session()
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _prepare_login(self):
+        """
+        INTERNAL: Connect (DNS, TCP and TLS) and get the login challenge
+        in the background, while the password is being typed.
+
+        Returns: (thread, result): the thread, and a dict whose 'ok' is
+            nonzero once the challenge has been received.
+        """
+        result = {'ok': 0}
+
+        def prepare():
+            try:
+                result['ok'] = self.GetChallenge(self.the_args.user)
+            except Exception:
+                # Whatever went wrong, login() will try again (and
+                # report it).
+                pass
 
+        thread = threading.Thread(target=prepare)
+        thread.daemon = True
+        thread.start()
+        return (thread, result)
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def get_password(self):
-        if ( self.the_args.password ):
+        # A shared session is logged in already.
+        if ( self._session != None and self._state == self.Authenticated ):
+            return 1
+
+        # Log in again without asking after a dropped connection.
+        prepared = None
+        keep_alive = self.keep_alive
+        if ( self._password ):
+            passwd = self._password
+        elif ( self.the_args.password ):
             passwd = self.the_args.password
         else:
-            passwd = getpass()
+            # Keep the connection that gets the challenge open for
+            # Authenticate.
+            self.keep_alive = True
+            prepared = self._prepare_login()
+            try:
+                passwd = getpass()
+            finally:
+                # A timeout keeps KeyboardInterrupt deliverable.
+                while ( prepared[0].is_alive() ):
+                    prepared[0].join(0.5)
+
+        try:
+            logged_in = self._login_with(passwd, prepared)
+        finally:
+            self.keep_alive = keep_alive
+            if ( not keep_alive and self._conn ):
+                self._conn.close()
+
+        if ( not logged_in ):
+            print "Login failure."
+        else:
+            self._password = passwd
+            
+        return logged_in
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _login_with(self, passwd, prepared):
+        """
+        INTERNAL: Log in, asking for the password again if it is wrong.
+
+        Parameters:
+        passwd: the password.
+        prepared: what _prepare_login returned, or None.
 
+        Returns: nonzero if logged in.
+        """
         logged_in = 0
         retries = 3
         while (not logged_in and retries > 0 ):
-            rv = self.login(passwd, self.the_args.user)
+            rv = 0
+            if ( prepared != None and prepared[1]['ok'] ):
+                rv = self.Authenticate(passwd)
+            prepared = None
+            if ( rv == 0 ):
+                # (The early challenge may have expired.)
+                rv = self.login(passwd, self.the_args.user)
             if ( rv == 0 ):
                 print "Login failure.  Please try again."
                 passwd = getpass()
                 retries -= 1
             logged_in = rv
-
-        if ( not logged_in ):
-            print "Login failure."
-            
         return logged_in
 
 class ZfCLIException(ZfLibException):
@@ -0,0 +1,296 @@
+#    Coordination of several backups sharing one tree (sharded backups)
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# A sharded backup runs N processes (on one host or several) over the
+# same tree.  Each directory belongs to exactly one shard, chosen either
+# by its top-level directory (so the other shards never even list it)
+# or by a hash of its path (which spreads a tree with few top-level
+# directories evenly).  The root directory belongs to shard 1.
+#
+# Groups that several shards need (the parents of their directories)
+# must be created exactly once.  The shards share a sqlite database,
+# which may be on a shared file system, and create groups and galleries
+# only while holding its write lock: a shard that gets the lock first
+# creates the element and records it, and the others find the record,
+# reload the hierarchy and use the element.  The same database collects
+# each shard's counters so that summaries can be merged.
+#
+# The counters belong to a run.  A shard that starts joins the current
+# run, unless it has a row in it already: then it has been run before
+# and this is a new run, so the rows of the old run are cleared (and a
+# shard of the old run that is still going no longer counts).
+#
+# Function list:
+#
+# parse_shard:                          "2/4" -> (2, 4)
+# shard_of:                             Shard that a directory belongs to
+# ShardRules:                           Walk rules that prune other shards
+# Coordinator:                          The shared database
+
+from zucla.zflib import ZfLibException
+from zucla import zfdiff
+
+from hashlib import md5
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# Counters kept for each shard, in summary order.
+COUNTERS = ["groups", "galleries", "skipped", "old", "added", "updated",
+            "deleted", "failed", "retried"]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def parse_shard(text):
+    """
+    Parse a shard specification "I/N" (1 <= I <= N).
+
+    Returns: (I, N).  Raises ZfLibException if the text is not valid.
+    """
+    try:
+        index, count = [int(part) for part in text.split("/")]
+    except ValueError:
+        raise ZfLibException("parse_shard", "not a shard: " + text)
+    if ( count < 1 or index < 1 or index > count ):
+        raise ZfLibException("parse_shard", "not a shard: " + text)
+    return (index, count)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def shard_of(rpath, count, by="top"):
+    """
+    Find the shard that a directory belongs to.
+
+    Parameters:
+    rpath: path of the directory relative to the root of the tree
+        ("" or "." for the root).
+    count: number of shards.
+    by: "top" to shard by top-level directory, "hash" by full path.
+
+    Returns: The shard number, 1 to count.
+    """
+    if ( rpath == "" or rpath == "." ):
+        return 1
+    parts = rpath.split(os.sep)
+    if ( by == "top" ):
+        key = parts[0]
+    else:
+        key = "/".join(parts)
+    return int(md5(key).hexdigest()[:8], 16) % count + 1
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ShardRules:
+    """
+    Rules for zfscan.walk that leave out the top-level directories of
+    other shards (when sharding by top-level directory), on top of an
+    optional zffilter.FilterRules.
+    """
+
+    def __init__(self, index, count, rules=None):
+        self._index = index
+        self._count = count
+        self._rules = rules
+
+    def prune_dir(self, rel_dir, name):
+        if ( rel_dir == "" and shard_of(name, self._count) != self._index ):
+            return True
+        return ( self._rules != None and self._rules.prune_dir(rel_dir, name) )
+
+    def skip_name(self, rel_dir, name):
+        return ( self._rules != None and self._rules.skip_name(rel_dir, name) )
+
+    def skip_stat(self, stat):
+        return ( self._rules != None and self._rules.skip_stat(stat) )
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Coordinator:
+    """
+    The database shared by the shards of a backup.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS elements (
+               path TEXT NOT NULL,
+               type TEXT NOT NULL,
+               id INTEGER,
+               shard INTEGER,
+               created INTEGER NOT NULL,
+               PRIMARY KEY (path, type))""",
+        """CREATE TABLE IF NOT EXISTS shards (
+               shard INTEGER PRIMARY KEY,
+               count INTEGER NOT NULL,
+               run INTEGER DEFAULT 0,
+               host TEXT,
+               pid INTEGER,
+               started INTEGER,
+               reported INTEGER,
+               finished INTEGER,
+               """ + ",\n               ".join([name + " INTEGER DEFAULT 0"
+                                                for name in COUNTERS]) + ")",
+        ]
+
+    def __init__(self, filename, index, count, timeout=600.0):
+        """
+        Open (and create, if needed) the shared database and register
+        this shard in the current run, or in a new one (see above).
+
+        Parameters:
+        filename: path of the database file.
+        index, count: this shard, and the number of shards.
+        timeout: how long to wait for another shard's lock, in seconds.
+        """
+        self.filename = filename
+        self.index = index
+        self.count = count
+        # Rollback journaling rather than WAL: WAL needs shared memory,
+        # which doesn't work across hosts.
+        self._db = sqlite3.connect(filename, timeout=timeout,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+        self._db.text_factory = str
+        self._lock = threading.RLock()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in self.SCHEMA:
+                self._db.execute(statement)
+            # Databases from before runs were told apart
+            columns = [row[1] for row
+                       in self._db.execute("PRAGMA table_info(shards)")]
+            if ( "run" not in columns ):
+                self._db.execute("ALTER TABLE shards ADD COLUMN " +
+                                 "run INTEGER DEFAULT 0")
+            self.run = self._db.execute("SELECT MAX(run) FROM shards " +
+                                        "WHERE count = ?",
+                                        (count,)).fetchone()[0] or 0
+            if ( self._db.execute("SELECT shard FROM shards " +
+                                  "WHERE shard = ? AND count = ?",
+                                  (index, count)).fetchone() != None ):
+                self.run += 1
+                self._db.execute("DELETE FROM shards WHERE count = ?",
+                                 (count,))
+            now = int(time.time())
+            self._db.execute("INSERT OR REPLACE INTO shards " +
+                             "(shard, count, run, host, pid, started, " +
+                             "reported) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (index, count, self.run, socket.gethostname(),
+                              os.getpid(), now, now))
+            self._db.execute("COMMIT")
+        except:
+            self._db.execute("ROLLBACK")
+            raise
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def create(self, session, etype, parent_path, title, create):
+        """
+        Create a group or gallery unless another shard has created it.
+
+        Parameters:
+        session: the ZfLib to create it with.
+        etype: "Group" or "PhotoSet".
+        parent_path: slash-delimited path of the parent group.
+        title: title of the new element.
+        create: function() that creates it and returns the result.
+
+        Returns: (result, created): what create() returned and True, or
+            the existing element and False if another shard created it.
+        """
+        path = zfdiff.zf_path_for(parent_path, title)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Another shard may have created it since our hierarchy
+                # was loaded.
+                session.retrieve_group_hierarchy()
+                element = session.element_index().get((path, etype))
+                created = ( element == None )
+                if ( not created ):
+                    result = element
+                else:
+                    result = create()
+                    element = session.element_index().get((path, etype))
+                    if ( element != None ):
+                        self._db.execute("INSERT OR REPLACE INTO elements " +
+                                         "(path, type, id, shard, created) " +
+                                         "VALUES (?, ?, ?, ?, ?)",
+                                         (path, etype, element['Id'],
+                                          self.index, int(time.time())))
+                self._db.execute("COMMIT")
+            except:
+                self._db.execute("ROLLBACK")
+                raise
+        return (result, created)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def report(self, counters, finished=False):
+        """
+        Publish this shard's counters.
+
+        Parameters:
+        counters: dict of counter name (see COUNTERS) -> value.
+        finished: this shard is done.
+        """
+        values = [counters.get(name, 0) for name in COUNTERS]
+        now = int(time.time())
+        with self._lock:
+            self._db.execute("UPDATE shards SET reported = ?, " +
+                             "finished = ?, " +
+                             ", ".join([name + " = ?" for name in COUNTERS]) +
+                             " WHERE shard = ? AND count = ? AND run = ?",
+                             [now, finished and now or None] + values +
+                             [self.index, self.count, self.run])
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def totals(self):
+        """
+        Add up the counters of all the shards of this run.
+
+        Returns: (counters, finished): dict of counter name -> total,
+            and the number of shards that have finished.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT finished, " +
+                                    ", ".join(COUNTERS) +
+                                    " FROM shards WHERE count = ? " +
+                                    "AND run = ?",
+                                    (self.count, self.run)).fetchall()
+        totals = dict([(name, 0) for name in COUNTERS])
+        finished = 0
+        for row in rows:
+            if ( row[0] != None ):
+                finished += 1
+            for i, name in enumerate(COUNTERS):
+                totals[name] += row[i + 1] or 0
+        return (totals, finished)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        if ( self._db != None ):
+            self._db.close()
+            self._db = None
@@ -0,0 +1,123 @@
+#    Find local files whose content is already on Zenfolio
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# Copies of the same picture in several directories are found by content
+# hash (see zfhash).  A file counts as being on Zenfolio if it was
+# uploaded or found unchanged earlier in this run, or if the state
+# database (zfstate) records it with its hash.
+#
+# What to do with a duplicate is up to the caller:
+#
+#   skip:   don't upload it; the photo stays in the first gallery only
+#   link:   add the existing photo to the current photoset, which the
+#           API only allows for collections; elsewhere, as skip
+#   report: upload it anyway, but count it
+#
+# Function list:
+#
+# DuplicateIndex:                       Hashes of files known to be uploaded
+
+import os.path
+
+POLICIES = ["skip", "link", "report"]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class DuplicateIndex:
+    """
+    Content hashes of the files that are on Zenfolio.
+
+    Attributes:
+    policy: "skip", "link" or "report"
+    duplicates: number of duplicates found
+    saved_bytes: total size of the duplicates that were not uploaded
+        (with "report", that could have been left out)
+    linked: number of duplicates added to a collection
+    """
+
+    def __init__(self, policy="skip", state=None):
+        """
+        Initialize the index.
+
+        Parameters:
+        policy: what the caller does with duplicates (see POLICIES).
+        state: a ZfState to look up files from earlier runs, or None.
+        """
+        self.policy = policy
+        self._state = state
+        self._hashes = {}
+
+        self.duplicates = 0
+        self.saved_bytes = 0
+        self.linked = 0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def add(self, digest, path, photo_id, photoset_id):
+        """
+        Remember that a file is on Zenfolio.  The first file with a
+        given content is kept.
+
+        Parameters:
+        digest: content hash of the file.
+        path: local path of the file.
+        photo_id: Id of its photo.
+        photoset_id: Id of the photoset that holds the photo.
+        """
+        if ( photo_id != None and digest not in self._hashes ):
+            self._hashes[digest] = (path, photo_id, photoset_id)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def find(self, digest, path, size):
+        """
+        Look for another file with the same content, counting it as a
+        duplicate if there is one.
+
+        Parameters:
+        digest: content hash of the file.
+        path: local path of the file.
+        size: size of the file, in bytes.
+
+        Returns: (path, photo_id, photoset_id) of the file on Zenfolio,
+            or None.
+        """
+        original = self._hashes.get(digest)
+        if ( original != None and
+             (original[0] == path or not os.path.exists(original[0])) ):
+            original = None
+        if ( original == None and self._state != None ):
+            original = self._state.find_hash(digest, path)
+            # Once its file is gone, --mirror may delete its photo.
+            if ( original != None and not os.path.exists(original[0]) ):
+                original = None
+            if ( original != None ):
+                self._hashes[digest] = original
+        if ( original != None ):
+            self.duplicates += 1
+            self.saved_bytes += size
+        return original
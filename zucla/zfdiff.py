@@ -0,0 +1,273 @@
+#    Compare a local directory tree with the Zenfolio group hierarchy
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# Nothing in this module talks to Zenfolio.  The remote side is described
+# by an element index (see ZfLib.element_index) and a dict of photoset
+# snapshots, so a diff can be computed from cached data.
+#
+# Function list:
+#
+# zf_path_for:                          Map a relative local path to ZF
+# scan_tree:                            Scan a local tree
+# load_snapshots:                       Load the snapshots a diff needs
+# diff_tree:                            Compute the ChangeSet for a tree
+
+from zucla import zfscan
+
+import os
+import os.path
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class LocalDir:
+    """
+    One directory of a local tree scan.
+
+    Attributes:
+    rpath: path relative to the root of the scan ("" for the root)
+    subdirs: sorted list of the names of the subdirectories
+    images: dict of image file name -> (size, mtime)
+    others: number of files that are not images
+    excluded: set of the names of files left out by filter rules,
+        whose photos a mirror keeps
+    """
+
+    def __init__(self, rpath, subdirs=None, images=None, others=0,
+                 excluded=None):
+        self.rpath = rpath
+        self.subdirs = subdirs or []
+        self.images = images or {}
+        self.others = others
+        self.excluded = excluded or set()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class LocalTree:
+    """
+    A scan of a local directory tree.
+
+    Attributes:
+    root: the local path that was scanned
+    dirs: list of LocalDir, in top-down walk order
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.dirs = []
+
+    def add(self, local_dir):
+        self.dirs.append(local_dir)
+
+    def local_path(self, rpath, filename=None):
+        """
+        Return the local path for a relative directory (and file).
+        """
+        if ( rpath == "" ):
+            path = self.root
+        else:
+            path = os.path.join(self.root, rpath)
+        if ( filename != None ):
+            path = os.path.join(path, filename)
+        return path
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ChangeSet:
+    """
+    Everything that must be done to bring Zenfolio up to date with a
+    local tree.
+
+    Attributes:
+    groups: Zenfolio paths of the groups to create, parents first
+    galleries: Zenfolio paths of the galleries to create
+    add: list of (local path, gallery path, size) to upload
+    replace: list of (local path, gallery path, size, old photo) to
+        upload in place of an existing photo
+    delete: list of (gallery path, photo) without a local counterpart
+    unchanged: number of image files that are already up to date
+    others: number of files that are not images
+    """
+
+    def __init__(self):
+        self.groups = []
+        self.galleries = []
+        self.add = []
+        self.replace = []
+        self.delete = []
+        self.unchanged = 0
+        self.others = 0
+
+    def upload_bytes(self):
+        """
+        Return the number of bytes that have to be uploaded.
+        """
+        return sum([op[2] for op in self.add]) + \
+            sum([op[2] for op in self.replace])
+
+    def is_empty(self):
+        return ( self.groups == [] and self.galleries == [] and
+                 self.add == [] and self.replace == [] and
+                 self.delete == [] )
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def zf_path_for(zf_root, rpath):
+    """
+    Map a path relative to the local root to a Zenfolio path.
+
+    Parameters:
+    zf_root: Zenfolio path that the local root maps to.
+    rpath: path relative to the local root ("" or "." for the root).
+
+    Returns: The Zenfolio path, in the form used by ZfLib.element_index.
+    """
+    parts = [part for part in zf_root.split("/") if part != ""]
+    if ( rpath != "" and rpath != "." ):
+        parts.extend(rpath.split(os.sep))
+    return "/" + "/".join(parts)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def scan_tree(root, jobs=8, rules=None):
+    """
+    Scan a local directory tree.
+
+    Parameters:
+    root: local path to scan.
+    jobs: number of threads scanning (see zfscan.walk).
+    rules: zffilter.FilterRules deciding what to leave out, or None.
+
+    Returns: A LocalTree.
+    """
+    tree = LocalTree(root)
+    for scan_dir in zfscan.walk(root, jobs, rules):
+        rpath = os.path.relpath(scan_dir.path, root)
+        if ( rpath == "." ):
+            rpath = ""
+        images = dict([(name, (stat.st_size, stat.st_mtime))
+                       for name, stat in scan_dir.images.iteritems()])
+        tree.add(LocalDir(rpath, list(scan_dir.dirs), images,
+                          len(scan_dir.files) - len(images),
+                          scan_dir.excluded))
+    return tree
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def load_snapshots(zflib, tree, zf_root, mirror=False):
+    """
+    Load the photoset snapshots that diff_tree needs for a tree: the
+    existing galleries of every directory that has images (or of every
+    directory, when mirroring).
+
+    Parameters:
+    zflib: an authenticated ZfLib.
+    tree: the LocalTree to compare.
+    zf_root: Zenfolio path that the local root maps to.
+    mirror: also load galleries of directories without images.
+
+    Returns: dict of Zenfolio path -> photoset snapshot.
+    """
+    index = zflib.element_index()
+    snapshots = {}
+    for local_dir in tree.dirs:
+        if ( local_dir.images == {} and not mirror ):
+            continue
+        zf_path = zf_path_for(zf_root, local_dir.rpath)
+        element = index.get((zf_path, "PhotoSet"))
+        if ( element != None ):
+            photoset = zflib.LoadPhotoSet(element['Id'], "Level2", "True")
+            if ( photoset != None ):
+                snapshots[zf_path] = photoset
+    return snapshots
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def diff_tree(tree, zf_root, index, snapshots, mirror=False):
+    """
+    Compute what has to change on Zenfolio for it to match a local tree.
+
+    The same rules as Backup apply: a directory with subdirectories
+    needs a group, a directory with images needs a gallery, a photo is
+    replaced when its size differs from the local file, and (when
+    mirroring) a photo without a local file is deleted.  Files left
+    out by filter rules still count as local files there.
+
+    Parameters:
+    tree: the LocalTree to compare.
+    zf_root: Zenfolio path that the local root maps to.
+    index: dict of (Zenfolio path, element type) -> element, as returned
+        by ZfLib.element_index.
+    snapshots: dict of Zenfolio path -> photoset snapshot with photos.
+    mirror: compute deletions as well.
+
+    Returns: A ChangeSet.
+    """
+    changes = ChangeSet()
+
+    for local_dir in tree.dirs:
+        zf_path = zf_path_for(zf_root, local_dir.rpath)
+        changes.others += local_dir.others
+
+        if ( local_dir.subdirs != [] and
+             (zf_path, "Group") not in index ):
+            changes.groups.append(zf_path)
+
+        photoset = snapshots.get(zf_path)
+        if ( photoset == None ):
+            remote = {}
+            if ( local_dir.images != {} and
+                 (zf_path, "PhotoSet") not in index ):
+                changes.galleries.append(zf_path)
+        else:
+            # File name -> photos.  As with ZfLib.get_photo, the first
+            # of several photos with the same file name is the one that
+            # counts, but a mirror deletes them all.
+            remote = {}
+            for photo in photoset['Photos']:
+                remote.setdefault(photo['FileName'], []).append(photo)
+
+        local = local_dir.images
+        local_names = set(local)
+        remote_names = set(remote)
+
+        dir_path = tree.local_path(local_dir.rpath)
+        for name in sorted(local_names - remote_names):
+            changes.add.append((os.path.join(dir_path, name),
+                                zf_path, local[name][0]))
+
+        for name in sorted(local_names & remote_names):
+            size = local[name][0]
+            photo = remote[name][0]
+            if ( size != photo['Size'] ):
+                changes.replace.append((os.path.join(dir_path, name),
+                                        zf_path, size, photo))
+            else:
+                changes.unchanged += 1
+
+        if ( mirror ):
+            for name in sorted(remote_names - local_names -
+                               local_dir.excluded):
+                for photo in remote[name]:
+                    changes.delete.append((zf_path, photo))
+
+    return changes
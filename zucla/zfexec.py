@@ -0,0 +1,371 @@
+#    Concurrent execution of uploads and backup plans
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# UploadPool:                           Upload files with N worker threads
+# PlanExecutor:                         Carry out a backup plan
+
+from zucla.zfapi import ZfAPIException
+from zucla.zflib import ZfLibException
+from zucla.zfsched import UploadScheduler
+from zucla import zfplan
+
+import httplib
+import os.path
+import threading
+import time
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class UploadTask:
+    """
+    A file to upload.
+
+    Attributes:
+    local_path: path of the file to upload
+    upload_url: UploadUrl of the destination gallery
+    size: size of the file in bytes
+    gallery: Zenfolio path of the destination gallery (for messages)
+    replace_id: Id of a photo to delete once the upload succeeds, or None
+    stat: os.stat result for the file, if the caller wants to record it
+    photoset_id: Id of the destination photoset, if known
+    upload_path: the file to send in place of local_path (a resized
+        copy, say), or None to send local_path itself; size is then
+        that of the copy
+    """
+
+    def __init__(self, local_path, upload_url, size, gallery=None,
+                 replace_id=None, stat=None, photoset_id=None,
+                 upload_path=None):
+        self.local_path = local_path
+        self.upload_url = upload_url
+        self.size = size
+        self.gallery = gallery
+        self.replace_id = replace_id
+        self.stat = stat
+        self.photoset_id = photoset_id
+        self.upload_path = upload_path
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class UploadPool:
+    """
+    Upload files with several worker threads, each with its own
+    connection sharing one authenticated session.
+
+    Attributes:
+    uploaded: number of files uploaded
+    bytes: number of bytes uploaded
+    retries: number of retried uploads
+    failed: list of (UploadTask, message) that could not be uploaded
+    """
+
+    def __init__(self, session, jobs=4, max_retries=3, queue_size=0,
+                 report=None, done=None, scheduler=None, limit=None):
+        """
+        Initialize the pool.
+
+        Parameters:
+        session: an authenticated ZfAPI (or subclass) to clone.
+        jobs: number of worker threads.
+        max_retries: how often to retry a broken or reset connection.
+        queue_size: bound on waiting tasks; submit() blocks when the
+            queue is full.  Zero means no bound.
+        report: function(action, task) called (serialized) when a file
+            is started ("Add"/"New"), or fails ("Fail").
+        done: function(task, photo_id) called (serialized) when a file
+            has been uploaded.
+        scheduler: a zfsched.UploadScheduler deciding the order of the
+            uploads; it replaces queue_size.  By default, files are
+            uploaded in the order they are submitted.
+        limit: a zfadapt.AdaptiveLimit that decides how many of the
+            workers upload at a time, or None.  With a limit, there
+            are as many workers as its upper bound, and jobs is unused.
+        """
+        self._session = session
+        self._jobs = max(1, jobs)
+        self._limit = limit
+        if ( limit != None ):
+            self._jobs = limit.high
+        self._max_retries = max_retries
+        if ( scheduler == None ):
+            scheduler = UploadScheduler(queue_size=queue_size)
+        self._queue = scheduler
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._report = report
+        self._done = done
+
+        self.uploaded = 0
+        self.bytes = 0
+        self.retries = 0
+        self.failed = []
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def start(self):
+        """
+        Start the worker threads.
+        """
+        for i in range(self._jobs):
+            thread = threading.Thread(target=self._worker,
+                                      name="upload-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def submit(self, task):
+        """
+        Queue an UploadTask.
+        """
+        self._queue.put(task)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        """
+        Wait until every queued task is done and stop the workers.
+        """
+        self._queue.close()
+        # Join with a timeout so that KeyboardInterrupt gets through.
+        for thread in self._threads:
+            while ( thread.is_alive() ):
+                thread.join(0.5)
+        self._threads = []
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def stop(self):
+        """
+        Drop the tasks that have not been started yet.
+        """
+        self._stopping = True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def report(self, action, task):
+        with self._lock:
+            if ( self._report != None ):
+                self._report(action, task)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _upload(self, api, task):
+        """
+        INTERNAL: Upload one file, reconnecting on a broken connection.
+
+        Returns: nonzero on success, zero on failure
+        """
+        retries = 0
+        while ( True ):
+            try:
+                result = api.UploadPhotoToURL(task.upload_path or
+                                              task.local_path,
+                                              task.upload_url,
+                                              task.local_path)
+            except IOError as e:
+                # Broken pipe or Connection reset by peer.  Anything
+                # else (a BadStatusLine, say) may come after the server
+                # has stored the photo, and a retry would duplicate it.
+                if ( retries < self._max_retries and
+                     (e.errno == 32 or e.errno == 104) ):
+                    retries += 1
+                    with self._lock:
+                        self.retries += 1
+                    api._open_connection()
+                else:
+                    raise
+            else:
+                # An upload that fails in the end counts as one error
+                # (see _worker), however often it was retried.
+                if ( result and self._limit != None ):
+                    for i in range(retries):
+                        self._limit.error()
+                return result
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _worker(self):
+        """
+        INTERNAL: Take tasks from the queue until told to stop.
+        """
+        api = self._session.clone()
+        while ( True ):
+            task = self._queue.get()
+            if ( task == None ):
+                break
+            if ( self._stopping ):
+                self._queue.task_done(task)
+                continue
+            # Only a worker with a task takes a slot; idle workers
+            # waiting for one would hold the slots of busy ones.
+            if ( self._limit != None ):
+                self._limit.acquire()
+            started = time.time()
+            ok = False
+            try:
+                ok = self._run_task(api, task)
+            finally:
+                self._queue.task_done(task)
+                if ( self._limit != None ):
+                    if ( self._stopping ):
+                        self._limit.cancel()
+                    else:
+                        self._limit.release(started, task.size, not ok)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _run_task(self, api, task):
+        """
+        INTERNAL: Upload a file and report how it went.
+
+        Returns: True if it was uploaded.
+        """
+        if ( task.replace_id == None ):
+            self.report("Add", task)
+        else:
+            self.report("New", task)
+
+        try:
+            if ( not self._upload(api, task) ):
+                raise ZfAPIException(None, "Upload rejected")
+            photo_id = api.last_upload_id()
+            # Keep the old photo unless the new one surely exists.
+            if ( task.replace_id != None and photo_id != None ):
+                api.DeletePhoto(task.replace_id)
+        except (ZfAPIException, IOError, httplib.HTTPException) as e:
+            msg = getattr(e, "msg", None) or getattr(e, "strerror", None) \
+                or str(e)
+            with self._lock:
+                self.failed.append((task, msg))
+            self.report("Fail", task)
+            return False
+        with self._lock:
+            self.uploaded += 1
+            self.bytes += task.size
+            if ( self._done != None ):
+                self._done(task, photo_id)
+        return True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class PlanExecutor:
+    """
+    Carry out a plan written by zfplan: create the groups and galleries
+    in order, then upload with an UploadPool, then delete.
+    """
+
+    def __init__(self, zflib, jobs=4, with_retries=None, report=None,
+                 scheduler=None, limit=None):
+        """
+        Initialize the executor.
+
+        Parameters:
+        zflib: an authenticated ZfLib used for the metadata calls.
+        jobs: number of concurrent uploads.
+        with_retries: function(func, *args) used to make metadata calls
+            (for example Backup.with_retries).  Defaults to a plain call.
+        report: passed on to the UploadPool.
+        scheduler: passed on to the UploadPool.
+        limit: passed on to the UploadPool.
+        """
+        self._zflib = zflib
+        self._jobs = jobs
+        self._report = report
+        self._scheduler = scheduler
+        self._limit = limit
+        if ( with_retries == None ):
+            self._call = lambda func, *args: func(*args)
+        else:
+            self._call = with_retries
+
+        self.groups = 0
+        self.galleries = 0
+        self.deleted = 0
+        self.missing = []
+        self.pool = None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run(self, plan):
+        """
+        Execute a plan.
+
+        Parameters:
+        plan: plan dict as returned by zfplan.read_plan.
+
+        Returns: Nothing
+        """
+        zflib = self._zflib
+        operations = plan['operations']
+
+        # Groups and galleries, parents first, in plan order.
+        for op in operations:
+            if ( op['op'] == "group" ):
+                if ( (op['path'], "Group") not in zflib.element_index() ):
+                    print "   New group:", op['path']
+                    self._call(zflib.create_group,
+                               zfplan.parent_path(op['path']),
+                               zfplan.leaf_name(op['path']))
+                    self.groups += 1
+            elif ( op['op'] == "gallery" ):
+                if ( (op['path'], "PhotoSet") not in zflib.element_index() ):
+                    print " New gallery:", op['path']
+                    self._call(zflib.create_gallery,
+                               zfplan.parent_path(op['path']),
+                               zfplan.leaf_name(op['path']))
+                    self.galleries += 1
+
+        # Uploads.  The hierarchy is loaded once to map every gallery
+        # to its upload URL.
+        index = zflib.element_index()
+        self.pool = UploadPool(zflib, jobs=self._jobs,
+                               queue_size=self._jobs * 4,
+                               report=self._report,
+                               scheduler=self._scheduler,
+                               limit=self._limit)
+        self.pool.start()
+        try:
+            for op in operations:
+                if ( op['op'] != "add" and op['op'] != "replace" ):
+                    continue
+                element = index.get((op['gallery'], "PhotoSet"))
+                if ( element == None ):
+                    raise ZfLibException("PlanExecutor.run", "Gallery \"" +
+                                         op['gallery'] + "\" not found")
+                if ( not os.path.isfile(op['file']) ):
+                    self.missing.append(op['file'])
+                    continue
+                self.pool.submit(UploadTask(op['file'],
+                                            element['UploadUrl'],
+                                            os.path.getsize(op['file']),
+                                            op['gallery'],
+                                            op.get('photo_id')))
+        except KeyboardInterrupt:
+            self.pool.stop()
+            self.pool.close()
+            raise
+        self.pool.close()
+
+        # Deletions go last, in batches.
+        stale = [{'Id': op['photo_id'], 'FileName': op['filename']}
+                 for op in operations if op['op'] == "delete"]
+        if ( stale != [] ):
+            self.deleted = self._call(zflib.delete_photos, stale)
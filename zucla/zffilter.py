@@ -0,0 +1,315 @@
+#    Include and exclude rules for the files of a local tree
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# Patterns are shell globs unless they start with "re:", in which case
+# the rest is a regular expression searched for in the path relative to
+# the root of the tree.  A glob without a slash is matched against the
+# file or directory name; a glob with a slash is matched against the
+# relative path.  A pattern ending in a slash only matches directories.
+#
+# Exclude patterns apply to directories (which are then not entered at
+# all) and files.  If there are include patterns, a file must match one
+# of them; directories are not subject to include patterns.  Size and
+# age limits apply to files and are checked last, since they need a
+# stat.
+#
+# All patterns of a kind are compiled into one regular expression.
+#
+# Function list:
+#
+# parse_size:                           "10M" -> 10485760
+# FilterRules:                          Compiled rules with counters
+# relative_dir:                         Directory path as FilterRules wants it
+# add_arguments:                        Add the filter options to a parser
+# from_args:                            Make FilterRules from the options
+
+from zucla.zflib import ZfLibException
+
+import fnmatch
+import os
+import re
+import time
+
+_SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30,
+               'T': 1 << 40}
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def parse_size(text):
+    """
+    Parse a size such as "512", "300K" or "1.5G" (powers of 1024).
+
+    Returns: The size in bytes.  Raises ZfLibException if the text is
+        not a size.
+    """
+    match = re.match(r"^\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)B?\s*$", text,
+                     re.IGNORECASE)
+    if ( match == None ):
+        raise ZfLibException("parse_size", "not a size: " + text)
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _compile(patterns):
+    """
+    INTERNAL: Compile patterns into (names, paths, dir_names, dir_paths),
+    one regular expression (or None) for each way of matching.
+    """
+    kinds = ([], [], [], [])
+    for pattern in patterns:
+        dir_only = pattern.endswith("/") and not pattern.startswith("re:")
+        if ( dir_only ):
+            pattern = pattern.rstrip("/")
+        if ( pattern.startswith("re:") ):
+            try:
+                re.compile(pattern[3:])
+            except re.error as e:
+                raise ZfLibException("FilterRules", "bad regular " +
+                                     "expression " + pattern[3:] + ": " +
+                                     str(e))
+            kinds[1].append("(?:.*?" + pattern[3:] + ")")
+            continue
+        regex = fnmatch.translate(pattern)
+        kind = 0
+        if ( "/" in pattern ):
+            kind = 1
+            regex = fnmatch.translate(pattern.lstrip("/"))
+        if ( dir_only ):
+            kind += 2
+        kinds[kind].append("(?:" + regex + ")")
+
+    return tuple([re.compile("|".join(kind), re.DOTALL) if kind else None
+                  for kind in kinds])
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class FilterRules:
+    """
+    Compiled include/exclude rules.
+
+    Relative paths are passed in with "/" separators and without a
+    leading slash ("" for the root itself).
+
+    Attributes:
+    excluded_dirs: number of directories pruned
+    excluded_files: number of files skipped by a rule
+    """
+
+    def __init__(self, includes=(), excludes=(), min_size=None,
+                 max_size=None, min_age=None, max_age=None, now=None):
+        """
+        Compile the rules.
+
+        Parameters:
+        includes: patterns of the files to back up (default: all).
+        excludes: patterns of the files and directories to leave out.
+        min_size, max_size: limits on the size of a file, in bytes.
+        min_age, max_age: limits on the age of a file (time since it was
+            last modified), in seconds.
+        now: the time that ages are measured from (default: now).
+        """
+        self._includes = _compile(includes)
+        self._excludes = _compile(excludes)
+        self._has_includes = ( list(includes) != [] )
+        self._min_size = min_size
+        self._max_size = max_size
+        if ( now == None ):
+            now = time.time()
+        self._newest = None
+        self._oldest = None
+        if ( min_age != None ):
+            self._newest = now - min_age
+        if ( max_age != None ):
+            self._oldest = now - max_age
+
+        self.excluded_dirs = 0
+        self.excluded_files = 0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def empty(self):
+        """
+        Returns: True if there are no rules at all.
+        """
+        return ( self._excludes == (None, None, None, None) and
+                 not self._has_includes and
+                 self._min_size == None and self._max_size == None and
+                 self._newest == None and self._oldest == None )
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _matches(self, compiled, rel_dir, name, is_dir):
+        """
+        INTERNAL: Does a name match any of the compiled patterns?
+        """
+        names, paths, dir_names, dir_paths = compiled
+        if ( rel_dir == "" ):
+            rel_path = name
+        else:
+            rel_path = rel_dir + "/" + name
+        if ( names != None and names.match(name) ):
+            return True
+        if ( paths != None and paths.match(rel_path) ):
+            return True
+        if ( is_dir ):
+            if ( dir_names != None and dir_names.match(name) ):
+                return True
+            if ( dir_paths != None and dir_paths.match(rel_path) ):
+                return True
+        return False
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def prune_dir(self, rel_dir, name):
+        """
+        Should a subdirectory be left out (with everything below it)?
+
+        Parameters:
+        rel_dir: relative path of the directory that contains it.
+        name: name of the subdirectory.
+        """
+        if ( self._matches(self._excludes, rel_dir, name, True) ):
+            self.excluded_dirs += 1
+            return True
+        return False
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def in_pruned_dir(self, rel_path):
+        """
+        Is a directory left out, itself or with one above it?  Unlike
+        prune_dir, this is not counted in excluded_dirs.
+
+        Parameters:
+        rel_path: relative path of the directory, "/"-separated.
+        """
+        parts = rel_path.split("/")
+        for i in range(len(parts)):
+            if ( self._matches(self._excludes, "/".join(parts[:i]),
+                               parts[i], True) ):
+                return True
+        return False
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def skip_name(self, rel_dir, name):
+        """
+        Should a file be left out because of its name?
+
+        Parameters:
+        rel_dir: relative path of the directory that contains it.
+        name: name of the file.
+        """
+        if ( self._matches(self._excludes, rel_dir, name, False) or
+             ( self._has_includes and
+               not self._matches(self._includes, rel_dir, name, False) ) ):
+            self.excluded_files += 1
+            return True
+        return False
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def skip_stat(self, stat):
+        """
+        Should a file be left out because of its size or age?
+
+        Parameters:
+        stat: os.stat result for the file.
+        """
+        if ( ( self._min_size != None and stat.st_size < self._min_size ) or
+             ( self._max_size != None and stat.st_size > self._max_size ) or
+             ( self._newest != None and stat.st_mtime > self._newest ) or
+             ( self._oldest != None and stat.st_mtime < self._oldest ) ):
+            self.excluded_files += 1
+            return True
+        return False
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def relative_dir(path, root):
+    """
+    Get the relative path of a directory in the form FilterRules wants.
+    """
+    rel_dir = os.path.relpath(path, root)
+    if ( rel_dir == "." ):
+        return ""
+    return rel_dir.replace(os.sep, "/")
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def add_arguments(parser, verb="back up"):
+    """
+    Add the include, exclude, size and age options to a command's
+    parser.
+
+    Parameters:
+    parser: the argparse parser.
+    verb: what the command does with the files, for the help.
+    """
+    parser.add_argument("--include", action="append",
+                        default=[], metavar="PATTERN",
+                        help="Only " + verb + " files matching " + \
+                            "PATTERN (a glob, or a regular " + \
+                            "expression after \"re:\").  " + \
+                            "May be given more than once.")
+    parser.add_argument("--exclude", action="append",
+                        default=[], metavar="PATTERN",
+                        help="Leave out files and directories " + \
+                            "matching PATTERN; a pattern " + \
+                            "ending in \"/\" only matches " + \
+                            "directories.  Excluded directories " + \
+                            "are not read at all.  May be " + \
+                            "given more than once.")
+    parser.add_argument("--min-size", action="store",
+                        dest="min_size", metavar="SIZE",
+                        help="Leave out files smaller than " + \
+                            "SIZE (for example, 10K).")
+    parser.add_argument("--max-size", action="store",
+                        dest="max_size", metavar="SIZE",
+                        help="Leave out files larger than " + \
+                            "SIZE (for example, 2G).")
+    parser.add_argument("--min-age", action="store", type=float,
+                        dest="min_age", metavar="DAYS",
+                        help="Leave out files modified less " + \
+                            "than DAYS ago.")
+    parser.add_argument("--max-age", action="store", type=float,
+                        dest="max_age", metavar="DAYS",
+                        help="Leave out files modified more " + \
+                            "than DAYS ago.")
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def from_args(args):
+    """
+    Compile the options added by add_arguments.
+
+    Parameters:
+    args: the parsed arguments.
+
+    Returns: FilterRules, or None if there are no rules.  Raises
+        ZfLibException if a rule is not valid.
+    """
+    day = 24 * 60 * 60
+    rules = FilterRules(args.include, args.exclude,
+                        min_size=args.min_size and parse_size(args.min_size),
+                        max_size=args.max_size and parse_size(args.max_size),
+                        min_age=args.min_age and args.min_age * day,
+                        max_age=args.max_age and args.max_age * day)
+    if ( rules.empty() ):
+        return None
+    return rules
@@ -0,0 +1,189 @@
+#    Content hashes of local files, computed in a process pool
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# Hashes are MD5 hex digests, the form Zenfolio uses for Photo.FileHash.
+#
+# Function list:
+#
+# hash_file:                            Hash a file
+# HashCache:                            Hashes by (dev, inode, size, mtime)
+# Hasher:                               Hash files in the background
+
+from hashlib import md5
+
+BLOCK_SIZE = 1024 * 1024
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def hash_file(path):
+    """
+    Compute the content hash of a file.
+
+    Parameters:
+    path: the file to hash.
+
+    Returns: The MD5 hex digest of the file.
+    """
+    digest = md5()
+    f = open(path, 'rb')
+    try:
+        block = f.read(BLOCK_SIZE)
+        while ( block ):
+            digest.update(block)
+            block = f.read(BLOCK_SIZE)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class HashCache:
+    """
+    Hashes of files keyed by (device, inode, size, mtime), so that a
+    file that has not been touched is never read again.  The cache is
+    kept in memory and, if a ZfState is given, in its database.
+    """
+
+    def __init__(self, state=None):
+        self._state = state
+        self._memory = {}
+
+    def key(self, stat):
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime)
+
+    def get(self, stat):
+        """
+        Return the cached hash for a file's stat result, or None.
+        """
+        key = self.key(stat)
+        digest = self._memory.get(key)
+        if ( digest == None and self._state != None ):
+            digest = self._state.cached_hash(*key)
+            if ( digest != None ):
+                self._memory[key] = digest
+        return digest
+
+    def put(self, stat, digest):
+        key = self.key(stat)
+        self._memory[key] = digest
+        if ( self._state != None ):
+            self._state.record_hash(key[0], key[1], key[2], key[3], digest)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Hasher:
+    """
+    Hash files in a pool of processes.  Files are submitted ahead of
+    time (for example, all the images of a directory as it is entered)
+    and hashed while earlier files upload; result() then waits only if
+    a hash is not ready yet.
+
+    Attributes:
+    hashed: number of files that were read and hashed
+    cached: number of submitted files whose hash was already cached
+    """
+
+    def __init__(self, jobs=None, cache=None, verify=False):
+        """
+        Initialize the hasher.
+
+        Parameters:
+        jobs: number of hashing processes (default: one per CPU).
+        cache: a HashCache, or None for a private in-memory cache.
+        verify: ignore cached hashes and read every file again.
+        """
+        import multiprocessing
+
+        if ( cache == None ):
+            cache = HashCache()
+        self._cache = cache
+        self._verify = verify
+        self._pool = multiprocessing.Pool(jobs)
+        self._pending = {}
+        self._last = None
+
+        self.hashed = 0
+        self.cached = 0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def submit(self, files):
+        """
+        Start hashing files.
+
+        Parameters:
+        files: list of (path, stat) tuples.
+        """
+        for path, stat in files:
+            if ( path in self._pending ):
+                continue
+            if ( not self._verify and self._cache.get(stat) != None ):
+                self.cached += 1
+                continue
+            self._pending[path] = self._pool.apply_async(hash_file, (path,))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def result(self, path, stat):
+        """
+        Get the hash of a file, waiting for it if it is still being
+        computed and computing it if it was never submitted.
+
+        Parameters:
+        path: the file.
+        stat: os.stat result for the file.
+
+        Returns: The hex digest.
+        """
+        # Asking twice in a row must not read the file twice, even when
+        # verifying.
+        key = self._cache.key(stat)
+        if ( self._last != None and self._last[0] == (path, key) ):
+            return self._last[1]
+
+        pending = self._pending.pop(path, None)
+        if ( pending == None ):
+            digest = None
+            if ( not self._verify ):
+                digest = self._cache.get(stat)
+            if ( digest != None ):
+                return digest
+            pending = self._pool.apply_async(hash_file, (path,))
+
+        # A timeout keeps KeyboardInterrupt deliverable while waiting.
+        digest = pending.get(86400)
+        self.hashed += 1
+        self._cache.put(stat, digest)
+        self._last = ((path, key), digest)
+        return digest
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        """
+        Stop the hashing processes.
+        """
+        self._pending = {}
+        self._pool.terminate()
+        self._pool.join()
@@ -0,0 +1,268 @@
+#    Checkpoint journal that lets an interrupted backup resume
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# The journal is a text file with one JSON record per line, only ever
+# appended to:
+#
+#   {"t": "start", "version": 1, "user": ..., "local_path": ...,
+#    "group_path": ...}
+#   {"t": "file", "path": ..., "size": ..., "mtime": ..., "photo_id": ...}
+#   {"t": "dir", "path": ...}
+#
+# A "file" record means the file is on Zenfolio as it was when the
+# record was written; a "dir" record means everything in the directory
+# (but not its subdirectories) was done.  Records are flushed and
+# fsync'ed in batches, so a crash loses at most one batch, and a torn
+# last line is ignored when the journal is read back.
+#
+# Function list:
+#
+# Journal.open:                         Start or resume a journal
+# Journal.file_done:                    Record a finished file
+# Journal.dir_done:                     Record a finished directory
+# Journal.is_file_done:                 Was a file finished, as it is now?
+# Journal.is_dir_done:                  Was a directory finished?
+# Journal.directory_unchanged:          Was a directory finished, as it is now?
+# Journal.sync:                         Write records to disk
+# Journal.close:                        Sync and close
+# Journal.remove:                       Close and delete a finished journal
+
+from zucla.zflib import ZfLibException
+
+import json
+import os
+import os.path
+import time
+
+JOURNAL_VERSION = 1
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Journal:
+    """
+    An append-only record of the work a backup has finished.
+
+    Attributes:
+    resumed_files: number of file records read back by open()
+    resumed_dirs: number of directory records read back by open()
+    """
+
+    def __init__(self, filename, sync_every=200, sync_seconds=5.0):
+        """
+        Initialize the journal.  Nothing is read or written before open().
+
+        Parameters:
+        filename: path of the journal file.
+        sync_every: number of records to collect before syncing.
+        sync_seconds: longest time a record waits to be synced.
+        """
+        self.filename = filename
+        self._sync_every = sync_every
+        self._sync_seconds = sync_seconds
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.time()
+        self._files = {}
+        self._dirs = set()
+
+        self.resumed_files = 0
+        self.resumed_dirs = 0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _read(self, header):
+        """
+        INTERNAL: Read an existing journal back.  Raises ZfLibException
+        if it was written for a different backup.
+        """
+        journal_file = open(self.filename, 'r')
+        try:
+            lines = journal_file.readlines()
+        finally:
+            journal_file.close()
+
+        start = None
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn write at the end of an interrupted run
+                continue
+            kind = record.get('t')
+            if ( kind == "start" ):
+                start = record
+            elif ( kind == "file" ):
+                # json gives back unicode; paths are byte strings.
+                path = record['path'].encode("utf-8")
+                self._files[path] = (record['size'], record['mtime'])
+            elif ( kind == "dir" ):
+                self._dirs.add(record['path'].encode("utf-8"))
+
+        if ( start == None or start.get('version') != JOURNAL_VERSION ):
+            raise ZfLibException("Journal.open", self.filename +
+                                 ": not a backup journal")
+        for key in header:
+            value = start.get(key)
+            if ( isinstance(value, unicode) ):
+                value = value.encode("utf-8")
+            if ( value != header[key] ):
+                raise ZfLibException("Journal.open", self.filename +
+                                     ": journal is for a different backup " +
+                                     "({:s} {!s})".format(key, value))
+        self.resumed_files = len(self._files)
+        self.resumed_dirs = len(self._dirs)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def open(self, header, resume=False):
+        """
+        Start a new journal, or resume an existing one.
+
+        Parameters:
+        header: dict describing the backup (user, local_path,
+            group_path); a resumed journal must have been started with
+            the same values.
+        resume: read the records of an existing journal and append to
+            it.  If there is no journal yet, a new one is started.
+
+        Returns: Nothing
+        """
+        if ( resume and os.path.exists(self.filename) ):
+            self._read(header)
+            self._file = open(self.filename, 'a')
+            # Start on a fresh line if the last one was torn.
+            if ( self._file.tell() > 0 ):
+                self._file.write("\n")
+        else:
+            self._file = open(self.filename, 'w')
+            record = dict(header)
+            record['t'] = "start"
+            record['version'] = JOURNAL_VERSION
+            self._append(record)
+            self.sync()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _append(self, record):
+        """
+        INTERNAL: Write a record, syncing when a batch is complete.
+        """
+        self._file.write(json.dumps(record, sort_keys=True) + "\n")
+        self._pending += 1
+        if ( self._pending >= self._sync_every or
+             time.time() - self._last_sync >= self._sync_seconds ):
+            self.sync()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def file_done(self, path, stat, photo_id):
+        """
+        Record that a file is on Zenfolio.
+
+        Parameters:
+        path: local path of the file.
+        stat: os.stat result for the file, taken before the upload.
+        photo_id: Id of the photo.
+        """
+        path = os.path.abspath(path)
+        self._files[path] = (stat.st_size, stat.st_mtime)
+        self._append({'t': "file", 'path': path, 'size': stat.st_size,
+                      'mtime': stat.st_mtime, 'photo_id': photo_id})
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def dir_done(self, path):
+        """
+        Record that everything in a directory has been backed up.
+        """
+        path = os.path.abspath(path)
+        self._dirs.add(path)
+        self._append({'t': "dir", 'path': path})
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def is_file_done(self, path, stat):
+        """
+        Check whether a file was recorded with its current size and
+        modification time.
+        """
+        return ( self._files.get(os.path.abspath(path)) ==
+                 (stat.st_size, stat.st_mtime) )
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def is_dir_done(self, path):
+        """
+        Check whether a directory was recorded as done.
+        """
+        return os.path.abspath(path) in self._dirs
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def directory_unchanged(self, path, stats):
+        """
+        Check whether a directory was recorded as done and none of its
+        files has changed since.
+
+        Parameters:
+        path: local directory.
+        stats: dict of file name -> os.stat result for its image files.
+
+        Returns: True if the directory needs no more work.
+        """
+        if ( not self.is_dir_done(path) ):
+            return False
+        for name, stat in stats.iteritems():
+            if ( not self.is_file_done(os.path.join(path, name), stat) ):
+                return False
+        return True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def sync(self):
+        """
+        Write the records collected so far to disk.
+        """
+        if ( self._file != None ):
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.time()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        """
+        Sync and close the journal, keeping it for --resume.
+        """
+        if ( self._file != None ):
+            self.sync()
+            self._file.close()
+            self._file = None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def remove(self):
+        """
+        Close and delete the journal of a backup that has finished.
+        """
+        if ( self._file != None ):
+            self._file.close()
+            self._file = None
+        if ( os.path.exists(self.filename) ):
+            os.remove(self.filename)
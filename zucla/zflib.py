@@ -35,10 +35,12 @@
 # login:                                Log in to Zenfolio
 # group_hierarchy:                      Return the group hierarchy
 # retrive_group_hierarchy:              Get group hierarchy from Zenfolio
+# element_index:                        Index the hierarchy by path
 # get_group:                            Find a group from a path
 # get_photoset:                         Find a photoset from a path
 # get_photo:                            Find a photo in a photoset
 # delete_photo:                         Delete a photo from a photoset
+# delete_photos:                        Delete many photos in batches
 # get_upload_url:                       Find the url to upload to from a path
 # upload_to_path:                       Upload a file to a gallery path
 # create_gallery:                       Create a gallery in a path
@@ -54,11 +56,15 @@ class ZfLib(ZfAPI):
     (LoginChallengeResponse, LoginPlain) = range(0,2)
     
     _group_hierarchy = None
+    _element_index = None
+    _indexed_hierarchy = None
+    _batch_delete = True
 
     def __init__(self,
                  ssl = 1,
                  debug = 0,
-                 username = ""):
+                 username = "",
+                 zf_host = "www.zenfolio.com"):
         """
         Initialize the class.
 
@@ -68,9 +74,12 @@ class ZfLib(ZfAPI):
         debug:    zero - don't emit debug information; 
                   nonzero - be verbose. Default is no debug.
         username: Login name of the user. Defaults to "" 
+        zf_host:  Host name (and port) to connect to (defaults to
+                  "www.zenfolio.com")
         """
 
-        ZfAPI.__init__(self, ssl=ssl, debug=debug, username=username)
+        ZfAPI.__init__(self, ssl=ssl, debug=debug, username=username,
+                       zf_host=zf_host)
         self._group_hierarchy = None
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -222,6 +231,41 @@ class ZfLib(ZfAPI):
             self._group_hierarchy = None
             return 0
 
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def element_index(self):
+        """
+        Index every element of the group hierarchy by its path.  The
+        index is rebuilt whenever the hierarchy is reloaded.
+
+        Parameters: None
+
+        Returns: A dict of (path, element type) -> element, where path
+            is delimited with slashes and starts with a slash (for
+            example, ("/All Photographs/Soccer", "Group")).  As with
+            _find_element, the first element wins if titles repeat.
+        """
+        if ( self.debug ):
+            print ">>>> ZfLib.element_index()"
+
+        if ( self._group_hierarchy == None ):
+            if ( self.retrieve_group_hierarchy() == 0 ):
+                return {}
+
+        if ( self._indexed_hierarchy is not self._group_hierarchy ):
+            index = {}
+            root = self._group_hierarchy
+            pending = [("/" + root['Title'], root)]
+            while ( pending != [] ):
+                path, element = pending.pop()
+                index.setdefault((path, element['$type']), element)
+                children = element.get('Elements') or []
+                for child in reversed(children):
+                    pending.append((path + "/" + child['Title'], child))
+            self._element_index = index
+            self._indexed_hierarchy = self._group_hierarchy
+
+        return self._element_index
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def get_photoset(self, path, delimiter="/", level="Level1", \
                                   include_photos="False"):
@@ -328,6 +372,53 @@ class ZfLib(ZfAPI):
             if ( photo['FileName'] == filename ):
                 return self.DeletePhoto(photo['Id'])
 
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def delete_photos(self, photos, batch_size=100):
+        """
+        Remove several photos, batch_size photos per API call.
+
+        If a DeletePhotos call fails, for any reason, fall back to one
+        DeletePhoto call per photo for the rest of the session.
+
+        Parameters:
+        photos: list of photo objects (from a photoset snapshot) to delete.
+        batch_size: maximum number of photos to delete in a single call.
+
+        Returns: The number of photos deleted.
+        """
+
+        if ( self.debug ):
+            print ">>>> ZfLib.delete_photos([", len(photos), "photos ],", \
+                batch_size, ")"
+
+        if ( photos == None or photos == [] ):
+            return 0
+        if ( batch_size < 1 ):
+            batch_size = 1
+
+        deleted = 0
+        for start in range(0, len(photos), batch_size):
+            batch = photos[start:start + batch_size]
+            ids = [photo['Id'] for photo in batch]
+
+            if ( self._batch_delete and len(ids) > 1 ):
+                if ( self.DeletePhotos(ids) ):
+                    deleted += len(ids)
+                    continue
+                # Servers that don't know DeletePhotos may answer with an
+                # API error or just an HTTP error, so whatever went
+                # wrong, delete one at a time instead; the photos that
+                # really can't be deleted then fail one by one.
+                if ( self.debug ):
+                    print "DeletePhotos rejected, deleting one at a time."
+                self._batch_delete = False
+
+            for photo_id in ids:
+                if ( self.DeletePhoto(photo_id) ):
+                    deleted += 1
+
+        return deleted
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def get_upload_url(self, path, delimiter="/"):
         """
@@ -353,13 +444,14 @@ class ZfLib(ZfAPI):
             return element['UploadUrl']
  
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def upload_to_path(self, image_path, gallery_path):
+    def upload_to_path(self, image_path, gallery_path, source=None):
         """
         Upload an image to the specified gallery
         
         Parameters:
         image_path: The path on the system that specifies the image to upload
         gallery_path: The path to the gallery to which to upload the image
+        source: The original, if image_path is a resized copy of it
         
         Returns: nonzero on success, zero on failure
         """
@@ -371,7 +463,7 @@ class ZfLib(ZfAPI):
 
         # If we found the gallery, then upload to it.
         if ( url ):
-            return self.UploadPhotoToURL(image_path, url)
+            return self.UploadPhotoToURL(image_path, url, source)
         else:
             raise ZfLibException("upload_to_path", 
                                  "Gallery \"" + gallery_path + "\" not found");
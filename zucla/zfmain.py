@@ -0,0 +1,210 @@
+#    The zf command: run any ZUCLA command, loading only that command
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# "zf COMMAND ARGS..." runs the same commands as the zf-COMMAND scripts.
+# Only the module of the command that is run is imported (after the
+# command has been offered to zf-agent, see zfagent), so that short
+# commands don't pay for loading the others; this module itself
+# imports nothing but light standard modules.
+#
+# "zf startup-time" guards how quickly commands start: it imports each
+# command in a fresh interpreter and fails if the best of several runs
+# takes longer than the budget.
+#
+# Function list:
+#
+# load_command:                         Import the class of a command
+# startup_times:                        Import time of each command
+# main:                                 Run the zf command
+
+from zucla import zfagent
+
+import os
+import subprocess
+import sys
+
+# name -> (module, class, runs in zf-agent, summary)
+COMMANDS = {
+    "agent": ("zucla.commands.agent", "Agent", False,
+              "Keep a Zenfolio session for the other commands"),
+    "backup": ("zucla.commands.backup", "Backup", True,
+               "Back up a directory tree to a group"),
+    "create-gallery": ("zucla.commands.create_gallery", "CreateGallery", True,
+                       "Create a gallery"),
+    "create-group": ("zucla.commands.create_group", "CreateGroup", True,
+                     "Create a group"),
+    "restore": ("zucla.commands.restore", "Restore", True,
+                "Download a group into a directory tree"),
+    "shell": ("zucla.commands.shell", "Shell", False,
+              "Run commands in one session"),
+    "upload": ("zucla.commands.upload", "Upload", True,
+               "Upload files to a gallery"),
+    "verify": ("zucla.commands.verify", "Verify", True,
+               "Compare a directory tree with its backup"),
+    }
+
+# Default budget for importing a command, in milliseconds.
+STARTUP_BUDGET = 100.0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def load_command(name):
+    """
+    Import the class of a command.
+
+    Parameters:
+    name: the command's name (a key of COMMANDS).
+
+    Returns: The ZfCLI subclass.
+    """
+    module_name, class_name = COMMANDS[name][:2]
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def startup_times(names, runs=5):
+    """
+    Measure how long it takes a fresh interpreter to import zf and then
+    each command.
+
+    Parameters:
+    names: the commands to measure.
+    runs: how many times to measure each; the best time counts.
+
+    Returns: A list of (name, milliseconds), starting with "zf" itself.
+    """
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+    script = ("import time, sys\n"
+              "start = time.time()\n"
+              "import zucla.zfmain\n"
+              "if sys.argv[1] != 'zf':\n"
+              "    zucla.zfmain.load_command(sys.argv[1])\n"
+              "print (time.time() - start) * 1000\n")
+    times = []
+    for name in ["zf"] + names:
+        best = None
+        for i in range(runs):
+            output = subprocess.check_output(
+                [sys.executable, "-c", script, name], env=env)
+            elapsed = float(output)
+            if ( best == None or elapsed < best ):
+                best = elapsed
+        times.append((name, best))
+    return times
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _print_usage(out):
+    """
+    INTERNAL: Print the list of commands.
+    """
+    print >>out, "usage: zf COMMAND [ARGS...]"
+    print >>out
+    print >>out, "Commands (\"zf COMMAND --help\" for their options):"
+    for name in sorted(COMMANDS):
+        print >>out, "  {:16s}{:s}".format(name, COMMANDS[name][3])
+    print >>out, "  {:16s}{:s}".format("startup-time",
+                                       "Check how quickly commands load")
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _startup_time(args):
+    """
+    INTERNAL: zf startup-time [--budget MS] [--runs N] [COMMAND...]
+
+    Returns: The exit status: 1 if a command is over the budget.
+    """
+    # (argparse is slow to load itself, but this is no hurry.)
+    import argparse
+    parser = argparse.ArgumentParser("zf startup-time",
+                                     description="Check how long it " + \
+                                         "takes to load zf and each " + \
+                                         "command.")
+    parser.add_argument("--budget", action="store", type=float,
+                        default=STARTUP_BUDGET, metavar="MS",
+                        help="Fail if loading a command takes more " + \
+                            "than MS milliseconds (default " + \
+                            "{:g}).".format(STARTUP_BUDGET))
+    parser.add_argument("--runs", action="store", type=int, default=5,
+                        metavar="N",
+                        help="Measure N times and take the best " + \
+                            "(default 5).")
+    parser.add_argument("commands", metavar="COMMAND", nargs="*",
+                        help="Commands to measure (default: all).")
+    the_args = parser.parse_args(args)
+    for name in the_args.commands:
+        if ( name not in COMMANDS ):
+            parser.error("unknown command \"" + name + "\"")
+
+    over = 0
+    for name, elapsed in startup_times(the_args.commands or sorted(COMMANDS),
+                                       max(1, the_args.runs)):
+        flag = ""
+        if ( elapsed > the_args.budget ):
+            flag = "  over budget"
+            over += 1
+        print "  {:16s}{:7.1f} ms{:s}".format(name, elapsed, flag)
+    if ( over ):
+        print over, "over the budget of {:g} ms".format(the_args.budget)
+        return 1
+    return 0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def main(argv=None):
+    """
+    Run "zf COMMAND ARGS..." and exit.
+
+    Parameters:
+    argv: the command line (default: sys.argv).
+    """
+    if ( argv == None ):
+        argv = sys.argv
+    if ( len(argv) < 2 or argv[1] in ("-h", "--help", "help") ):
+        if ( len(argv) > 2 and argv[2] in COMMANDS ):
+            argv = [argv[0], argv[2], "--help"]
+        else:
+            _print_usage(sys.stdout)
+            sys.exit(0)
+
+    name = argv[1]
+    args = argv[2:]
+    if ( name == "startup-time" ):
+        sys.exit(_startup_time(args))
+    if ( name not in COMMANDS ):
+        print >>sys.stderr, "zf: unknown command \"" + name + "\""
+        _print_usage(sys.stderr)
+        sys.exit(2)
+
+    if ( COMMANDS[name][2] ):
+        zfagent.forward(name, args)
+    command = load_command(name)()
+    # The command parses sys.argv[1:].
+    sys.argv = [argv[0] + " " + name] + args
+    command.run()
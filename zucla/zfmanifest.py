@@ -0,0 +1,104 @@
+#    Read lists of files to upload, and group them by gallery
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# A manifest has one file per line, optionally followed by a tab and the
+# path of the gallery to upload it to:
+#
+#   /photos/2013/img_0001.jpg
+#   /photos/2013/img_0002.jpg<TAB>/All Photographs/2013/Spring
+#
+# Files without a gallery go to the default gallery.  Blank lines are
+# ignored.  The manifest is read lazily, a batch at a time, so a list of
+# any length needs only a batch's worth of memory; within a batch the
+# files are grouped by gallery, so each gallery is looked up once per
+# batch (and a caller can cache the upload URLs across batches).
+#
+# Function list:
+#
+# read_manifest:                        (path, gallery) for each line
+# batches:                              Group (path, gallery) by gallery
+
+from zucla.zflib import ZfLibException
+
+BATCH_SIZE = 1000
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def read_manifest(f, default_gallery=None):
+    """
+    Read a manifest lazily.
+
+    Parameters:
+    f: an open file (or any iterable of lines).
+    default_gallery: gallery for lines that don't name one, or None.
+
+    Returns: A generator of (path, gallery).  Raises ZfLibException at a
+        line without a gallery if there is no default.
+    """
+    line_number = 0
+    for line in f:
+        line_number += 1
+        line = line.rstrip("\r\n")
+        if ( line.strip() == "" ):
+            continue
+        path, sep, gallery = line.partition("\t")
+        gallery = gallery.strip() or default_gallery
+        if ( gallery == None ):
+            raise ZfLibException("read_manifest", "line {:d}: no gallery " \
+                                 "for {:s}".format(line_number, path))
+        yield (path, gallery)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def batches(entries, size=BATCH_SIZE):
+    """
+    Group (path, gallery) pairs by gallery, a batch at a time.
+
+    Parameters:
+    entries: iterable of (path, gallery).
+    size: number of entries in a batch.
+
+    Returns: A generator of lists of (gallery, [path, ...]), one list
+        per batch, with galleries in the order they first appear.
+    """
+    galleries = []
+    paths = {}
+    count = 0
+    for path, gallery in entries:
+        if ( gallery not in paths ):
+            galleries.append(gallery)
+            paths[gallery] = []
+        paths[gallery].append(path)
+        count += 1
+        if ( count >= size ):
+            yield [(gallery, paths[gallery]) for gallery in galleries]
+            galleries = []
+            paths = {}
+            count = 0
+    if ( count > 0 ):
+        yield [(gallery, paths[gallery]) for gallery in galleries]
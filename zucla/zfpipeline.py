@@ -0,0 +1,488 @@
+#    Pipelined, concurrent backup of a directory tree
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# The pipeline has three stages joined by bounded queues:
+#
+#   scanner (main thread):  walks the tree, skips directories that the
+#                           state database or journal says are done,
+#                           has the files of the others hashed (--hash)
+#                           and resized (--resize, --quality), and
+#                           records finished work in both
+#   metadata (M threads):   finds or creates the group and gallery of a
+#                           directory, loads its photoset and decides
+#                           what to upload
+#   upload (N threads):     an UploadPool
+#
+# Groups and galleries are created one at a time, under a lock, because
+# every creation reloads the group hierarchy; a missing parent group is
+# created first, so directories can be resolved in any order.  Photoset
+# loads and uploads run concurrently.  The only ordering kept within a
+# gallery is that a replaced photo is deleted after its new version is
+# uploaded.
+#
+# The Hasher and Transformer, like the state database, are used by the
+# scanner alone.  Their process pools work on a directory while the
+# other stages look up and upload the directories before it.
+
+from zucla.zfapi import ZfAPIException
+from zucla.zflib import ZfLibException
+from zucla.zfexec import UploadPool, UploadTask
+from zucla import zfdiff
+from zucla import zfplan
+from zucla import zfscan
+
+import httplib
+import os.path
+import sys
+import threading
+import time
+import Queue
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class DirJob:
+    """
+    A directory on its way from the scanner to the metadata stage.
+
+    Attributes (besides those of a zfscan directory):
+    done: names of the images that the journal says are done
+    hashes: dict of image name -> content hash (--hash)
+    uploads: dict of image name -> (path, size) of the file to upload
+        in its place (--resize, --quality)
+    known: dict of image name -> state database record (--hash)
+    """
+
+    def __init__(self, path, zf_path, dirs, images, done=(), excluded=(),
+                 hashes=None, uploads=None, known=None):
+        self.path = path
+        self.zf_path = zf_path
+        self.dirs = dirs
+        self.images = images
+        self.done = done
+        self.excluded = excluded
+        self.hashes = hashes or {}
+        self.uploads = uploads or {}
+        self.known = known or {}
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class BackupPipeline:
+    """
+    Back up a tree with concurrent metadata and upload stages, on
+    behalf of a Backup command (whose options, counters, session and
+    state database it uses).
+
+    Attributes:
+    errors: number of directories that could not be resolved
+    pool: the UploadPool
+    """
+
+    def __init__(self, backup, jobs=4, meta_jobs=4, queue_size=16,
+                 scheduler=None, limit=None, meta_limit=None):
+        """
+        Initialize the pipeline.
+
+        Parameters:
+        backup: the authenticated Backup command.
+        jobs: number of concurrent uploads.
+        meta_jobs: number of directories resolved concurrently.
+        queue_size: number of directories waiting for the metadata stage.
+        scheduler: a zfsched.UploadScheduler for the upload stage, or
+            None to upload in the order the files are found.
+        limit: a zfadapt.AdaptiveLimit for the upload stage, or None.
+        meta_limit: a zfadapt.AdaptiveLimit for the metadata stage (as
+            many threads as its upper bound are started, and meta_jobs
+            is unused), or None.
+        """
+        self._backup = backup
+        self._jobs = jobs
+        self._scheduler = scheduler
+        self._limit = limit
+        self._meta_limit = meta_limit
+        self._meta_jobs = max(1, meta_jobs)
+        if ( meta_limit != None ):
+            self._meta_jobs = meta_limit.high
+        self._dir_queue = Queue.Queue(queue_size)
+        self._done_queue = Queue.Queue()
+        self._meta_lock = threading.RLock()
+        self._print_lock = threading.Lock()
+        self._stopping = False
+        self._outstanding = {}
+        self._resolved = set()
+        self._digests = {}
+
+        self.errors = 0
+        self.pool = None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def say(self, line):
+        """
+        Print a line without mixing it up with other threads' lines.
+        """
+        with self._print_lock:
+            print line
+            sys.stdout.flush()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def report(self, action, task):
+        """
+        INTERNAL: UploadPool callback for started and failed uploads.
+        """
+        with self._print_lock:
+            self._backup.print_upload(action, task)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def done(self, task, photo_id):
+        """
+        INTERNAL: UploadPool callback for finished uploads.
+        """
+        self._done_queue.put(("Up", task.local_path, task.stat, photo_id,
+                              task.photoset_id))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def drain(self):
+        """
+        INTERNAL: Count and record the work finished by the other stages.
+        Only the main thread touches the state database.
+        """
+        backup = self._backup
+        state = backup._state_db
+        journal = backup._journal
+        while ( True ):
+            try:
+                event = self._done_queue.get_nowait()
+            except Queue.Empty:
+                return
+            if ( event[0] == "Group" ):
+                if ( state != None ):
+                    state.record_group(event[1], event[2])
+                continue
+
+            # A directory is done when it has been resolved and all the
+            # uploads it queued have finished (in either order).
+            if ( event[0] == "Resolved" ):
+                path = event[1]
+                self._resolved.add(path)
+                self._outstanding[path] = self._outstanding.get(path, 0) + \
+                    event[2]
+            else:
+                if ( event[0] == "Old" ):
+                    backup._old_files += 1
+                    self.say("Old  " + event[1])
+                if ( state != None ):
+                    state.record_file(event[1], event[2], event[3], event[4],
+                                      self._digests.pop(event[1], None))
+                if ( journal != None ):
+                    journal.file_done(event[1], event[2], event[3])
+                if ( event[0] == "Old" ):
+                    continue
+                path = os.path.dirname(event[1])
+                self._outstanding[path] = self._outstanding.get(path, 0) - 1
+
+            if ( path in self._resolved and self._outstanding[path] == 0 ):
+                self._resolved.discard(path)
+                del self._outstanding[path]
+                if ( journal != None ):
+                    journal.dir_done(path)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def ensure_group(self, path):
+        """
+        Find a group, creating it (and any missing parent groups) if it
+        doesn't exist.  Call with the metadata lock held.
+
+        Parameters:
+        path: Zenfolio path of the group, as returned by zfdiff.zf_path_for.
+
+        Returns: The group element.
+        """
+        backup = self._backup
+        group = backup.element_index().get((path, "Group"))
+        if ( group != None ):
+            return group
+
+        parent = zfplan.parent_path(path)
+        if ( parent == "" ):
+            raise ZfLibException("ensure_group",
+                                 "Group \"" + path + "\" not found")
+        self.ensure_group(parent)
+
+        backup._new_groups += 1
+        self.say("   New group: " + path)
+        group = backup.with_retries(backup.create_group, parent,
+                                    zfplan.leaf_name(path))
+        if ( group == None ):
+            raise ZfLibException("ensure_group",
+                                 "Could not create group \"" + path + "\"")
+        return group
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def resolve(self, api, job):
+        """
+        INTERNAL: Find or create the group and gallery of a directory and
+        queue its uploads.
+
+        Parameters:
+        api: this thread's ZfAPI connection.
+        job: the DirJob.
+
+        Returns: The number of uploads queued.
+        """
+        backup = self._backup
+        mirror = backup.the_args.mirror
+        todo = [name for name in sorted(job.images) if name not in job.done]
+
+        with self._meta_lock:
+            if ( job.dirs != [] ):
+                group = self.ensure_group(job.zf_path)
+                self._done_queue.put(("Group", job.path, group['Id']))
+
+            if ( todo == [] and not mirror ):
+                return 0
+
+            element = backup.element_index().get((job.zf_path, "PhotoSet"))
+            if ( element == None ):
+                if ( todo == [] ):
+                    return 0
+                parent = zfplan.parent_path(job.zf_path)
+                self.ensure_group(parent)
+                backup._new_galleries += 1
+                self.say(" New gallery: " + job.zf_path)
+                backup.with_retries(backup.create_gallery, parent,
+                                    zfplan.leaf_name(job.zf_path))
+                element = backup.element_index().get((job.zf_path,
+                                                      "PhotoSet"))
+                if ( element == None ):
+                    raise ZfLibException("resolve", "Could not create " +
+                                         "gallery \"" + job.zf_path + "\"")
+
+        photoset = api.LoadPhotoSet(element['Id'], "Level2", "True")
+        if ( photoset == None ):
+            raise ZfLibException("resolve", "Could not load gallery \"" +
+                                 job.zf_path + "\"")
+
+        # The first photo of a name counts, as in zfdiff.diff_tree.
+        remote = {}
+        for photo in photoset['Photos']:
+            remote.setdefault(photo['FileName'], photo)
+        queued = 0
+        for name in todo:
+            stat = job.images[name]
+            photo_path = os.path.join(job.path, name)
+            upload_path, size = job.uploads.get(name, (None, stat.st_size))
+            photo = remote.get(name)
+            if ( photo == None ):
+                replace_id = None
+            elif ( size != photo['Size'] or
+                   (name in job.hashes and
+                    backup.hashes_differ(job.hashes[name], photo,
+                                         job.known.get(name))) ):
+                replace_id = photo['Id']
+            else:
+                self._done_queue.put(("Old", photo_path, stat, photo['Id'],
+                                      photoset['Id']))
+                continue
+            if ( upload_path == photo_path ):
+                upload_path = None
+            self.pool.submit(UploadTask(photo_path, element['UploadUrl'],
+                                        size, job.zf_path, replace_id, stat,
+                                        photoset['Id'], upload_path))
+            queued += 1
+
+        if ( mirror ):
+            with self._meta_lock:
+                with self._print_lock:
+                    backup.mirror_photoset(photoset, set(job.images) |
+                                           set(job.excluded))
+        return queued
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _meta_worker(self):
+        """
+        INTERNAL: Resolve directories until told to stop.
+        """
+        api = self._backup.clone()
+        limit = self._meta_limit
+        while ( True ):
+            job = self._dir_queue.get()
+            if ( job == None ):
+                break
+            if ( self._stopping ):
+                continue
+            # (Taking the slot first would let idle workers hold it.)
+            if ( limit != None ):
+                limit.acquire()
+            started = time.time()
+            failed = True
+            try:
+                queued = self.resolve(api, job)
+                self._done_queue.put(("Resolved", job.path, queued))
+                failed = False
+            except (ZfAPIException, IOError, httplib.HTTPException) as e:
+                msg = getattr(e, "msg", None) or getattr(e, "strerror", None) \
+                    or str(e)
+                with self._meta_lock:
+                    self.errors += 1
+                self.say("Fail " + job.path + ": " + str(msg))
+            finally:
+                if ( limit != None ):
+                    limit.release(started, 1, failed)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def prepare(self, path, names, images):
+        """
+        INTERNAL: Hash (--hash) and make the copies to upload (--resize,
+        --quality) of the images of a directory, with the Backup's
+        Hasher and Transformer.
+
+        Parameters:
+        path: the local directory.
+        names: the names of the images to back up.
+        images: dict of image name -> os.stat result.
+
+        Returns: (hashes, uploads, known), as for DirJob.
+        """
+        backup = self._backup
+        files = [(os.path.join(path, name), images[name]) for name in names]
+        hashes = {}
+        uploads = {}
+        known = {}
+        if ( backup._hasher != None ):
+            backup._hasher.submit(files)
+            if ( backup._state_db != None ):
+                known = backup._state_db.directory_files(path)
+        if ( backup._transformer != None ):
+            backup._transformer.submit(files)
+        for name, (file_path, stat) in zip(names, files):
+            if ( backup._hasher != None ):
+                hashes[name] = backup._hasher.result(file_path, stat)
+                self._digests[file_path] = hashes[name]
+            if ( backup._transformer != None ):
+                uploads[name] = backup._transformer.result(file_path, stat)
+        return (hashes, uploads, known)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _put(self, job):
+        """
+        INTERNAL: Queue a directory, recording finished work while the
+        queue is full.
+        """
+        while ( True ):
+            try:
+                self._dir_queue.put(job, True, 0.5)
+                return
+            except Queue.Full:
+                self.drain()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run(self, local_root, zf_root):
+        """
+        Back up a tree.
+
+        Parameters:
+        local_root: local path to back up.
+        zf_root: Zenfolio group to back up to.
+
+        Returns: Nothing
+        """
+        backup = self._backup
+        self.pool = UploadPool(backup, jobs=self._jobs,
+                               queue_size=self._jobs * 4,
+                               report=self.report, done=self.done,
+                               scheduler=self._scheduler,
+                               limit=self._limit)
+        self.pool.start()
+        threads = []
+        for i in range(self._meta_jobs):
+            thread = threading.Thread(target=self._meta_worker,
+                                      name="metadata-%d" % i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for scan_dir in zfscan.walk(local_root, backup.the_args.scan_jobs,
+                                        backup._walk_rules):
+                if ( not backup.owns(local_root, scan_dir.path) ):
+                    continue
+                rpath = os.path.relpath(scan_dir.path, local_root)
+                backup._local_path = scan_dir.path
+                backup._zf_path = zfdiff.zf_path_for(zf_root, rpath)
+                self.say("   Archiving: " + scan_dir.path)
+
+                if ( backup._state_db != None and not backup.the_args.mirror and
+                     not backup.the_args.verify_hash ):
+                    with self._print_lock:
+                        skip = backup.skip_unchanged(scan_dir.dirs,
+                                                     scan_dir.files,
+                                                     scan_dir.images)
+                    if ( skip ):
+                        continue
+
+                done = set()
+                if ( backup._journal != None ):
+                    with self._print_lock:
+                        skip = backup.skip_journaled(scan_dir.files,
+                                                     scan_dir.images)
+                    if ( skip ):
+                        continue
+                    done = set([name for name in scan_dir.images
+                                if backup._journal.is_file_done(
+                                    os.path.join(scan_dir.path, name),
+                                    scan_dir.images[name])])
+                    backup._old_files += len(done)
+
+                backup._skip_files += len(scan_dir.files) - \
+                    len(scan_dir.images)
+                names = [name for name in sorted(scan_dir.images)
+                         if name not in done]
+                hashes, uploads, known = self.prepare(scan_dir.path, names,
+                                                      scan_dir.images)
+                self._put(DirJob(scan_dir.path, backup._zf_path,
+                                 scan_dir.dirs, scan_dir.images, done,
+                                 scan_dir.excluded, hashes, uploads, known))
+                self.drain()
+                with self._print_lock:
+                    backup.report_shard()
+
+            # Let the metadata stage finish, then the uploads.
+            for thread in threads:
+                self._put(None)
+            for thread in threads:
+                while ( thread.is_alive() ):
+                    thread.join(0.5)
+                    self.drain()
+            self.pool.close()
+
+        except KeyboardInterrupt:
+            self._stopping = True
+            self.pool.stop()
+            raise
+
+        finally:
+            self.drain()
@@ -0,0 +1,222 @@
+#    Backup plans: a ChangeSet written to and read from a file
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# A plan is a JSON document:
+#
+#   {"version": 1, "user": ..., "local_path": ..., "group_path": ...,
+#    "created": <unix time>,
+#    "operations": [{"op": "group", "path": ...},
+#                   {"op": "gallery", "path": ...},
+#                   {"op": "add", "file": ..., "gallery": ..., "size": ...},
+#                   {"op": "replace", "file": ..., "gallery": ...,
+#                    "size": ..., "photo_id": ...},
+#                   {"op": "delete", "gallery": ..., "photo_id": ...,
+#                    "filename": ...}],
+#    "totals": {"groups": ..., "galleries": ..., "add": ..., "replace": ...,
+#               "delete": ..., "unchanged": ..., "upload_bytes": ...},
+#    "rate": <bytes per second>, "estimated_seconds": ...}
+#
+# Function list:
+#
+# parent_path:                          Parent of a Zenfolio path
+# leaf_name:                            Last component of a Zenfolio path
+# estimate_seconds:                     Estimate how long a plan will take
+# make_plan:                            Turn a ChangeSet into a plan
+# write_plan:                           Save a plan to a file
+# to_utf8:                              Turn unicode in JSON into byte strings
+# read_plan:                            Load a plan from a file
+# format_plan:                          Describe a plan for people
+
+from zucla.zflib import ZfLibException
+
+import json
+import time
+
+PLAN_VERSION = 1
+
+# Round-trip time assumed for each API call when estimating.
+CALL_SECONDS = 0.5
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def parent_path(path):
+    """
+    Return the parent of a slash-delimited Zenfolio path.
+    """
+    return path.rstrip("/").rsplit("/", 1)[0]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def leaf_name(path):
+    """
+    Return the last component of a slash-delimited Zenfolio path.
+    """
+    return path.rstrip("/").rsplit("/", 1)[-1]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def estimate_seconds(totals, rate, jobs=1):
+    """
+    Estimate the time needed to carry out a plan.
+
+    Parameters:
+    totals: the "totals" dict of a plan.
+    rate: sustained upload rate in bytes per second (for all jobs
+        together; concurrency does not widen the uplink).
+    jobs: number of concurrent uploads, which hide per-call latency.
+
+    Returns: Estimated number of seconds.
+    """
+    calls = totals['groups'] + totals['galleries']
+    uploads = totals['add'] + totals['replace']
+    seconds = calls * CALL_SECONDS
+    seconds += (uploads + totals['replace']) * CALL_SECONDS / max(1, jobs)
+    seconds += (totals['delete'] // 100 + 1) * CALL_SECONDS
+    if ( rate > 0 ):
+        seconds += float(totals['upload_bytes']) / rate
+    return int(seconds)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def make_plan(changes, user, local_path, group_path, rate, jobs=1):
+    """
+    Turn a ChangeSet into a plan.
+
+    Parameters:
+    changes: ChangeSet from zfdiff.diff_tree.
+    user: Zenfolio login name the plan was made for.
+    local_path, group_path: what is being backed up, and where to.
+    rate: expected upload rate in bytes per second.
+    jobs: expected number of concurrent uploads.
+
+    Returns: A plan dict.
+    """
+    operations = []
+    for path in changes.groups:
+        operations.append({'op': "group", 'path': path})
+    for path in changes.galleries:
+        operations.append({'op': "gallery", 'path': path})
+    for local_file, gallery, size in changes.add:
+        operations.append({'op': "add", 'file': local_file,
+                           'gallery': gallery, 'size': size})
+    for local_file, gallery, size, photo in changes.replace:
+        operations.append({'op': "replace", 'file': local_file,
+                           'gallery': gallery, 'size': size,
+                           'photo_id': photo['Id']})
+    for gallery, photo in changes.delete:
+        operations.append({'op': "delete", 'gallery': gallery,
+                           'photo_id': photo['Id'],
+                           'filename': photo['FileName']})
+
+    totals = {'groups': len(changes.groups),
+              'galleries': len(changes.galleries),
+              'add': len(changes.add),
+              'replace': len(changes.replace),
+              'delete': len(changes.delete),
+              'unchanged': changes.unchanged,
+              'upload_bytes': changes.upload_bytes()}
+
+    return {'version': PLAN_VERSION,
+            'user': user,
+            'local_path': local_path,
+            'group_path': group_path,
+            'created': int(time.time()),
+            'operations': operations,
+            'totals': totals,
+            'rate': rate,
+            'estimated_seconds': estimate_seconds(totals, rate, jobs)}
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def write_plan(plan, filename):
+    """
+    Save a plan to a file.
+    """
+    plan_file = open(filename, 'w')
+    try:
+        json.dump(plan, plan_file, indent=1, sort_keys=True)
+    finally:
+        plan_file.close()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def to_utf8(value):
+    """
+    Turn every unicode string in a value loaded from JSON (and in the
+    lists and dicts it holds) into a UTF-8 byte string, which is what
+    the rest of ZUCLA works with.
+    """
+    if ( isinstance(value, unicode) ):
+        return value.encode("utf-8")
+    if ( isinstance(value, list) ):
+        return [to_utf8(item) for item in value]
+    if ( isinstance(value, dict) ):
+        return dict((to_utf8(key), to_utf8(item))
+                    for key, item in value.items())
+    return value
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def read_plan(filename):
+    """
+    Load a plan from a file.
+
+    Returns: A plan dict, with strings as UTF-8 byte strings.  Raises
+        ZfLibException if the file is not a plan this version understands.
+    """
+    plan_file = open(filename, 'r')
+    try:
+        plan = to_utf8(json.load(plan_file))
+    except ValueError as e:
+        raise ZfLibException("read_plan",
+                             filename + ": not a plan (" + str(e) + ")")
+    finally:
+        plan_file.close()
+
+    if ( not isinstance(plan, dict) or
+         plan.get('version') != PLAN_VERSION or
+         'operations' not in plan ):
+        raise ZfLibException("read_plan",
+                             filename + ": unsupported plan version")
+    return plan
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def format_plan(plan):
+    """
+    Describe a plan in a few lines of text.
+    """
+    totals = plan['totals']
+    seconds = plan['estimated_seconds']
+    lines = ["Plan for {:s} -> {:s}".format(plan['local_path'],
+                                             plan['group_path']),
+             "  Create  {:5d} groups".format(totals['groups']),
+             "      and {:5d} galleries".format(totals['galleries']),
+             "  Add     {:5d} image files".format(totals['add']),
+             "  Update  {:5d} image files".format(totals['replace']),
+             "  Delete  {:5d} remote image files".format(totals['delete']),
+             "  Keep    {:5d} image files".format(totals['unchanged']),
+             "  Upload  {:.1f} MB".format(totals['upload_bytes'] / 1e6),
+             "  Estimated time {:d}:{:02d}:{:02d}".format(seconds // 3600,
+                                                         seconds // 60 % 60,
+                                                         seconds % 60)]
+    return "\n".join(lines)
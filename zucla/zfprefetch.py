@@ -0,0 +1,186 @@
+#    Load photoset snapshots ahead of the directories that need them
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# A serial backup spends a round trip at the start of every directory
+# loading its photoset.  The prefetcher is told about the next few
+# directories of the walk and loads their photosets on its own
+# connections, so the snapshot is usually there when the backup gets to
+# the directory.  Only galleries that already exist are prefetched; the
+# gallery of the directory being worked on is never touched by the
+# prefetcher, so a snapshot cannot be made stale by our own uploads.
+
+from zucla.zfapi import ZfAPIException
+from zucla import zfdiff
+
+from collections import OrderedDict
+import httplib
+import threading
+import Queue
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class PhotosetPrefetcher:
+    """
+    Load photoset snapshots (Level2, with photos) in the background.
+
+    At most "lookahead" snapshots are held or being loaded; requesting
+    more drops the oldest.
+
+    Attributes:
+    hits: number of get() calls answered by a prefetched snapshot
+    misses: number of get() calls for a photoset that wasn't prefetched
+    wasted: number of snapshots dropped without being used
+    """
+
+    def __init__(self, session, lookahead=4, jobs=2):
+        """
+        Initialize the prefetcher and start its threads.
+
+        Parameters:
+        session: an authenticated ZfLib (used from the caller's thread
+            only, to look up photoset Ids).
+        lookahead: number of snapshots to hold.
+        jobs: number of snapshots loaded at a time.
+        """
+        self._session = session
+        self._lookahead = max(1, lookahead)
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._threads = []
+
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+
+        for i in range(max(1, jobs)):
+            thread = threading.Thread(target=self._worker,
+                                      name="prefetch-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def request(self, path):
+        """
+        Start loading the photoset at a Zenfolio path, if it exists.
+
+        Parameters:
+        path: slash-delimited Zenfolio path of the gallery.
+
+        Returns: Nothing
+        """
+        path = zfdiff.zf_path_for(path, "")
+        element = self._session.element_index().get((path, "PhotoSet"))
+        if ( element == None ):
+            return
+
+        with self._lock:
+            if ( path in self._entries ):
+                return
+            while ( len(self._entries) >= self._lookahead ):
+                self._entries.popitem(last=False)
+                self.wasted += 1
+            entry = [threading.Event(), None]
+            self._entries[path] = entry
+        self._queue.put((element['Id'], entry))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def get(self, path):
+        """
+        Take the prefetched snapshot of a photoset, waiting for it if it
+        is still loading.
+
+        Parameters:
+        path: slash-delimited Zenfolio path of the gallery.
+
+        Returns: The snapshot, or None if it was not prefetched (or
+            could not be loaded); the caller then loads it itself.
+        """
+        path = zfdiff.zf_path_for(path, "")
+        with self._lock:
+            entry = self._entries.pop(path, None)
+        if ( entry == None ):
+            self.misses += 1
+            return None
+
+        # Wait with a timeout so that KeyboardInterrupt gets through.
+        while ( not entry[0].is_set() ):
+            entry[0].wait(0.5)
+        if ( entry[1] == None ):
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry[1]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def forget(self, path):
+        """
+        Drop the snapshot of a photoset that has been changed since it
+        was requested.
+        """
+        path = zfdiff.zf_path_for(path, "")
+        with self._lock:
+            if ( self._entries.pop(path, None) != None ):
+                self.wasted += 1
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        """
+        Stop the prefetch threads, letting loads in progress finish.
+        """
+        with self._lock:
+            self.wasted += len(self._entries)
+            self._entries.clear()
+        for thread in self._threads:
+            self._queue.put(None)
+        # Join with a timeout so that KeyboardInterrupt gets through.
+        for thread in self._threads:
+            while ( thread.is_alive() ):
+                thread.join(0.5)
+        self._threads = []
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _worker(self):
+        """
+        INTERNAL: Load snapshots until told to stop.
+        """
+        api = self._session.clone()
+        while ( True ):
+            item = self._queue.get()
+            if ( item == None ):
+                break
+            photoset_id, entry = item
+            try:
+                entry[1] = api.LoadPhotoSet(photoset_id, "Level2", "True")
+            except (ZfAPIException, IOError, httplib.HTTPException):
+                # The backup loads it again itself; start over with a
+                # new connection.
+                api._open_connection()
+            entry[0].set()
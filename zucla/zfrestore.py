@@ -0,0 +1,384 @@
+#    Download galleries from Zenfolio into a local tree
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# A restore is a backup run backwards: every group and gallery under a
+# Zenfolio path becomes a local directory (a group and a gallery with
+# the same path share one, as a backup creates them), and the original
+# of every photo is downloaded into its gallery's directory.
+#
+# Files are downloaded by a pool of worker threads, each with its own
+# connections.  A file is written to NAME.part and renamed when it is
+# complete, so an interrupted restore leaves no truncated photos; the
+# next run asks for the rest of each .part file with a Range request.
+# All the workers draw from one RateLimiter, which caps the total
+# bandwidth.
+#
+# Function list:
+#
+# restore_targets:                      Groups and galleries under a path
+# local_name:                           Safe local file name for a photo
+# unique_name:                          Name not used in a directory yet
+# RateLimiter:                          Bandwidth limit shared by threads
+# DownloadPool:                         Download files with N threads
+
+from zucla.zfapi import ZfAPIException
+
+import httplib
+import os
+import os.path
+import threading
+import time
+import Queue
+
+# Bytes read from the server at a time.
+READ_SIZE = 64 * 1024
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def restore_targets(index, zf_root):
+    """
+    Find the groups and galleries to restore.
+
+    Parameters:
+    index: dict of (Zenfolio path, element type) -> element, as returned
+        by ZfLib.element_index.
+    zf_root: slash-delimited Zenfolio path to restore, in the form used
+        by the index.
+
+    Returns: A list of (relative path, element type, element) sorted by
+        path, parents first; the relative path of zf_root itself is "".
+        Relative paths are slash-delimited.
+    """
+    prefix = zf_root.rstrip("/") + "/"
+    targets = []
+    for (path, etype), element in index.iteritems():
+        if ( path == zf_root ):
+            targets.append(("", etype, element))
+        elif ( path.startswith(prefix) ):
+            targets.append((path[len(prefix):], etype, element))
+    targets.sort()
+    return targets
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def local_name(filename):
+    """
+    Make a photo's file name safe to use as a local file name: no
+    directories, and nothing that would name another file.
+
+    Returns: The name, or None if nothing usable is left.
+    """
+    if ( filename == None ):
+        return None
+    name = filename.replace("\\", "/").split("/")[-1]
+    if ( name in ("", ".", "..") or name.endswith(".part") ):
+        return None
+    return name
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def unique_name(name, photo_id, used):
+    """
+    Make sure that no two photos are restored to the same file (a
+    gallery may hold several photos with one file name).  The first
+    photo keeps its name; the others get their Id added, so that every
+    run picks the same names: IMG_1.jpg, IMG_1-1234.jpg.
+
+    Parameters:
+    name: the photo's local name (see local_name).
+    photo_id: the photo's Id.
+    used: set of the names used in the directory so far, in lower case
+        (for file systems that ignore case).  The name chosen is added.
+
+    Returns: The name.
+    """
+    base, ext = os.path.splitext(name)
+    unique = name
+    suffix = "-{:d}".format(photo_id)
+    count = 1
+    while ( unique.lower() in used ):
+        unique = base + suffix + ext
+        count += 1
+        suffix = "-{:d}-{:d}".format(photo_id, count)
+    used.add(unique.lower())
+    return unique
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class RateLimiter:
+    """
+    A token bucket shared by threads, limiting the bytes per second
+    they transfer between them.
+    """
+
+    def __init__(self, rate):
+        """
+        Initialize the limiter.
+
+        Parameters:
+        rate: bytes per second.  Up to a second's worth may be
+            transferred in a burst.
+        """
+        self._rate = float(rate)
+        self._allowance = self._rate
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, count):
+        """
+        Account for count bytes, sleeping as long as it takes to stay
+        within the rate.
+        """
+        with self._lock:
+            now = time.time()
+            self._allowance = min(self._rate, self._allowance +
+                                  (now - self._last) * self._rate)
+            self._last = now
+            self._allowance -= count
+            wait = -self._allowance / self._rate
+        if ( wait > 0 ):
+            time.sleep(wait)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class DownloadTask:
+    """
+    A file to download.
+
+    Attributes:
+    url: URL of the file (a photo's OriginalUrl)
+    local_path: where to put it
+    size: its size in bytes, or None if not known
+    gallery: Zenfolio path of its gallery (for messages)
+    resumed: bytes already there from an earlier download
+    """
+
+    def __init__(self, url, local_path, size=None, gallery=None):
+        self.url = url
+        self.local_path = local_path
+        self.size = size
+        self.gallery = gallery
+        self.resumed = 0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class DownloadPool:
+    """
+    Download files with several worker threads, each with its own
+    connections sharing one authenticated session.
+
+    Attributes:
+    downloaded: number of files downloaded
+    bytes: number of bytes downloaded
+    resumed: number of downloads continued from a .part file
+    retries: number of retried downloads
+    failed: list of (DownloadTask, message) that could not be downloaded
+    """
+
+    def __init__(self, session, jobs=4, limiter=None, max_retries=3,
+                 report=None):
+        """
+        Initialize the pool.
+
+        Parameters:
+        session: an authenticated ZfAPI (or subclass) to clone.
+        jobs: number of worker threads.
+        limiter: a RateLimiter for all the workers, or None.
+        max_retries: how often to retry a failed download (each retry
+            resumes where the last one stopped).
+        report: function(action, task, message) called (serialized)
+            when a file has been downloaded ("Get") or has failed
+            ("Fail").
+        """
+        self._session = session
+        self._jobs = max(1, jobs)
+        self._limiter = limiter
+        self._max_retries = max_retries
+        self._report = report
+        self._queue = Queue.Queue(self._jobs * 4)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopping = False
+
+        self.downloaded = 0
+        self.bytes = 0
+        self.resumed = 0
+        self.retries = 0
+        self.failed = []
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def start(self):
+        """
+        Start the worker threads.
+        """
+        for i in range(self._jobs):
+            thread = threading.Thread(target=self._worker,
+                                      name="download-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def submit(self, task):
+        """
+        Queue a DownloadTask, waiting while the queue is full.
+        """
+        while ( True ):
+            try:
+                # A timeout keeps KeyboardInterrupt deliverable.
+                self._queue.put(task, True, 0.5)
+                return
+            except Queue.Full:
+                pass
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        """
+        Wait until every queued task is done and stop the workers.
+        """
+        for thread in self._threads:
+            self.submit(None)
+        # Join with a timeout so that KeyboardInterrupt gets through.
+        for thread in self._threads:
+            while ( thread.is_alive() ):
+                thread.join(0.5)
+        self._threads = []
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def stop(self):
+        """
+        Drop the tasks that have not been started yet.
+        """
+        self._stopping = True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def report(self, action, task, message=None):
+        with self._lock:
+            if ( self._report != None ):
+                self._report(action, task, message)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _worker(self):
+        """
+        INTERNAL: Take tasks from the queue until told to stop.
+        """
+        api = self._session.clone()
+        while ( True ):
+            task = self._queue.get()
+            if ( task == None ):
+                break
+            if ( self._stopping ):
+                continue
+            try:
+                self._download(api, task)
+            except (ZfAPIException, IOError, OSError,
+                    httplib.HTTPException) as e:
+                msg = getattr(e, "msg", None) or \
+                    getattr(e, "strerror", None) or str(e) or \
+                    e.__class__.__name__
+                with self._lock:
+                    self.failed.append((task, msg))
+                self.report("Fail", task, msg)
+            else:
+                with self._lock:
+                    self.downloaded += 1
+                    if ( task.resumed ):
+                        self.resumed += 1
+                self.report("Get", task)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _download(self, api, task):
+        """
+        INTERNAL: Download one file into its .part file, resuming and
+        retrying as needed, and move it into place.
+        """
+        part_path = task.local_path + ".part"
+        retries = 0
+        first = True
+        while ( True ):
+            offset = 0
+            if ( os.path.exists(part_path) ):
+                offset = os.path.getsize(part_path)
+                if ( task.size != None and offset > task.size ):
+                    offset = 0
+            if ( first ):
+                task.resumed = offset
+                first = False
+            error = None
+            try:
+                self._fetch(api, task, part_path, offset)
+            except (IOError, httplib.HTTPException) as e:
+                error = e
+            # A connection that closed early counts as a failure too.
+            if ( error == None and 
+                 (task.size == None or 
+                  os.path.getsize(part_path) >= task.size) ):
+                break
+            if ( retries >= self._max_retries ):
+                if ( error != None ):
+                    raise error
+                break
+            retries += 1
+            with self._lock:
+                self.retries += 1
+
+        if ( task.size != None and os.path.getsize(part_path) != task.size ):
+            raise ZfAPIException(None, "got {:d} of {:d} bytes".format(
+                os.path.getsize(part_path), task.size))
+        os.rename(part_path, task.local_path)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _fetch(self, api, task, part_path, offset):
+        """
+        INTERNAL: Download a file (from offset, if the server allows)
+        into its .part file.
+        """
+        if ( task.size != None and offset == task.size and offset > 0 ):
+            # Complete already; the rename was all that was missing.
+            return
+        response = api.open_url(task.url, offset)
+        try:
+            if ( response.status == 206 and offset > 0 ):
+                mode = "ab"
+            elif ( response.status == 200 ):
+                mode = "wb"
+            else:
+                raise ZfAPIException(response.status, 
+                                     "HTTP {:d} {:s}".format(
+                                         response.status, response.reason))
+            part = open(part_path, mode)
+            try:
+                while ( True ):
+                    data = response.read(READ_SIZE)
+                    if ( data == "" ):
+                        break
+                    if ( self._limiter != None ):
+                        self._limiter.consume(len(data))
+                    part.write(data)
+                    with self._lock:
+                        self.bytes += len(data)
+            finally:
+                part.close()
+        finally:
+            response.close()
@@ -0,0 +1,478 @@
+#    Scan a local directory tree with several threads
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# walk() visits directories in the same order as os.walk(topdown=True)
+# with sorted directory names, but reads directories and stats image
+# files on a pool of threads, so that on network file systems many
+# requests are in flight at once.  Directory entries are classified
+# from the type that readdir returns where scandir is available, and
+# files are recognized as images from their extension only; only image
+# files are stat'ed.  Without scandir (Python 2 without the scandir
+# module), each entry is lstat'ed once instead, and that result is also
+# the stat of an image, so no file is stat'ed twice.  Directories
+# excluded by FilterRules are not read at all, and files they exclude
+# are left out of the listing.
+#
+# A directory with more than max_files files (a camera dump of hundreds
+# of thousands of pictures, say) is yielded without its files; the
+# caller reads them with scan_chunks(), a bounded chunk at a time.
+#
+# WalkAhead runs a walk on a thread of its own, so that it can start
+# before its caller is ready for it (while a password is typed, say).
+# It can't be used by callers that prune ScanDir.dirs.
+#
+# Function list:
+#
+# image_extensions:                     Extensions of image files
+# is_image_name:                        Is this the name of an image file?
+# walk:                                 Walk a tree, yielding ScanDir
+# scan_chunks:                          Read a large directory in chunks
+# WalkAhead:                            Run a walk in the background
+
+from zucla import zffilter
+
+import os
+import os.path
+import Queue
+import stat
+import sys
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# Number of files stat'ed by one task.
+STAT_CHUNK = 64
+
+_image_extensions = None
+_encodings = None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def image_extensions():
+    """
+    Get the (lower case) extensions that mimetypes maps to an image
+    type.  The system MIME databases are read on the first call.
+
+    Returns: A frozenset of extensions, including the leading dot.
+    """
+    global _image_extensions, _encodings
+    if ( _image_extensions == None ):
+        # Imported here: mimetypes imports urllib, which is slow to load.
+        import mimetypes
+        mimetypes.init()
+        extensions = set()
+        for types_map in (mimetypes.types_map, mimetypes.common_types):
+            for ext, mime_type in types_map.items():
+                if ( mime_type.startswith("image/") ):
+                    extensions.add(ext.lower())
+        _encodings = frozenset(mimetypes.encodings_map)
+        _image_extensions = frozenset(extensions)
+    return _image_extensions
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def is_image_name(filename):
+    """
+    Decide from its name whether a file is an image, the way
+    mimetypes.guess_type would (a compressed image such as "a.tif.gz"
+    counts), without touching the file.
+    """
+    extensions = image_extensions()
+    root, ext = os.path.splitext(filename)
+    ext = ext.lower()
+    if ( ext in _encodings ):
+        root, ext = os.path.splitext(root)
+        ext = ext.lower()
+    return ext in extensions
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ScanDir:
+    """
+    One directory found by walk().
+
+    Attributes:
+    path: path of the directory
+    dirs: sorted names of the subdirectories.  Remove names from this
+        list to keep walk() from descending into them.
+    files: sorted names of everything else, or None if there are
+        more than walk()'s max_files (see scan_chunks)
+    images: dict of image file name -> os.stat result, or None along
+        with files
+    excluded: set of the names of the files that the rules left out
+        (they are there, just not backed up), or None along with files
+    """
+
+    def __init__(self, path, dirs, files, images, excluded=None):
+        self.path = path
+        self.dirs = dirs
+        self.files = files
+        self.images = images
+        if ( excluded == None and files != None ):
+            excluded = set()
+        self.excluded = excluded
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _classify(full_path):
+    """
+    INTERNAL: Find out what a directory entry is without scandir: one
+    lstat, and a stat only for a symbolic link.
+
+    Returns: (is_dir, is_link, stat): stat is the os.stat result of the
+        entry (or what it links to), or None if it is gone or a
+        dangling link.
+    """
+    try:
+        result = os.lstat(full_path)
+    except OSError:
+        return (False, False, None)
+    if ( not stat.S_ISLNK(result.st_mode) ):
+        return (stat.S_ISDIR(result.st_mode), False, result)
+    try:
+        result = os.stat(full_path)
+    except OSError:
+        return (False, True, None)
+    return (stat.S_ISDIR(result.st_mode), True, result)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _read_dir(path, max_files=None):
+    """
+    INTERNAL: List a directory.
+
+    Returns: (dirs, links, files, stats): sorted subdirectory names,
+        the subset of those that are symbolic links, sorted other names
+        (None if there are more than max_files of them), and a dict of
+        image name -> os.stat result for the images that were stat'ed
+        to list them (without scandir).  ([], set(), [], {}) if the
+        directory cannot be read, like os.walk.
+    """
+    dirs = []
+    links = set()
+    files = []
+    stats = {}
+    try:
+        if ( scandir != None ):
+            for entry in scandir(path):
+                if ( entry.is_dir() ):
+                    dirs.append(entry.name)
+                    if ( entry.is_symlink() ):
+                        links.add(entry.name)
+                elif ( files != None ):
+                    files.append(entry.name)
+                    if ( max_files != None and len(files) > max_files ):
+                        files = None
+        else:
+            for name in os.listdir(path):
+                is_dir, is_link, result = _classify(os.path.join(path, name))
+                if ( is_dir ):
+                    dirs.append(name)
+                    if ( is_link ):
+                        links.add(name)
+                elif ( files != None ):
+                    files.append(name)
+                    if ( result != None and is_image_name(name) ):
+                        stats[name] = result
+                    if ( max_files != None and len(files) > max_files ):
+                        files = None
+                        stats = {}
+    except OSError:
+        return ([], set(), [], {})
+    dirs.sort()
+    if ( files != None ):
+        files.sort()
+    return (dirs, links, files, stats)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _stat_files(path, names):
+    """
+    INTERNAL: Stat files in a directory, skipping those that are gone
+    (or are dangling links).
+
+    Returns: list of (name, os.stat result).
+    """
+    stats = []
+    for name in names:
+        try:
+            stats.append((name, os.stat(os.path.join(path, name))))
+        except OSError:
+            pass
+    return stats
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def walk(root, jobs=8, rules=None, base=None, max_files=None):
+    """
+    Walk a directory tree top-down, like os.walk with sorted names.
+
+    While the caller works on one directory, the listings of its
+    subdirectories are already being read.  Symbolic links to
+    directories are listed in dirs but not descended into.
+
+    Parameters:
+    root: the directory to walk.
+    jobs: number of threads reading directories and stat'ing files.
+    rules: zffilter.FilterRules deciding what to leave out, or None.
+    base: the directory that the rules' relative paths start from
+        (default: root).
+    max_files: leave out the files of directories with more than
+        this many (ScanDir.files and images are None), or None.
+
+    Returns: A generator of ScanDir.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if ( base == None ):
+        base = root
+    pool = ThreadPool(max(1, jobs))
+    try:
+        stack = [(root, pool.apply_async(_read_dir, (root, max_files)))]
+        while ( stack != [] ):
+            path, listing = stack.pop()
+            dirs, links, files, stats = listing.get(86400)
+
+            excluded = set()
+            if ( rules != None ):
+                rel_dir = zffilter.relative_dir(path, base)
+                dirs = [name for name in dirs
+                        if not rules.prune_dir(rel_dir, name)]
+                if ( files != None ):
+                    excluded = set([name for name in files
+                                    if rules.skip_name(rel_dir, name)])
+                    files = [name for name in files if name not in excluded]
+
+            children = [(os.path.join(path, name),
+                         pool.apply_async(_read_dir,
+                                          (os.path.join(path, name),
+                                           max_files)))
+                        for name in dirs if name not in links]
+            if ( files == None ):
+                scan_dir = ScanDir(path, dirs, None, None)
+                yield scan_dir
+                wanted = set(scan_dir.dirs)
+                children = [(child, result) for child, result in children
+                            if os.path.basename(child) in wanted]
+                stack.extend(reversed(children))
+                continue
+
+            # Stat the images in chunks while the subdirectories are read,
+            # unless listing the directory did already.
+            if ( scandir != None ):
+                names = [name for name in files if is_image_name(name)]
+            else:
+                names = []
+            chunks = [pool.apply_async(_stat_files,
+                                       (path, names[i:i + STAT_CHUNK]))
+                      for i in range(0, len(names), STAT_CHUNK)]
+
+            images = dict([(name, stats[name]) for name in files
+                           if name in stats])
+            for chunk in chunks:
+                images.update(chunk.get(86400))
+            if ( rules != None ):
+                skipped = set([name for name in images
+                               if rules.skip_stat(images[name])])
+                if ( skipped ):
+                    files = [name for name in files if name not in skipped]
+                    for name in skipped:
+                        del images[name]
+                    excluded |= skipped
+
+            scan_dir = ScanDir(path, dirs, files, images, excluded)
+            yield scan_dir
+
+            # The caller may have pruned dirs.
+            wanted = set(scan_dir.dirs)
+            children = [(child, result) for child, result in children
+                        if os.path.basename(child) in wanted]
+            stack.extend(reversed(children))
+    finally:
+        pool.terminate()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _iter_files(path):
+    """
+    INTERNAL: Generate (name, stat) for the entries of a directory that
+    are not directories, reading the directory as it goes where scandir
+    is available.  stat is the os.stat result of an image that was
+    stat'ed to classify it (without scandir), or None.
+    """
+    try:
+        if ( scandir != None ):
+            for entry in scandir(path):
+                if ( not entry.is_dir() ):
+                    yield (entry.name, None)
+        else:
+            for name in os.listdir(path):
+                is_dir, is_link, result = _classify(os.path.join(path, name))
+                if ( not is_dir ):
+                    if ( not is_image_name(name) ):
+                        result = None
+                    yield (name, result)
+    except OSError:
+        return
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def scan_chunks(path, chunk, rules=None, base=None, excluded=None):
+    """
+    Read the files of a directory a chunk at a time, for directories
+    too large to list at once (see walk's max_files).  The chunks come
+    in directory order; only the names within a chunk are sorted.
+
+    Parameters:
+    path: the directory.
+    chunk: number of files per chunk.
+    rules: zffilter.FilterRules deciding what to leave out, or None.
+    base: the directory that the rules' relative paths start from
+        (default: path).
+    excluded: function(name) called for each file that the rules
+        leave out, or None.
+
+    Returns: A generator of lists of (name, os.stat result) pairs; the
+        stat result is None for files that are not images.
+    """
+    if ( base == None ):
+        base = path
+    rel_dir = zffilter.relative_dir(path, base)
+    names = []
+    stats = {}
+    for name, result in _iter_files(path):
+        if ( rules != None and rules.skip_name(rel_dir, name) ):
+            if ( excluded != None ):
+                excluded(name)
+            continue
+        names.append(name)
+        if ( result != None ):
+            stats[name] = result
+        if ( len(names) >= chunk ):
+            yield _stat_chunk(path, names, rules, excluded, stats)
+            names = []
+            stats = {}
+    if ( names != [] ):
+        yield _stat_chunk(path, names, rules, excluded, stats)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _stat_chunk(path, names, rules, excluded=None, stats=None):
+    """
+    INTERNAL: Stat the images among some files of a directory, except
+    those whose os.stat result is in stats already.
+
+    Returns: sorted list of (name, os.stat result or None).
+    """
+    names.sort()
+    images = dict(stats or {})
+    images.update(_stat_files(path, [name for name in names
+                                     if is_image_name(name) and
+                                        name not in images]))
+    entries = []
+    for name in names:
+        if ( not is_image_name(name) ):
+            entries.append((name, None))
+        elif ( name not in images ):
+            continue
+        elif ( rules == None or not rules.skip_stat(images[name]) ):
+            entries.append((name, images[name]))
+        elif ( excluded != None ):
+            excluded(name)
+    return entries
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class WalkAhead:
+    """
+    A walk that runs on a background thread, up to a number of
+    directories ahead of the caller.  Iterating over it yields the
+    walk's ScanDirs (and raises its exception, if it fails).
+    """
+
+    def __init__(self, walker, ahead=256):
+        """
+        Start the walk.
+
+        Parameters:
+        walker: the generator returned by walk().
+        ahead: how many directories may wait for the caller.
+        """
+        self._walker = walker
+        self._queue = Queue.Queue(max(1, ahead))
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        """
+        INTERNAL: Queue an item, unless the walk is closed first.
+        """
+        while ( not self._closed ):
+            try:
+                self._queue.put(item, True, 0.5)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        """
+        INTERNAL: The thread: walk, queueing (scan_dir, None), then
+        (None, exc_info) if the walk fails and None at the end.
+        """
+        try:
+            try:
+                for scan_dir in self._walker:
+                    if ( not self._put((scan_dir, None)) ):
+                        return
+            except Exception:
+                self._put((None, sys.exc_info()))
+            self._put(None)
+        finally:
+            self._walker.close()
+
+    def __iter__(self):
+        while ( True ):
+            try:
+                # A timeout keeps KeyboardInterrupt deliverable.
+                item = self._queue.get(True, 0.5)
+            except Queue.Empty:
+                continue
+            if ( item == None ):
+                return
+            scan_dir, error = item
+            if ( error != None ):
+                raise error[0], error[1], error[2]
+            yield scan_dir
+
+    def close(self):
+        """
+        Stop the walk, and wait for its thread to finish.
+        """
+        self._closed = True
+        while ( self._thread.is_alive() ):
+            self._thread.join(0.5)
@@ -0,0 +1,198 @@
+#    Decide the order in which an UploadPool uploads its files
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# The scheduler takes the place of the UploadPool's queue.  Tasks wait in
+# a bounded window (put() blocks while it is full, which holds back the
+# stages feeding it) and workers take the best one according to:
+#
+#   1. the priority of its gallery (highest first; see parse_priority)
+#   2. the order: "fifo" (as submitted), "smallest" or "largest" file
+#      first, or "mixed" (alternately the smallest and the largest)
+#
+# Ordering only applies within the window, so a larger window orders
+# better at the cost of memory.  With max_bytes, a task is only handed
+# out when the bytes being uploaded stay within the limit (one task is
+# always allowed, however large).
+#
+# Function list:
+#
+# parse_priority:                       "GLOB=N" -> (GLOB, N)
+# UploadScheduler:                      Ordered, bounded task queue
+
+from zucla.zflib import ZfLibException
+
+from bisect import bisect_left, insort
+import fnmatch
+import re
+import threading
+
+ORDERS = ["fifo", "smallest", "largest", "mixed"]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def parse_priority(text):
+    """
+    Parse a gallery priority "GLOB=N", where GLOB is matched against
+    Zenfolio gallery paths (for example "/All Photographs/2013/*=10").
+
+    Returns: (GLOB, N).  Raises ZfLibException if the text is not valid.
+    """
+    pattern, sep, value = text.rpartition("=")
+    try:
+        priority = int(value)
+    except ValueError:
+        sep = ""
+    if ( sep == "" or pattern == "" ):
+        raise ZfLibException("parse_priority", "not a priority: " + text)
+    return (pattern, priority)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class UploadScheduler:
+    """
+    A bounded queue of UploadTasks that hands them out in priority and
+    size order.
+
+    Attributes:
+    in_flight: bytes handed out and not yet done
+    """
+
+    def __init__(self, order="fifo", max_bytes=None, queue_size=0,
+                 priorities=()):
+        """
+        Initialize the scheduler.
+
+        Parameters:
+        order: one of ORDERS.
+        max_bytes: limit on the bytes being uploaded at a time, or None.
+        queue_size: bound on waiting tasks; zero means no bound.
+        priorities: list of (glob, priority) for gallery paths; the
+            first match counts, and other galleries have priority 0.
+        """
+        if ( order not in ORDERS ):
+            raise ZfLibException("UploadScheduler", "unknown order " + order)
+        self._order = order
+        self._max_bytes = max_bytes
+        self._queue_size = queue_size
+        self._priorities = [(re.compile(fnmatch.translate(pattern)), priority)
+                            for pattern, priority in priorities]
+        self._cond = threading.Condition()
+        self._keys = []
+        self._tasks = {}
+        self._seq = 0
+        self._closed = False
+        self._big_next = False
+
+        self.in_flight = 0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def priority(self, task):
+        """
+        Returns: The priority of a task's gallery.
+        """
+        for regex, priority in self._priorities:
+            if ( task.gallery != None and regex.match(task.gallery) ):
+                return priority
+        return 0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def put(self, task):
+        """
+        Queue a task, waiting while the window is full.
+        """
+        with self._cond:
+            while ( self._queue_size > 0 and
+                    len(self._keys) >= self._queue_size ):
+                # A timeout keeps KeyboardInterrupt deliverable.
+                self._cond.wait(0.5)
+            self._seq += 1
+            if ( self._order == "largest" ):
+                size = -task.size
+            elif ( self._order == "fifo" ):
+                size = 0
+            else:
+                size = task.size
+            key = (-self.priority(task), size, self._seq)
+            insort(self._keys, key)
+            self._tasks[key] = task
+            self._cond.notify_all()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _next(self):
+        """
+        INTERNAL: Index of the task to hand out next.
+        """
+        if ( self._order != "mixed" ):
+            return 0
+        # The largest task of the highest priority, every other time.
+        self._big_next = not self._big_next
+        if ( not self._big_next ):
+            return 0
+        return bisect_left(self._keys, (self._keys[0][0] + 1,)) - 1
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def get(self):
+        """
+        Take the next task, waiting until there is one that fits within
+        max_bytes.
+
+        Returns: The task, or None once the scheduler is closed and empty.
+        """
+        with self._cond:
+            while ( True ):
+                if ( self._keys != [] ):
+                    index = self._next()
+                    task = self._tasks[self._keys[index]]
+                    if ( self._max_bytes == None or self.in_flight == 0 or
+                         self.in_flight + task.size <= self._max_bytes ):
+                        del self._tasks[self._keys.pop(index)]
+                        self.in_flight += task.size
+                        self._cond.notify_all()
+                        return task
+                    # (With "mixed", the other end is tried next.)
+                elif ( self._closed ):
+                    return None
+                self._cond.wait(0.5)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def task_done(self, task):
+        """
+        Release the bytes of a task that has been uploaded (or failed).
+        """
+        with self._cond:
+            self.in_flight -= task.size
+            self._cond.notify_all()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        """
+        Accept no more tasks; get() returns None once the rest are taken.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
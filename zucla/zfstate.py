@@ -0,0 +1,354 @@
+#    Local record of what has been uploaded, kept in a sqlite database
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# Function list:
+#
+# record_file:                          Remember an uploaded file
+# record_group:                         Remember the group of a directory
+# forget_file:                          Forget a file
+# directory_files:                      Everything known about a directory
+# directory_unchanged:                  Are a directory's files as recorded?
+# has_photo:                            Is a file there, with a photo?
+# group_id:                             Recorded group of a directory
+# cached_hash:                          Look up a content hash
+# record_hash:                          Remember a content hash
+# find_hash:                            Find an uploaded file by content
+# find_moved:                           Find where a moved file came from
+# photo_path:                           Local path recorded for a photo
+# commit:                               Write pending changes
+# close:                                Commit and close the database
+
+import os.path
+import sqlite3
+import time
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ZfState:
+    """
+    A sqlite database recording, for every local file that is known to
+    be on Zenfolio, its size, modification time, inode, content hash
+    (if known) and the Ids of the photo and photoset it was uploaded to.
+
+    Paths are stored as absolute paths so that the database can be used
+    from any working directory.
+
+    A duplicate that was not uploaded (see zfdedupe) is recorded without
+    a photo, with the path of the file whose photo stands in for it.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS files (
+               path TEXT PRIMARY KEY,
+               dir TEXT NOT NULL,
+               size INTEGER NOT NULL,
+               mtime REAL NOT NULL,
+               inode INTEGER NOT NULL,
+               hash TEXT,
+               photo_id INTEGER,
+               photoset_id INTEGER,
+               updated INTEGER NOT NULL,
+               duplicate_of TEXT)""",
+        """CREATE INDEX IF NOT EXISTS files_dir ON files (dir)""",
+        """CREATE INDEX IF NOT EXISTS files_hash ON files (hash)""",
+        """CREATE INDEX IF NOT EXISTS files_inode ON files (inode)""",
+        """CREATE INDEX IF NOT EXISTS files_photo ON files (photo_id)""",
+        """CREATE TABLE IF NOT EXISTS dirs (
+               path TEXT PRIMARY KEY,
+               group_id INTEGER,
+               updated INTEGER NOT NULL)""",
+        """CREATE TABLE IF NOT EXISTS hashes (
+               dev INTEGER NOT NULL,
+               inode INTEGER NOT NULL,
+               size INTEGER NOT NULL,
+               mtime REAL NOT NULL,
+               hash TEXT NOT NULL,
+               PRIMARY KEY (dev, inode, size, mtime))""",
+        ]
+
+    def __init__(self, filename, commit_every=500):
+        """
+        Open (and create, if needed) a state database.
+
+        Parameters:
+        filename: path of the database file.
+        commit_every: number of changes to collect before committing.
+        """
+        self.filename = filename
+        self._commit_every = commit_every
+        self._pending = 0
+        self._db = sqlite3.connect(filename)
+        self._db.text_factory = str
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self._db.execute(statement)
+        # Databases from before duplicates were recorded separately
+        columns = [row[1] for row
+                   in self._db.execute("PRAGMA table_info(files)")]
+        if ( "duplicate_of" not in columns ):
+            self._db.execute("ALTER TABLE files ADD COLUMN duplicate_of TEXT")
+        self._db.commit()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _changed(self):
+        """
+        INTERNAL: Count a change and commit if enough have piled up.
+        """
+        self._pending += 1
+        if ( self._pending >= self._commit_every ):
+            self.commit()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def record_file(self, path, stat, photo_id, photoset_id, hash=None,
+                    duplicate_of=None):
+        """
+        Remember that a file is on Zenfolio.
+
+        Parameters:
+        path: local path of the file.
+        stat: os.stat result for the file, taken before the upload.
+        photo_id: Id of the photo on Zenfolio (None if unknown, or for
+            a duplicate).
+        photoset_id: Id of the photoset that holds the photo.
+        hash: content hash of the file, if known.
+        duplicate_of: for a duplicate that was not uploaded, the path of
+            the file whose photo it uses.
+        """
+        path = os.path.abspath(path)
+        if ( duplicate_of != None ):
+            duplicate_of = os.path.abspath(duplicate_of)
+        # Without a new hash, keep the old one if the file is the same.
+        self._db.execute("INSERT OR REPLACE INTO files " +
+                         "(path, dir, size, mtime, inode, hash, photo_id, " +
+                         "photoset_id, updated, duplicate_of) " +
+                         "VALUES (?, ?, ?, ?, ?, COALESCE(?, " +
+                         "(SELECT hash FROM files WHERE path = ? AND " +
+                         "size = ? AND mtime = ? AND inode = ?)), " +
+                         "?, ?, ?, ?)",
+                         (path, os.path.dirname(path), stat.st_size,
+                          stat.st_mtime, stat.st_ino, hash,
+                          path, stat.st_size, stat.st_mtime, stat.st_ino,
+                          photo_id, photoset_id, int(time.time()),
+                          duplicate_of))
+        self._changed()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def record_group(self, path, group_id):
+        """
+        Remember the group that a local directory was backed up to.
+        """
+        self._db.execute("INSERT OR REPLACE INTO dirs " +
+                         "(path, group_id, updated) VALUES (?, ?, ?)",
+                         (os.path.abspath(path), group_id, int(time.time())))
+        self._changed()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def forget_file(self, path):
+        """
+        Forget a file, for example because its photo was deleted.
+        """
+        self._db.execute("DELETE FROM files WHERE path = ?",
+                         (os.path.abspath(path),))
+        self._changed()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def directory_files(self, path):
+        """
+        Get everything recorded about the files in a directory.
+
+        Returns: dict of file name -> (size, mtime, inode, hash,
+            photo_id, photoset_id, duplicate_of).
+        """
+        rows = self._db.execute("SELECT path, size, mtime, inode, hash, " +
+                                "photo_id, photoset_id, duplicate_of " +
+                                "FROM files WHERE dir = ?",
+                                (os.path.abspath(path),))
+        return dict([(os.path.basename(row[0]), row[1:]) for row in rows])
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def directory_unchanged(self, path, stats):
+        """
+        Check whether every file in a directory is on Zenfolio as it is
+        now, according to the database.
+
+        Parameters:
+        path: local directory.
+        stats: dict of file name -> os.stat result for the files that
+            have to be on Zenfolio.
+
+        Returns: True if every file matches its record in size, mtime
+            and inode, and has a photo (or, for a duplicate, the file it
+            duplicates is still there and has one).
+        """
+        if ( stats == {} ):
+            return False
+        known = self.directory_files(path)
+        for name, stat in stats.iteritems():
+            row = known.get(name)
+            if ( row == None or row[0] != stat.st_size or
+                 row[1] != stat.st_mtime or row[2] != stat.st_ino ):
+                return False
+            if ( row[4] == None and
+                 (row[6] == None or not self.has_photo(row[6])) ):
+                return False
+        return True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def has_photo(self, path):
+        """
+        Check whether a local file is still there and recorded with a
+        photo.
+        """
+        path = os.path.abspath(path)
+        row = self._db.execute("SELECT photo_id FROM files WHERE path = ?",
+                               (path,)).fetchone()
+        return ( row != None and row[0] != None and os.path.exists(path) )
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def group_id(self, path):
+        """
+        Get the Id of the group a local directory was backed up to.
+
+        Returns: The group Id, or None if not recorded.
+        """
+        row = self._db.execute("SELECT group_id FROM dirs WHERE path = ?",
+                               (os.path.abspath(path),)).fetchone()
+        if ( row == None ):
+            return None
+        return row[0]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def cached_hash(self, dev, inode, size, mtime):
+        """
+        Look up the content hash of a file by its identity.
+
+        Returns: The hash, or None if the file has not been hashed as
+            it is now.
+        """
+        row = self._db.execute("SELECT hash FROM hashes WHERE dev = ? " +
+                               "AND inode = ? AND size = ? AND mtime = ?",
+                               (dev, inode, size, mtime)).fetchone()
+        if ( row == None ):
+            return None
+        return row[0]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def record_hash(self, dev, inode, size, mtime, hash):
+        """
+        Remember the content hash of a file.  Older hashes of the same
+        inode are dropped.
+        """
+        self._db.execute("DELETE FROM hashes WHERE dev = ? AND inode = ?",
+                         (dev, inode))
+        self._db.execute("INSERT INTO hashes (dev, inode, size, mtime, hash) " +
+                         "VALUES (?, ?, ?, ?, ?)",
+                         (dev, inode, size, mtime, hash))
+        self._changed()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def find_hash(self, hash, path=None):
+        """
+        Find a file with the given content that is on Zenfolio.
+
+        Parameters:
+        hash: the content hash.
+        path: a file to leave out (usually the one being looked up).
+
+        Returns: (path, photo_id, photoset_id) of the file, or None.
+        """
+        row = self._db.execute("SELECT path, photo_id, photoset_id " +
+                               "FROM files WHERE hash = ? AND path != ? " +
+                               "AND photo_id IS NOT NULL LIMIT 1",
+                               (hash, os.path.abspath(path or ""))).fetchone()
+        if ( row == None ):
+            return None
+        return tuple(row)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def find_moved(self, path, stat, hash=None):
+        """
+        Find the record of a file that has been moved or renamed: one
+        with the same inode, size and modification time (or, if given,
+        the same content hash) that is no longer at its recorded path.
+
+        Parameters:
+        path: where the file is now.
+        stat: os.stat result for the file.
+        hash: content hash of the file, to find copies across file
+            systems, or None.
+
+        Returns: (old path, photo_id, photoset_id), or None.
+        """
+        path = os.path.abspath(path)
+        rows = self._db.execute("SELECT path, photo_id, photoset_id " +
+                                "FROM files WHERE inode = ? AND size = ? " +
+                                "AND mtime = ? AND photo_id IS NOT NULL",
+                                (stat.st_ino, stat.st_size,
+                                 stat.st_mtime)).fetchall()
+        if ( hash != None ):
+            rows += self._db.execute("SELECT path, photo_id, photoset_id " +
+                                     "FROM files WHERE hash = ? AND " +
+                                     "photo_id IS NOT NULL",
+                                     (hash,)).fetchall()
+        for row in rows:
+            if ( row[0] != path and not os.path.exists(row[0]) ):
+                return tuple(row)
+        return None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def photo_path(self, photo_id):
+        """
+        Get the local path recorded for a photo.
+
+        Returns: The path, or None if the photo is not recorded.
+        """
+        row = self._db.execute("SELECT path FROM files WHERE photo_id = ?",
+                               (photo_id,)).fetchone()
+        if ( row == None ):
+            return None
+        return row[0]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def commit(self):
+        """
+        Write pending changes to the database.
+        """
+        self._db.commit()
+        self._pending = 0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        """
+        Commit and close the database.
+        """
+        if ( self._db != None ):
+            self.commit()
+            self._db.close()
+            self._db = None
@@ -0,0 +1,236 @@
+#    Back up very large directories without holding them in memory
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# In streaming mode (--chunk), a directory with more files than the
+# chunk size is never listed as a whole.  Its files are read and backed
+# up a chunk at a time (zfscan.scan_chunks), and its gallery's photos
+# are loaded a page at a time (LoadPhotoSetPhotos) into a PhotoIndex
+# rather than as one photoset snapshot.  The index keeps only what the
+# backup compares (file name, Id, size and hash) and moves itself to a
+# temporary sqlite database once it holds more than max_entries photos,
+# so memory use depends on the chunk size and max_entries rather than on
+# the size of the directory.  Each local file takes its photo out of the
+# index, and whatever is left at the end is what --mirror deletes.
+#
+# The hard ceiling (--max-memory) is a limit on the address space of
+# the process: going over it raises MemoryError instead of swapping.
+# Threads started after it is set get smaller stacks, which would
+# otherwise take up much of the address space.
+#
+# Function list:
+#
+# PhotoIndex:                           Photos of a photoset by file name
+# index_entries:                        max_entries for a memory budget
+# set_memory_limit:                     Cap the address space of the process
+
+from zucla.zflib import ZfLibException
+
+import os
+import sqlite3
+import tempfile
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Rough size of one photo in a PhotoIndex held in memory, in bytes.
+ENTRY_BYTES = 250
+
+# Photos kept in memory by default.
+DEFAULT_ENTRIES = 200000
+
+# Stack size of threads under a memory limit.
+THREAD_STACK = 512 * 1024
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def index_entries(max_memory):
+    """
+    Decide how many photos a PhotoIndex may keep in memory.
+
+    Parameters:
+    max_memory: the memory ceiling in bytes, or None.
+
+    Returns: max_entries for PhotoIndex: an eighth of the ceiling (but
+        at least 1000 photos), or DEFAULT_ENTRIES without a ceiling.
+    """
+    if ( max_memory == None ):
+        return DEFAULT_ENTRIES
+    return max(1000, max_memory / 8 / ENTRY_BYTES)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def set_memory_limit(max_memory):
+    """
+    Limit the address space of this process (and of the processes it
+    starts from now on), and make the stacks of new threads smaller.
+
+    Parameters:
+    max_memory: the limit in bytes.
+
+    Returns: Nothing.  Raises ZfLibException if the system has no such
+        limit or the limit is above the hard limit already in place.
+    """
+    if ( resource == None ):
+        raise ZfLibException("set_memory_limit",
+                             "memory limits are not supported here")
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, hard))
+    except ValueError:
+        raise ZfLibException("set_memory_limit",
+                             "cannot raise the memory limit above " +
+                             str(hard))
+    threading.stack_size(THREAD_STACK)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class PhotoIndex:
+    """
+    The photos of a photoset, by file name, reduced to what a backup
+    compares.  Photos are taken out as their local files are found.
+
+    Attributes:
+    total: number of photos added
+    spilled: True once the index has moved to disk
+    """
+
+    def __init__(self, max_entries=DEFAULT_ENTRIES):
+        """
+        Initialize the index.
+
+        Parameters:
+        max_entries: number of photos to keep in memory before moving
+            to a temporary database.
+        """
+        self._max_entries = max_entries
+        self._photos = {}
+        self._db = None
+        self._filename = None
+        self._count = 0
+
+        self.total = 0
+        self.spilled = False
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def add(self, photo):
+        """
+        Add a photo from a photoset snapshot.  Photos with the same file
+        name are all kept (see pop()).
+        """
+        self.total += 1
+        self._count += 1
+        entry = (photo['Id'], photo.get('Size'), photo.get('FileHash'))
+        if ( self._db != None ):
+            self._db.execute("INSERT INTO photos (name, id, size, hash) " +
+                             "VALUES (?, ?, ?, ?)",
+                             (photo['FileName'],) + entry)
+            return
+        self._photos.setdefault(photo['FileName'], []).append(entry)
+        if ( self._count > self._max_entries ):
+            self._spill()
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _spill(self):
+        """
+        INTERNAL: Move the photos to a temporary database.
+        """
+        fd, self._filename = tempfile.mkstemp(prefix="zucla-", suffix=".db")
+        os.close(fd)
+        self._db = sqlite3.connect(self._filename)
+        self._db.text_factory = str
+        self._db.execute("PRAGMA synchronous = OFF")
+        self._db.execute("""CREATE TABLE photos (
+                                name TEXT,
+                                id INTEGER,
+                                size INTEGER,
+                                hash TEXT)""")
+        self._db.execute("CREATE INDEX photos_name ON photos (name)")
+        self._db.executemany("INSERT INTO photos (name, id, size, hash) " +
+                             "VALUES (?, ?, ?, ?)",
+                             ((name,) + entry for name in sorted(self._photos)
+                              for entry in self._photos[name]))
+        self._photos = {}
+        self.spilled = True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def pop(self, filename):
+        """
+        Take the photos with a file name out of the index.
+
+        Returns: The first of them, as ZfLib.get_photo finds it (a dict
+            with FileName, Id, Size and FileHash), or None if there is
+            no photo with that file name.
+        """
+        if ( self._db != None ):
+            row = self._db.execute("SELECT id, size, hash FROM photos " +
+                                   "WHERE name = ? ORDER BY rowid",
+                                   (filename,)).fetchone()
+            if ( row != None ):
+                cursor = self._db.execute("DELETE FROM photos " +
+                                          "WHERE name = ?", (filename,))
+                self._count -= cursor.rowcount
+        else:
+            rows = self._photos.pop(filename, [])
+            row = ( rows and rows[0] or None )
+            self._count -= len(rows)
+        if ( row == None ):
+            return None
+        return {'FileName': filename, 'Id': row[0], 'Size': row[1],
+                'FileHash': row[2]}
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def remaining(self):
+        """
+        Generate the photos that are still in the index (as pop()
+        returns them), in file name order.
+        """
+        if ( self._db != None ):
+            rows = self._db.execute("SELECT name, id, size, hash " +
+                                    "FROM photos ORDER BY name, rowid")
+        else:
+            rows = ((name,) + entry for name in sorted(self._photos)
+                    for entry in self._photos[name])
+        for name, photo_id, size, digest in rows:
+            yield {'FileName': name, 'Id': photo_id, 'Size': size,
+                   'FileHash': digest}
+
+    def __len__(self):
+        return self._count
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        """
+        Drop the index (and its temporary database).
+        """
+        self._photos = {}
+        if ( self._db != None ):
+            self._db.close()
+            self._db = None
+            os.remove(self._filename)
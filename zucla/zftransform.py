@@ -0,0 +1,345 @@
+#    Resize or recompress images before they are uploaded
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# Uploading full-size originals is a waste when a gallery only needs
+# web-size copies.  A Transformer makes a JPEG copy of each image,
+# scaled down so that its longer side is at most max_size pixels and/or
+# recompressed at a given quality, and the copy is uploaded (under the
+# original file name) instead of the original.
+#
+# Images are transformed in a pool of processes.  As with zfhash.Hasher,
+# files are submitted ahead of time, so that the next files are being
+# transformed while the current one uploads, and result() waits only
+# if a copy is not ready yet.
+#
+# Copies are kept in a cache directory, named after the MD5 of the
+# original and the settings, so a rerun (or a copy of the same picture
+# elsewhere) does no work.  A HashCache remembers the hashes of files
+# that have not changed, so they are not even read again.  If a copy
+# would not be smaller, or the image cannot be read (a RAW file, say),
+# the original is uploaded and that decision is cached too.
+#
+# The Python Imaging Library (PIL or Pillow) is needed, and imported,
+# only when a Transformer is made.
+#
+# Function list:
+#
+# add_arguments:                        Add the transform options to a parser
+# from_args:                            Make a Transformer from the options
+# transform_file:                       Transform one file (in a worker)
+# Transformer:                          Transform files in the background
+
+from zucla.zflib import ZfLibException
+from zucla.zfhash import HashCache, hash_file
+
+import os
+import os.path
+
+# PIL's Image module, imported by the first Transformer (see _import_pil)
+Image = None
+
+DEFAULT_QUALITY = 85
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def add_arguments(parser):
+    """
+    Add the options that control transforming to a command's parser.
+    """
+    parser.add_argument("--resize", action="store", type=int,
+                        metavar="PIXELS",
+                        help="Upload JPEG copies of the images, scaled " + \
+                            "down to at most PIXELS on the longer side.  " + \
+                            "Needs PIL or Pillow.")
+    parser.add_argument("--quality", action="store", type=int,
+                        metavar="Q",
+                        help="Upload JPEG copies of the images " + \
+                            "compressed at quality Q (1-95; default " + \
+                            str(DEFAULT_QUALITY) + " with --resize).")
+    parser.add_argument("--transform-jobs", action="store", type=int,
+                        dest="transform_jobs", metavar="N",
+                        help="With --resize or --quality, transform " + \
+                            "with N processes (default: one per CPU).")
+    parser.add_argument("--transform-cache", action="store",
+                        dest="transform_cache", metavar="DIR",
+                        help="With --resize or --quality, keep the " + \
+                            "copies in DIR (default " + \
+                            "~/.cache/zucla/transformed).")
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def from_args(args, hash_cache=None):
+    """
+    Make a Transformer from the options added by add_arguments.
+
+    Parameters:
+    args: the parsed arguments.
+    hash_cache: a HashCache to share, or None.
+
+    Returns: A Transformer, or None if no transform was asked for.
+        Raises ZfLibException if the options are not valid or PIL is
+        missing.
+    """
+    if ( args.resize == None and args.quality == None ):
+        return None
+    if ( args.resize != None and args.resize < 1 ):
+        raise ZfLibException("from_args", "--resize must be at least 1")
+    quality = args.quality or DEFAULT_QUALITY
+    if ( quality < 1 or quality > 95 ):
+        raise ZfLibException("from_args", "--quality must be 1 to 95")
+    return Transformer(args.resize, quality, args.transform_jobs,
+                       args.transform_cache, hash_cache)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _import_pil():
+    """
+    INTERNAL: Import PIL on first use; it is slow to load.
+
+    Returns: True if PIL is available.
+    """
+    global Image
+    if ( Image == None ):
+        try:
+            from PIL import Image
+        except ImportError:
+            return False
+    return True
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _cache_names(cache_dir, digest, max_size, quality):
+    """
+    INTERNAL: Paths of the cached copy of a file, and of the marker
+    that says the original is to be used.
+    """
+    base = os.path.join(cache_dir, "{:s}-{:d}-q{:d}".format(
+        digest, max_size or 0, quality))
+    return (base + ".jpg", base + ".orig")
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def transform_file(path, digest, cache_dir, max_size, quality):
+    """
+    Make the copy of a file to upload, unless it is cached.  Runs in a
+    worker process.
+
+    Parameters:
+    path: the original.
+    digest: its MD5 hex digest, or None to compute it.
+    cache_dir: the cache directory.
+    max_size: longest side of the copy in pixels, or None.
+    quality: JPEG quality of the copy.
+
+    Returns: (digest, copy, made): the digest of the original, the path
+        of the copy (None if the original is to be uploaded) and
+        whether the copy was made now rather than found in the cache.
+    """
+    if ( digest == None ):
+        digest = hash_file(path)
+    out_path, orig_path = _cache_names(cache_dir, digest, max_size, quality)
+    if ( os.path.exists(out_path) ):
+        return (digest, out_path, False)
+    if ( os.path.exists(orig_path) ):
+        return (digest, None, False)
+
+    temp_path = "{:s}.{:d}.tmp".format(out_path, os.getpid())
+    try:
+        image = Image.open(path)
+        extra = {}
+        if ( image.info.get('exif') ):
+            extra['exif'] = image.info['exif']
+        if ( max_size != None and max(image.size) > max_size ):
+            image.thumbnail((max_size, max_size), Image.ANTIALIAS)
+        if ( image.mode not in ("RGB", "L") ):
+            image = image.convert("RGB")
+        image.save(temp_path, "JPEG", quality=quality, optimize=True,
+                   **extra)
+    except (IOError, ValueError, SyntaxError):
+        # Not something PIL can read (or write as JPEG)
+        if ( os.path.exists(temp_path) ):
+            os.remove(temp_path)
+        open(orig_path, 'w').close()
+        return (digest, None, True)
+
+    if ( os.path.getsize(temp_path) >= os.path.getsize(path) ):
+        os.remove(temp_path)
+        open(orig_path, 'w').close()
+        return (digest, None, True)
+    os.rename(temp_path, out_path)
+    return (digest, out_path, True)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Transformer:
+    """
+    Make the copies of images to upload in a pool of processes.
+
+    Attributes:
+    transformed: number of copies made
+    cached: number of copies (or decisions to use the original) found
+        in the cache
+    kept: number of files for which the original is used
+    saved_bytes: how much smaller the copies are than the originals
+    """
+
+    def __init__(self, max_size=None, quality=DEFAULT_QUALITY, jobs=None,
+                 cache_dir=None, hash_cache=None):
+        """
+        Initialize the transformer.
+
+        Parameters:
+        max_size: longest side of the copies in pixels, or None to
+            keep the size.
+        quality: JPEG quality of the copies.
+        jobs: number of processes (default: one per CPU).
+        cache_dir: where to keep the copies (default:
+            ~/.cache/zucla/transformed).
+        hash_cache: a HashCache for the hashes of the originals, or
+            None for a private in-memory cache.
+        """
+        import multiprocessing
+
+        if ( not _import_pil() ):
+            raise ZfLibException("Transformer",
+                                 "resizing images needs PIL or Pillow")
+        if ( cache_dir == None ):
+            cache_dir = os.path.expanduser("~/.cache/zucla/transformed")
+        if ( not os.path.isdir(cache_dir) ):
+            try:
+                os.makedirs(cache_dir)
+            except OSError as e:
+                raise ZfLibException("Transformer", cache_dir + ": " +
+                                     e.strerror)
+        if ( hash_cache == None ):
+            hash_cache = HashCache()
+        self._max_size = max_size
+        self._quality = quality
+        self._cache_dir = cache_dir
+        self._hashes = hash_cache
+        self._pool = multiprocessing.Pool(jobs)
+        self._pending = {}
+        self._results = {}
+
+        self.transformed = 0
+        self.cached = 0
+        self.kept = 0
+        self.saved_bytes = 0
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _cached(self, stat):
+        """
+        INTERNAL: Look for the copy of an unchanged file in the cache.
+
+        Returns: (found, copy): whether the cache decides it, and the
+            path of the copy (None to upload the original).
+        """
+        digest = self._hashes.get(stat)
+        if ( digest == None ):
+            return (False, None)
+        out_path, orig_path = _cache_names(self._cache_dir, digest,
+                                           self._max_size, self._quality)
+        if ( os.path.exists(out_path) ):
+            return (True, out_path)
+        if ( os.path.exists(orig_path) ):
+            return (True, None)
+        return (False, None)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def submit(self, files):
+        """
+        Start making copies.
+
+        Parameters:
+        files: list of (path, stat) tuples.
+        """
+        for path, stat in files:
+            if ( path in self._pending or path in self._results ):
+                continue
+            if ( self._cached(stat)[0] ):
+                continue
+            self._pending[path] = self._pool.apply_async(
+                transform_file, (path, self._hashes.get(stat),
+                                 self._cache_dir, self._max_size,
+                                 self._quality))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def result(self, path, stat):
+        """
+        Get the file to upload in place of an original, waiting for the
+        copy if it is still being made and making it if it was never
+        submitted.
+
+        Parameters:
+        path: the original.
+        stat: os.stat result for the original.
+
+        Returns: (path, size) of the file to upload: the copy, or the
+            original itself.
+        """
+        result = self._results.get(path)
+        if ( result != None and result[0] == stat ):
+            return result[1]
+
+        pending = self._pending.pop(path, None)
+        found = False
+        if ( pending == None ):
+            found, out_path = self._cached(stat)
+        if ( found ):
+            self.cached += 1
+        else:
+            if ( pending == None ):
+                pending = self._pool.apply_async(
+                    transform_file, (path, self._hashes.get(stat),
+                                     self._cache_dir, self._max_size,
+                                     self._quality))
+            # A timeout keeps KeyboardInterrupt deliverable while waiting.
+            digest, out_path, made = pending.get(86400)
+            self._hashes.put(stat, digest)
+            if ( not made ):
+                self.cached += 1
+            elif ( out_path != None ):
+                self.transformed += 1
+
+        if ( out_path == None ):
+            self.kept += 1
+            upload = (path, stat.st_size)
+        else:
+            upload = (out_path, os.path.getsize(out_path))
+            self.saved_bytes += stat.st_size - upload[1]
+        # Remember only the last few, for the size check and upload of
+        # the same file.
+        if ( len(self._results) > 64 ):
+            self._results.clear()
+        self._results[path] = (stat, upload)
+        return upload
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        self._pending = {}
+        self._pool.terminate()
+        self._pool.join()
@@ -0,0 +1,368 @@
+#    Compare a local tree with Zenfolio without changing anything
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# A verification walks the local tree and compares each directory with
+# its gallery, using the same rules as a backup (see zfdiff.diff_tree):
+# every local image should have a photo of the same size, and every
+# photo a local image.  The backup's filter rules and --resize/--quality
+# settings are given again: files and directories the rules leave out
+# are neither missing nor extra, and an image's size is that of the
+# copy that was uploaded (found in the transform cache).
+#
+# The group hierarchy is loaded once and looked up through the element
+# index; the galleries are loaded by several worker threads, each on
+# its own connection.  At most a few galleries per
+# worker are waiting or loaded at any time, so memory use does not grow
+# with the size of the tree.
+#
+# Only problems are kept.  The report is a dict that can be written as
+# JSON, with a list for each kind of problem and the totals.
+#
+# Function list:
+#
+# VerifyReport:                         What a verification found
+# Verifier:                             Compare a tree with Zenfolio
+
+from zucla.zfapi import ZfAPIException
+from zucla.zflib import ZfLibException
+from zucla import zfdiff
+
+import httplib
+import json
+import os
+import os.path
+import threading
+import time
+import Queue
+
+# Kinds of problems, in report order.
+PROBLEMS = ["missing_groups", "missing_galleries", "missing_files",
+            "size_mismatches", "extra_photos", "extra_galleries", "errors"]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class VerifyReport:
+    """
+    What a verification found.
+
+    Attributes:
+    directories: number of local directories compared
+    files: number of local image files compared
+    photos: number of photos in the galleries loaded
+    ok: number of image files whose photo matches
+    complete: False if the verification stopped before the end
+    problems: dict of kind (see PROBLEMS) -> list of dicts
+    """
+
+    def __init__(self, local_root, zf_root):
+        self.local_root = local_root
+        self.zf_root = zf_root
+        self.started = time.time()
+        self.finished = None
+        self.directories = 0
+        self.files = 0
+        self.photos = 0
+        self.ok = 0
+        self.complete = True
+        self.problems = dict([(kind, []) for kind in PROBLEMS])
+
+    def add(self, kind, **details):
+        self.problems[kind].append(details)
+
+    def count(self):
+        """
+        Returns: The number of problems found.
+        """
+        return sum([len(found) for found in self.problems.values()])
+
+    def as_dict(self):
+        """
+        Returns: The report as a dict of JSON-compatible values.
+        """
+        report = {'local_path': os.path.abspath(self.local_root),
+                  'group_path': self.zf_root,
+                  'started': int(self.started),
+                  'finished': self.finished and int(self.finished),
+                  'seconds': round((self.finished or time.time()) -
+                                   self.started, 1),
+                  'complete': self.complete,
+                  'totals': {'directories': self.directories,
+                             'files': self.files,
+                             'photos': self.photos,
+                             'ok': self.ok}}
+        for kind in PROBLEMS:
+            report['totals'][kind] = len(self.problems[kind])
+            report[kind] = self.problems[kind]
+        return report
+
+    def write(self, filename):
+        """
+        Save the report as JSON.  The file is replaced only once the
+        report is complete, so a reader never sees half a report.
+        """
+        temp_name = filename + ".tmp"
+        report_file = open(temp_name, 'w')
+        try:
+            json.dump(self.as_dict(), report_file, indent=1, sort_keys=True)
+        finally:
+            report_file.close()
+        os.rename(temp_name, filename)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Verifier:
+    """
+    Compare a local tree with Zenfolio, loading galleries with several
+    worker threads.
+    """
+
+    def __init__(self, session, jobs=8, deadline=None, show=None,
+                 transformer=None, rules=None):
+        """
+        Initialize the verifier.
+
+        Parameters:
+        session: an authenticated ZfLib (used from the caller's thread
+            only).
+        jobs: number of galleries loaded at a time.
+        deadline: time.time() after which no more directories are
+            compared, or None.
+        show: function(kind, details) called for each problem as it is
+            found, or None.
+        transformer: the zftransform.Transformer of the backup's
+            --resize/--quality, or None.
+        rules: the zffilter.FilterRules that the walk was given, or
+            None; galleries of the directories they leave out are not
+            extra.
+        """
+        self._session = session
+        self._transformer = transformer
+        self._rules = rules
+        self._jobs = max(1, jobs)
+        self._deadline = deadline
+        self._show = show
+        self._work = Queue.Queue(self._jobs * 4)
+        self._results = Queue.Queue()
+        self._pending = 0
+        self._index = None
+        self._report = None
+        self._zf_root = None
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run(self, walker, local_root, zf_root):
+        """
+        Compare a tree.
+
+        Parameters:
+        walker: generator of zfscan.ScanDir for the local tree.
+        local_root: the local path being verified.
+        zf_root: Zenfolio path that the local root maps to.
+
+        Returns: A VerifyReport.
+        """
+        self._zf_root = zfdiff.zf_path_for(zf_root, "")
+        self._index = self._session.element_index()
+        if ( self._index == None ):
+            raise ZfLibException("Verifier.run",
+                                 "Could not load the group hierarchy")
+        self._report = VerifyReport(local_root, self._zf_root)
+        seen = set()
+
+        threads = []
+        for i in range(self._jobs):
+            thread = threading.Thread(target=self._worker,
+                                      name="verify-%d" % i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            for scan_dir in walker:
+                if ( self._deadline != None and
+                     time.time() > self._deadline ):
+                    self._report.complete = False
+                    break
+                rpath = os.path.relpath(scan_dir.path, local_root)
+                if ( rpath == "." ):
+                    rpath = ""
+                if ( self._transformer != None ):
+                    # Have the whole directory transformed at once.
+                    self._transformer.submit(
+                        [(os.path.join(scan_dir.path, name), stat)
+                         for name, stat in scan_dir.images.iteritems()])
+                images = dict([(name, (self._size(scan_dir, name, stat),
+                                       stat.st_mtime))
+                               for name, stat
+                               in scan_dir.images.iteritems()])
+                local_dir = zfdiff.LocalDir(rpath, list(scan_dir.dirs),
+                                            images,
+                                            excluded=scan_dir.excluded)
+                zf_path = zfdiff.zf_path_for(self._zf_root, rpath)
+                seen.add(zf_path)
+
+                element = self._index.get((zf_path, "PhotoSet"))
+                if ( element == None ):
+                    self._compare(local_root, local_dir, zf_path, None)
+                else:
+                    # Blocks while the workers are behind.
+                    self._put((local_dir, zf_path, element['Id']))
+                self._drain(local_root, False)
+            self._drain(local_root, True)
+        finally:
+            for thread in threads:
+                self._work.put(None)
+
+        if ( self._report.complete ):
+            prefix = self._zf_root.rstrip("/") + "/"
+            for (path, etype) in sorted(self._index):
+                if ( etype == "PhotoSet" and path not in seen and
+                     path.startswith(prefix) and
+                     (self._rules == None or
+                      not self._rules.in_pruned_dir(path[len(prefix):])) ):
+                    self._problem("extra_galleries", gallery=path)
+        self._report.finished = time.time()
+        return self._report
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _put(self, item):
+        """
+        INTERNAL: Queue a gallery for the workers, waiting with a
+        timeout so that KeyboardInterrupt gets through.
+        """
+        while ( True ):
+            try:
+                self._work.put(item, True, 0.5)
+                self._pending += 1
+                return
+            except Queue.Full:
+                pass
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _drain(self, local_root, wait):
+        """
+        INTERNAL: Compare the directories whose galleries have been
+        loaded; with wait, until none are left.
+        """
+        while ( self._pending > 0 ):
+            try:
+                item = self._results.get(wait, 0.5)
+            except Queue.Empty:
+                if ( wait ):
+                    continue
+                return
+            self._pending -= 1
+            local_dir, zf_path, photoset, error = item
+            if ( error != None ):
+                self._report.directories += 1
+                self._problem("errors", gallery=zf_path, message=error)
+            else:
+                self._compare(local_root, local_dir, zf_path, photoset)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _size(self, scan_dir, name, stat):
+        """
+        INTERNAL: The size that the photo of a local image should have.
+        """
+        if ( self._transformer == None ):
+            return stat.st_size
+        return self._transformer.result(os.path.join(scan_dir.path, name),
+                                        stat)[1]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _compare(self, local_root, local_dir, zf_path, photoset):
+        """
+        INTERNAL: Compare a directory with its gallery (None if there
+        is none) and record the differences.
+        """
+        report = self._report
+        report.directories += 1
+        report.files += len(local_dir.images)
+        snapshots = {}
+        if ( photoset != None ):
+            report.photos += len(photoset['Photos'])
+            snapshots[zf_path] = photoset
+
+        tree = zfdiff.LocalTree(local_root)
+        tree.add(local_dir)
+        changes = zfdiff.diff_tree(tree, self._zf_root, self._index,
+                                   snapshots, True)
+        report.ok += changes.unchanged
+        for path in changes.groups:
+            self._problem("missing_groups", group=path)
+        for path in changes.galleries:
+            self._problem("missing_galleries", gallery=path,
+                          path=tree.local_path(local_dir.rpath),
+                          files=len(local_dir.images))
+        for path, gallery, size in changes.add:
+            self._problem("missing_files", path=path, gallery=gallery,
+                          size=size)
+        for path, gallery, size, photo in changes.replace:
+            self._problem("size_mismatches", path=path, gallery=gallery,
+                          size=size, remote_size=photo['Size'],
+                          photo_id=photo['Id'])
+        for gallery, photo in changes.delete:
+            self._problem("extra_photos", gallery=gallery,
+                          file_name=photo['FileName'], photo_id=photo['Id'],
+                          size=photo.get('Size'))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _problem(self, kind, **details):
+        """
+        INTERNAL: Record (and show) a problem.
+        """
+        self._report.add(kind, **details)
+        if ( self._show != None ):
+            self._show(kind, details)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _worker(self):
+        """
+        INTERNAL: Load galleries until told to stop.
+        """
+        api = self._session.clone()
+        while ( True ):
+            item = self._work.get()
+            if ( item == None ):
+                break
+            local_dir, zf_path, photoset_id = item
+            photoset = None
+            error = None
+            # One more try on a new connection if the first one fails.
+            for attempt in range(2):
+                try:
+                    photoset = api.LoadPhotoSet(photoset_id, "Level2",
+                                                "True")
+                    error = None
+                    if ( photoset == None ):
+                        error = "Could not load the gallery"
+                    break
+                except (ZfAPIException, IOError, ValueError,
+                        httplib.HTTPException) as e:
+                    error = ( getattr(e, "msg", None) or str(e) or
+                              e.__class__.__name__ )
+                    api._open_connection()
+            self._results.put((local_dir, zf_path, photoset, error))
@@ -0,0 +1,289 @@
+#    Watch a directory tree for new image files with Linux inotify
+#
+#    For more information, see http://github.com/bryanmason/ZUCLA
+#
+#    Copyright (c) 2011-2013 Bryan Mason
+#
+#    This file is part of ZUCLA.
+#
+#    ZUCLA is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+#
+#    ZUCLA uses the public ZenfolioAPI documented at
+#    http://www.zenfolio.com/zf/tools/api.aspx.  ZUCLA and Zenfolio are
+#    not affiliated and Zenfiolio does not endorse the use of ZUCLA to
+#    access the Zenfiolo service.
+#
+###############################################################################
+#
+# inotify is called through ctypes, so nothing outside the standard
+# library is needed; on systems without it, Inotify() raises
+# ZfLibException.
+#
+# An image file becomes "ready" once nothing has happened to it for a
+# settle time, so files that are still being copied in are not uploaded
+# half-written.  Directories that appear are watched at once and the
+# image files already in them are treated as new.  If the kernel's event
+# queue overflows, events have been lost and the caller should rescan.
+#
+# Function list:
+#
+# Inotify:                              Thin wrapper around inotify(7)
+# TreeWatcher:                          Collect new image files in a tree
+
+from zucla.zflib import ZfLibException
+from zucla import zffilter
+from zucla import zfscan
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import os.path
+import select
+import struct
+import time
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct("iIII")
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Inotify:
+    """
+    An inotify instance.
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        try:
+            self._libc = ctypes.CDLL(libc_name, use_errno=True)
+            self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise ZfLibException("Inotify", "inotify is not available")
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if ( self._fd < 0 ):
+            e = ctypes.get_errno()
+            raise ZfLibException("Inotify", "inotify_init1: " +
+                                 os.strerror(e))
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, path, mask):
+        """
+        Watch a path.
+
+        Returns: The watch descriptor, or -1 (for example, if the path
+            is gone or the watch limit has been reached).
+        """
+        return self._libc.inotify_add_watch(self._fd, path, mask)
+
+    def read_events(self, timeout):
+        """
+        Wait for events.
+
+        Parameters:
+        timeout: longest time to wait, in seconds.
+
+        Returns: A list of (wd, mask, cookie, name) tuples, empty if
+            nothing happened before the timeout.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if ( ready == [] ):
+            return []
+        try:
+            data = os.read(self._fd, 65536)
+        except OSError as e:
+            if ( e.errno == errno.EAGAIN ):
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while ( offset + _EVENT.size <= len(data) ):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip("\0")
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        if ( self._fd >= 0 ):
+            os.close(self._fd)
+            self._fd = -1
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class TreeWatcher:
+    """
+    Watch every directory of a tree and collect the image files that
+    are created, written or moved into it.
+
+    Attributes:
+    overflowed: True if events may have been lost since the last
+        rescan; the caller resets it.
+    """
+
+    WATCH_MASK = ( IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE |
+                   IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR )
+
+    def __init__(self, root, settle=2.0, rules=None):
+        """
+        Start watching a tree.
+
+        Parameters:
+        root: the directory to watch.
+        settle: seconds a file must be left alone before it is ready.
+        rules: zffilter.FilterRules deciding what to leave out, or None.
+        """
+        self._inotify = Inotify()
+        self._root = root
+        self._settle = settle
+        self._rules = rules
+        self._paths = {}
+        self._pending = {}
+
+        self.overflowed = False
+
+        self.add_tree(root)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def add_tree(self, path, new=False):
+        """
+        Watch a directory and everything below it.
+
+        Parameters:
+        path: the directory.
+        new: the directory just appeared, so its image files are new too.
+        """
+        now = time.time()
+        for scan_dir in zfscan.walk(path, 1, self._rules, self._root):
+            wd = self._inotify.add_watch(scan_dir.path, self.WATCH_MASK)
+            if ( wd < 0 ):
+                # Out of watches; only a rescan will find files here.
+                self.overflowed = True
+                continue
+            self._paths[wd] = scan_dir.path
+            if ( new ):
+                for name in scan_dir.images:
+                    self._pending[os.path.join(scan_dir.path, name)] = now
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def wait(self, timeout):
+        """
+        Wait for changes in the tree and take note of them.
+
+        Parameters:
+        timeout: longest time to wait, in seconds.
+
+        Returns: Nothing
+        """
+        events = self._inotify.read_events(timeout)
+        now = time.time()
+        for wd, mask, cookie, name in events:
+            if ( mask & IN_Q_OVERFLOW ):
+                self.overflowed = True
+                continue
+            parent = self._paths.get(wd)
+            if ( parent == None ):
+                continue
+            if ( mask & IN_IGNORED ):
+                del self._paths[wd]
+                continue
+            if ( mask & IN_MOVE_SELF ):
+                # The paths of everything below it are stale now.
+                self.overflowed = True
+                continue
+            if ( mask & IN_DELETE_SELF ):
+                continue
+
+            path = os.path.join(parent, name)
+            if ( path in self._pending ):
+                self._pending[path] = now
+            elif ( mask & IN_ISDIR ):
+                if ( mask & (IN_CREATE | IN_MOVED_TO) and
+                     not self.skip(parent, name, True) ):
+                    self.add_tree(path, True)
+            elif ( zfscan.is_image_name(name) and
+                   not self.skip(parent, name, False) ):
+                self._pending[path] = now
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def skip(self, parent, name, is_dir):
+        """
+        INTERNAL: Do the rules leave out a new file or directory?
+        """
+        if ( self._rules == None ):
+            return False
+        rel_dir = zffilter.relative_dir(parent, self._root)
+        if ( is_dir ):
+            return self._rules.prune_dir(rel_dir, name)
+        return self._rules.skip_name(rel_dir, name)
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def next_deadline(self):
+        """
+        Returns: The time at which the next pending file will be ready,
+            or None if nothing is pending.
+        """
+        if ( self._pending == {} ):
+            return None
+        return min(self._pending.itervalues()) + self._settle
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def ready(self):
+        """
+        Take the files that have settled, grouped by directory.
+
+        Returns: dict of directory -> {file name: os.stat result}.
+        """
+        now = time.time()
+        batches = {}
+        for path, changed in self._pending.items():
+            if ( now - changed < self._settle ):
+                continue
+            del self._pending[path]
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Gone again (a temporary file, for example)
+                continue
+            if ( self._rules != None and self._rules.skip_stat(stat) ):
+                continue
+            directory, name = os.path.split(path)
+            batches.setdefault(directory, {})[name] = stat
+        return batches
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        """
+        Stop watching.
+        """
+        self._inotify.close()
+        self._paths = {}
+        self._pending = {}